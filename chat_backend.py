@@ -1,11 +1,20 @@
+import asyncio
+import copy
 import json
 import os
-import re
 import shutil
 import logging
+import threading
+import time
 from datetime import datetime
 import ollama
+import chat_journal
+import file_lock
+import context_window
+import profiles
+import write_behind
 from ollama import chat_with_ollama
+from markup_formatter import italics_to_bold
 
 logging.basicConfig(level=logging.DEBUG) # DEBUG, INFO, WARNING, ERROR, CRITICAL
 
@@ -16,6 +25,32 @@ LAST_CHAT_FILE = "last_chat.json"
 BACKUP_FOLDER = "backup"
 BACKUP_CHAT_FOLDER = "backup/chat_data"
 
+# Storage backend: "file" (JSON files under chat_data/) or "sqlite"
+STORAGE_BACKEND = os.environ.get("CHAT_STORAGE_BACKEND", "file")
+DATABASE_FILE = os.environ.get("CHAT_DATABASE_FILE", os.path.join(CHAT_FOLDER, "chats.db"))
+_storage = None
+
+# Characters whose summary is being refreshed in the background
+_summaries_in_progress = set()
+_summaries_lock = threading.Lock()
+# Latest prompt prefix to warm per character, and characters with a warmup running
+_warmups_pending = {}
+_warmups_running = set()
+_warmups_lock = threading.Lock()
+# Messages waiting for the background writer, per character
+_pending_appends = {}
+_appends_lock = threading.Lock()
+
+# Messages loaded when a chat is opened, and per "Load earlier" page
+HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE", "50"))
+
+# Read-through cache of metadata and the character list (file backend). An entry is
+# re-validated against its file's mtime and size at most every CACHE_CHECK_INTERVAL
+# seconds, so outside edits show up after that; this module's own writes update it at once.
+CACHE_CHECK_INTERVAL = float(os.environ.get("CHAT_CACHE_CHECK_INTERVAL", "2"))
+_cache = {}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
 
 # Ensure folder exists
 os.makedirs(CHAT_FOLDER, exist_ok=True)
@@ -23,34 +58,104 @@ os.makedirs(BACKUP_FOLDER, exist_ok=True)
 os.makedirs(BACKUP_CHAT_FOLDER, exist_ok=True)
 
 # ------------------------
-# Utilities
+# Storage backend
 # ------------------------
 
-def italics_to_bold(text: str) -> str:
-    """
-    Converts action-style markup to bold-italic text.
+def get_storage():
+    """Return the SQLite storage when selected, or None for the file backend."""
+    global _storage
+    if STORAGE_BACKEND != "sqlite":
+        return None
+    if _storage is None:
+        import sqlite_storage
+        _storage = sqlite_storage.SqliteStorage(DATABASE_FILE, CHAT_FOLDER, BACKUP_CHAT_FOLDER)
+        if not _storage.list_characters():
+            logging.info("SQLite storage is empty, importing " + CHAT_FOLDER)
+            _storage.import_chat_data(CHAT_FOLDER, LAST_CHAT_FILE)
+    return _storage
+
+def set_storage_backend(backend: str, database_file: str = None):
+    """Switch between the "file" and "sqlite" backends at runtime."""
+    global STORAGE_BACKEND, DATABASE_FILE, _storage
+    STORAGE_BACKEND = backend
+    if database_file:
+        DATABASE_FILE = database_file
+    _storage = None
+    return get_storage()
 
-    Supported action formatting:
-    - *text* or _text_
-    - (text)
-    - [text]
-    """
-    if not isinstance(text, str):
-        return text
+# ------------------------
+# Metadata and character list cache
+# ------------------------
 
-    text = re.sub(r'(?<!\*)\*(?!\*)(.*?)\*(?!\*)', r'***\1***', text)  # *text*
-    text = re.sub(r'_(.*?)_', r'***\1***', text)  # _text_
-    text = re.sub(r'\(([^)]+)\)', r'***\1***', text)
-    text = re.sub(r'\[([^\]]+)\]', r'***\1***', text)
-    return text
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _cached_read(key, path, read):
+    """read()'s value for path, reused while the file's mtime and size stay the same. Callers get a copy."""
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and now - entry["checked"] < CACHE_CHECK_INTERVAL:
+            _cache_stats["hits"] += 1
+            return copy.deepcopy(entry["value"])
+
+    signature = _signature(path)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry["signature"] == signature:
+            entry["checked"] = now
+            _cache_stats["hits"] += 1
+            return copy.deepcopy(entry["value"])
+
+    # The signature is taken before reading, so a change during the read is caught next time
+    value = read()
+    with _cache_lock:
+        _cache[key] = {"signature": signature, "checked": now, "value": copy.deepcopy(value)}
+        _cache_stats["misses"] += 1
+    return value
+
+def _cache_store(key, path, value):
+    """Record a value this module just wrote to path."""
+    with _cache_lock:
+        _cache[key] = {"signature": _signature(path), "checked": time.monotonic(), "value": copy.deepcopy(value)}
+
+def _cache_invalidate(*keys):
+    with _cache_lock:
+        for key in keys:
+            if _cache.pop(key, None) is not None:
+                _cache_stats["invalidations"] += 1
+
+def cache_stats():
+    with _cache_lock:
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+        return dict(_cache_stats, entries=len(_cache), hit_rate=_cache_stats["hits"] / lookups if lookups else 0.0)
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        for field in _cache_stats:
+            _cache_stats[field] = 0
+
+def _list_character_folders():
+    # A folder added or removed changes the mtime of CHAT_FOLDER
+    def read():
+        return [name for name in os.listdir(CHAT_FOLDER) if os.path.isdir(os.path.join(CHAT_FOLDER, name))]
+    return _cached_read(("characters",), CHAT_FOLDER, read)
 
+# ------------------------
+# Utilities
+# ------------------------
 
 def get_character_list():
     logging.debug("get_character_list")
-    return [
-        name for name in os.listdir("chat_data")
-        if os.path.isdir(os.path.join("chat_data", name))
-    ]
+    storage = get_storage()
+    if storage is not None:
+        return storage.list_characters()
+    return _list_character_folders()
 
 # ------------------------
 # Index management
@@ -58,18 +163,22 @@ def get_character_list():
 
 def load_characters_list():
     logging.debug("Retrieving all characters list")
+    storage = get_storage()
+    if storage is not None:
+        return storage.list_characters()
     if not os.path.exists(CHAT_FOLDER):
         logging.critical("Chat data does not exist!")
         return {}
     try:
-        characters = [name for name in os.listdir(CHAT_FOLDER)
-           if os.path.isdir(os.path.join(CHAT_FOLDER, name))]
-        return characters
+        return _list_character_folders()
     except Exception as ex:
         logging.critical("Failed trying to load characters folders! " + ex)
 
 def load_index():
     logging.debug("Retrieving all characters info...")
+    storage = get_storage()
+    if storage is not None:
+        return storage.load_index()
     if not os.path.exists(INDEX_FILE):
         logging.critical("Index file does not exist!")
         return {}
@@ -82,17 +191,30 @@ def load_index():
 
 def save_index(name, character_info, index=None):
     logging.debug("Saving info of character: ", name)
-    if index is None:
-        index = load_index()
-    index[name] = character_info
-    with open(INDEX_FILE, "w", encoding="utf-8") as f:
-        json.dump(index, f, indent=2)
+    storage = get_storage()
+    if storage is not None:
+        storage.save_index(name, character_info)
+        return
+    # Re-read under the lock: another session or process may have changed other entries
+    with file_lock.locked(INDEX_FILE + ".lock"):
+        fresh = load_index() or {}
+        fresh[name] = character_info
+        write_behind.write_json_atomic(INDEX_FILE, fresh, indent=2)
+    if index is not None:
+        index.clear()
+        index.update(fresh)
 
 def remove_from_index(name, index):
     logging.debug("Removing character from index: ", name)
-    del index[name]
-    with open(INDEX_FILE, "w", encoding="utf-8") as f:
-        json.dump(index, f, indent=2)
+    storage = get_storage()
+    if storage is not None:
+        storage.remove_from_index(name)
+        index.pop(name, None)
+        return index
+    with file_lock.locked(INDEX_FILE + ".lock"):
+        index = load_index() or {}
+        index.pop(name, None)
+        write_behind.write_json_atomic(INDEX_FILE, index, indent=2)
     return index
 
 # ------------------------
@@ -101,11 +223,18 @@ def remove_from_index(name, index):
 
 def save_last_chat_name(name: str):
     logging.debug("Saving last chat of: ", name)
-    try:
-        with open(LAST_CHAT_FILE, "w", encoding="utf-8") as f:
-            json.dump({"last_chat": name}, f)
-    except Exception as ex:
-        logging.critical("Failed to save last chat!")
+    storage = get_storage()
+    if storage is not None:
+        storage.save_last_chat_name(name)
+        return
+
+    # Written in the background; switching chats quickly only writes the last one
+    def write():
+        try:
+            write_behind.write_json_atomic(LAST_CHAT_FILE, {"last_chat": name})
+        except Exception as ex:
+            logging.critical("Failed to save last chat!")
+    write_behind.submit(("last_chat",), write)
 
 def reset_last_chat_name(default_chat="Default Chat"):
     save_last_chat_name(default_chat)
@@ -113,6 +242,10 @@ def reset_last_chat_name(default_chat="Default Chat"):
 
 def load_last_chat_name():
     logging.debug("load_last_chat_name")
+    write_behind.wait(("last_chat",))
+    storage = get_storage()
+    if storage is not None:
+        return storage.load_last_chat_name()
     if os.path.exists(LAST_CHAT_FILE):
         logging.debug("Last chat file exists!")
         try:
@@ -141,6 +274,11 @@ def get_metadata_file_path(name: str):
     logging.debug("Getting metadata path for: "+ name)
     return os.path.join(character_folder, "metadata.json")
 
+def get_summary_file_path(name: str):
+    """Return the path to the rolling summary file for this character."""
+    character_folder = os.path.join(CHAT_FOLDER, name)
+    return os.path.join(character_folder, "summary.json")
+
 def get_avatar_file_path(name: str):
     """Return the path to the avatar file for this character."""
     character_folder = os.path.join(CHAT_FOLDER, name)
@@ -162,35 +300,44 @@ def new_metadata(name, system_prompt):
     
 def get_metadata(name: str):
     logging.debug("Getting metadata for: "+ name)
+    write_behind.wait(("chat", name))
+    storage = get_storage()
+    if storage is not None:
+        return storage.get_metadata(name)
+    metadata = _read_metadata(name)
+    if metadata is None:
+        logging.critical("Metadata not found for character: " + name)
+    return metadata
+
+def _read_metadata(name: str):
+    """Metadata of a character from the cache or metadata.json; None if there is none."""
     metadata_path = get_metadata_file_path(name)
-    logging.debug("Metadata path: " + metadata_path)
-    metadata = None
 
-    if os.path.exists(metadata_path):
+    def read():
+        if not os.path.exists(metadata_path):
+            return None
         with open(metadata_path, "r", encoding="utf-8") as f:
-            logging.debug("Getting metadata from character: " + name)
-            metadata = json.load(f)
-            logging.debug(metadata)
-    else:
-        logging.critical("Metadata not found for character: " + name)
-        
-    return metadata
+            logging.debug("Reading metadata from: " + metadata_path)
+            return json.load(f)
+    return _cached_read(("metadata", name), metadata_path, read)
 
 def save_metadata(character_info):
     logging.debug("Saving metadata for: " + character_info["name"])
+    storage = get_storage()
+    if storage is not None:
+        return storage.save_metadata(character_info)
     metadata_path = get_metadata_file_path(character_info["name"])
     logging.debug("Metadata path: " + metadata_path)
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
 
-    if os.path.exists(metadata_path):
-        with open(metadata_path, "w", encoding="utf-8") as f:
-            logging.debug("Saving metadata for character: " + character_info["name"])
-            json.dump(character_info, f, indent=2)
-            logging.debug("Saved metadata for: " + character_info["name"])
-    else:
+    if not os.path.exists(metadata_path):
         logging.warning("Metadata path not found for character: " + character_info["name"] + " Creating new one.")
-        with open(metadata_path, "w", encoding="utf-8") as f:
-            logging.debug("Saving metadata for character: " + character_info["name"])
-            json.dump(character_info, f, indent=2)
+    # Same lock as save_chat, which also writes this file
+    with chat_journal.locked(get_chat_file_path(character_info["name"])):
+        write_behind.write_json_atomic(metadata_path, character_info, indent=2)
+        _cache_store(("metadata", character_info["name"]), metadata_path, character_info)
+    logging.debug("Saved metadata for: " + character_info["name"])
+    _cache_invalidate(("characters",))
         
     return character_info
 
@@ -202,35 +349,65 @@ def save_metadata(character_info):
 # ------------------------
 
 def load_chat(name: str):
+    write_behind.wait(("chat", name))
+    storage = get_storage()
+    if storage is not None:
+        return storage.load_chat(name)
+
     # 1: Gets path of chat of character
     chat_file = get_chat_file_path(name)
     logging.debug("Chat file: " + chat_file)
 
-    # 2: Gets chat from character
-    if os.path.exists(chat_file):
-        with open(chat_file, "r", encoding="utf-8") as f:
-            logging.debug("Getting chat from character: " + chat_file)
-            chat_data = json.load(f)
-            logging.debug(chat_data)
+    # 2: Gets chat from character (snapshot plus journal)
+    chat_data = chat_journal.load(chat_file)
+    if chat_data is not None:
+        logging.debug("Getting chat from character: " + chat_file)
+        logging.debug(chat_data)
     else:
         logging.info("Creating empty chat for: " + chat_file)
         chat_data = {"system_prompt": "", "history": []}
 
     # Load metadata if exists
-    metadata_file = get_metadata_file_path(name)
-    metadata = {}
-    if os.path.exists(metadata_file):
-        with open(metadata_file, "r", encoding="utf-8") as f:
-            logging.debug("Loading metadata for: " + name)
-            metadata = json.load(f)
-            logging.debug(metadata)
-    else:
+    metadata = _read_metadata(name)
+    if metadata is None:
         logging.critical("No metadata found for character: " + name)
+        metadata = {}
 
     return chat_data, metadata
 
-def save_chat(name: str, chat_data: dict, metadata: dict = None):
-    """Save chat data and metadata for a given character."""
+def load_history_window(name: str, limit: int = None, before: int = None):
+    """
+    Load only the last messages of a chat (limit, HISTORY_PAGE_SIZE by
+    default), or those before message index before when paging back.
+    Returns (messages, start), start being the index of messages[0] in the
+    whole history; the cost does not grow with the length of the chat.
+    """
+    limit = HISTORY_PAGE_SIZE if limit is None else limit
+    write_behind.wait(("chat", name))
+    storage = get_storage()
+    if storage is not None:
+        return storage.load_history_window(name, limit, before)
+    window = chat_journal.load_window(get_chat_file_path(name), limit, before)
+    if window is None:
+        return [], 0
+    return window
+
+def save_chat(name: str, chat_data: dict, metadata: dict = None, expected_version=None):
+    """
+    Save chat data and metadata for a given character; returns the chat's new
+    version. Pass the version load_chat returned as expected_version to
+    raise chat_journal.VersionConflict instead of overwriting changes made
+    meanwhile by another session or process.
+    """
+    # After any background append to this chat, so the older state cannot land last
+    write_behind.wait(("chat", name))
+    storage = get_storage()
+    if storage is not None:
+        chat_data["timestamp"] = datetime.now().isoformat()
+        version = storage.save_chat(name, chat_data, metadata, expected_version)
+        logging.debug(f"Saved chat and metadata for {name}")
+        return version
+
     chat_file_path = get_chat_file_path(name)
     metadata_file_path = get_metadata_file_path(name)
 
@@ -239,34 +416,232 @@ def save_chat(name: str, chat_data: dict, metadata: dict = None):
 
     chat_data["timestamp"] = datetime.now().isoformat()
 
-    # Save chat file
-    with open(chat_file_path, "w", encoding="utf-8") as f:
-        json.dump(chat_data, f, indent=2, ensure_ascii=False)
+    with chat_journal.locked(chat_file_path):
+        # Save chat file, appending only the new messages to the journal
+        version = chat_journal.save(chat_file_path, chat_data, expected_version)
+        write_behind.mark_dirty(chat_file_path)
+        write_behind.mark_dirty(chat_journal.get_journal_path(chat_file_path))
 
-    # Save metadata
-    if metadata:
-        with open(metadata_file_path, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        # Save metadata
+        if metadata:
+            write_behind.write_json_atomic(metadata_file_path, metadata, indent=2, ensure_ascii=False)
+            _cache_store(("metadata", name), metadata_file_path, metadata)
+    # The character folder may be new
+    _cache_invalidate(("characters",))
 
     logging.debug(f"Saved chat and metadata for {name}")
+    return version
+
+def append_messages(name: str, messages: list, header: dict = None):
+    """
+    Add messages (e.g. a user turn and its reply) after the chat's current
+    history and return the new version. Turns sent from two sessions at the
+    same time are both kept, one after the other, whatever history each
+    session had on screen. header is used if the chat does not exist yet.
+    """
+    timestamp = datetime.now().isoformat()
+    storage = get_storage()
+    if storage is not None:
+        return storage.append_messages(name, messages, timestamp, header)
+
+    chat_file_path = get_chat_file_path(name)
+    os.makedirs(os.path.dirname(chat_file_path), exist_ok=True)
+    version = chat_journal.append(chat_file_path, messages, timestamp, header)
+    write_behind.mark_dirty(chat_file_path)
+    write_behind.mark_dirty(chat_journal.get_journal_path(chat_file_path))
+    _cache_invalidate(("characters",))
+    return version
+
+def append_messages_later(name: str, messages: list, header: dict = None):
+    """
+    Like append_messages, but returns at once and writes in the background
+    (write_behind). Appends queued for the same character go out in one
+    write, in order; load_chat waits for them.
+    """
+    with _appends_lock:
+        pending = _pending_appends.setdefault(name, {"messages": [], "header": header})
+        pending["messages"].extend(copy.deepcopy(messages))
+    write_behind.submit(("chat", name), lambda: _write_pending_appends(name))
+
+def _write_pending_appends(name: str):
+    with _appends_lock:
+        pending = _pending_appends.pop(name, None)
+    if pending and pending["messages"]:
+        append_messages(name, pending["messages"], pending["header"])
 
 def remove_chat(name):
     """Backup and remove a character chat folder."""
+    write_behind.wait(("chat", name))
+    storage = get_storage()
+    if storage is not None:
+        storage.remove_chat(name)
+        return
+
     src_folder = os.path.join(CHAT_FOLDER, name)
     if not os.path.exists(src_folder):
         logging.warning(f"Chat folder for {name} not found.")
         return
 
     dst_folder = os.path.join(BACKUP_CHAT_FOLDER, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    chat_journal.compact(get_chat_file_path(name))
     shutil.move(src_folder, dst_folder)
+    chat_journal.forget(get_chat_file_path(name))
+    _cache_invalidate(("characters",), ("metadata", name))
     logging.debug(f"Chat {name} backed up to {dst_folder}")
 
+# ------------------------
+# Conversation summary
+# ------------------------
+
+def load_summary(name: str):
+    """Return the stored {"summary", "covered"} for a character, or None."""
+    storage = get_storage()
+    if storage is not None:
+        return storage.load_summary(name)
+
+    summary_path = get_summary_file_path(name)
+    if not os.path.exists(summary_path):
+        return None
+    try:
+        with open(summary_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as ex:
+        logging.critical("Cannot read summary for %s", name, exc_info=ex)
+        return None
+
+def save_summary(name: str, summary: dict):
+    storage = get_storage()
+    if storage is not None:
+        storage.save_summary(name, summary)
+        return
+
+    summary_path = get_summary_file_path(name)
+    os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+    with chat_journal.locked(get_chat_file_path(name)):
+        write_behind.write_json_atomic(summary_path, summary, indent=2, ensure_ascii=False)
+
+def refresh_summary(name: str, system_prompt: str, history: list, budget=None, start=0):
+    """
+    Fold messages that fell out of the context window into the stored summary.
+    history may be a window of the chat beginning at message start.
+    """
+    summary = load_summary(name)
+    covered = summary.get("covered", 0) if summary else 0
+    if start > covered:
+        # Messages between the summary and the window are read from disk, they are the ones to fold in
+        earlier, start = load_history_window(name, start - covered, before=start)
+        history = earlier + history
+    summary = context_window.valid_summary(context_window.summary_for_window(summary, start), history)
+    pending = context_window.pending_summary_range(system_prompt, history, summary, budget)
+    if pending is None:
+        return summary
+
+    first, last = pending
+    logging.debug(f"Summarizing messages {start + first}-{start + last} for {name}")
+    previous_text = summary["summary"] if summary else ""
+    text = ollama.summarize_conversation(previous_text, history[first:last])
+    if not text or text == previous_text:
+        return summary
+
+    summary = {"summary": text, "covered": start + last, "updated": datetime.now().isoformat()}
+    save_summary(name, summary)
+    return summary
+
+def prompt_context(name: str, history: list, start=0, profile=None):
+    """
+    History and summary to build a prompt from, when history is a window of
+    the chat beginning at message start. Older messages are read from disk
+    while the token budget has room for them and the summary does not stand
+    in for them, so the prompt is the same as with the whole history loaded.
+    """
+    summary = load_summary(name) if name else None
+    if not start:
+        return history, summary
+    covered = summary.get("covered", 0) if summary else 0
+    budget = profiles.context_tokens(profile) or context_window.TOKEN_BUDGET
+    while start > covered and context_window.window_start(history, budget) == 0:
+        earlier, start = load_history_window(name, min(HISTORY_PAGE_SIZE, start - covered), before=start)
+        if not earlier:
+            break
+        history = earlier + history
+    return history, context_window.summary_for_window(summary, start)
+
+def schedule_summary_refresh(name: str, system_prompt: str, history: list, profile=None, start=0):
+    """
+    Run refresh_summary in the background, at most once at a time per
+    character, then warm up the prompt prefix for the next turn (a new
+    summary changes the prefix, so the warmup waits for it).
+    """
+    with _warmups_lock:
+        _warmups_pending[name] = (system_prompt, list(history), profile, start)
+    with _summaries_lock:
+        if name in _summaries_in_progress:
+            return
+        _summaries_in_progress.add(name)
+
+    def worker():
+        try:
+            refresh_summary(name, system_prompt, list(history), profiles.context_tokens(profile), start)
+        except Exception as ex:
+            logging.critical("Summary refresh failed for %s", name, exc_info=ex)
+        finally:
+            with _summaries_lock:
+                _summaries_in_progress.discard(name)
+            _start_prefix_warmup(name)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+def schedule_prefix_warmup(name: str, system_prompt: str, history: list, profile=None, start=0):
+    """Send this chat's prompt prefix to Ollama in the background, so the next message is cheap to evaluate."""
+    with _warmups_lock:
+        _warmups_pending[name] = (system_prompt, list(history), profile, start)
+    with _summaries_lock:
+        if name in _summaries_in_progress:
+            # The summary worker starts the warmup once the summary is saved
+            return
+    _start_prefix_warmup(name)
+
+def _start_prefix_warmup(name: str):
+    with _warmups_lock:
+        if name in _warmups_running or name not in _warmups_pending:
+            return
+        _warmups_running.add(name)
+
+    def worker():
+        # Requests that arrive meanwhile replace each other; only the latest prefix is warmed next
+        while True:
+            with _warmups_lock:
+                request = _warmups_pending.pop(name, None)
+                if request is None:
+                    _warmups_running.discard(name)
+                    return
+            system_prompt, history, profile, start = request
+            try:
+                history, summary = prompt_context(name, history, start, profile)
+                ollama.warm_prefix(system_prompt, history, summary, profile)
+            except Exception as ex:
+                logging.warning("Prefix warmup failed for %s: %s", name, ex)
+
+    threading.Thread(target=worker, daemon=True).start()
+
 # ------------------------
 # Ollama backend
 # ------------------------
 
-def make_chat_fn(system_prompt, history):
+def make_chat_fn(system_prompt, history, name=None, profile=None):
     logging.debug("Making chat")
     def generator(history_input):
-        return ollama.chat_with_ollama(system_prompt, history, history_input)
+        summary = load_summary(name) if name else None
+        return ollama.chat_with_ollama(system_prompt, history, history_input, summary=summary, profile=profile)
+    return generator
+
+def make_async_stream_fn(system_prompt, name=None, profile=None):
+    """Like make_chat_fn, but the generator is async and yields ollama.ChatDelta items."""
+    logging.debug("Making async chat stream")
+    async def generator(history_input, start=0):
+        # history_input may be the window of the chat the UI loaded, beginning at message start.
+        # prompt_context can wait for a pending save and read from disk: off the event loop
+        history, summary = await asyncio.to_thread(prompt_context, name, history_input, start, profile)
+        async for delta in ollama.async_stream_chat(system_prompt, history, summary=summary, profile=profile):
+            yield delta
     return generator
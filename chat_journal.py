@@ -0,0 +1,485 @@
+"""
+Append-only chat journal.
+
+A character chat is stored as a snapshot (``chat.json``, the same format the
+app always used) plus a journal next to it (``chat.jsonl``) that holds one
+JSON line per message added after the snapshot was written. Saving a turn
+only appends the new messages, so its cost no longer depends on the length
+of the history. Once the journal grows past ``COMPACT_THRESHOLD`` lines it is
+folded back into the snapshot by a background thread.
+
+Existing ``chat.json`` files need no conversion: they are read as the initial
+snapshot and the first save starts a journal beside them.
+
+Snapshots are written with one message per line, and an offset index
+(``chat.idx``) records where each message starts, so ``load_window`` can read
+the last N messages (or the N before some index) without parsing the whole
+chat. The index names the snapshot's size and mtime it belongs to; a missing
+or stale index (older snapshot, edit by hand) falls back to a full read and
+has the snapshot rewritten with a fresh index in the background. ``compact_all``
+folds every journal back into its snapshot, e.g. before a backup or before
+downgrading to a version that only reads ``chat.json``.
+
+Every read and write holds ``file_lock`` on ``chat.json.lock``, so several
+processes can share the folder; the cached state below is checked against
+the files' size and mtime before a save relies on it. A loaded chat carries
+a version (``VERSION_KEY``): ``save(..., expected_version=...)`` refuses to
+overwrite a chat that changed since, and ``append`` adds messages after
+whatever is on disk, so concurrent turns from two sessions are merged.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import file_lock
+
+COMPACT_THRESHOLD = 500
+JOURNAL_EXTENSION = ".jsonl"
+LOCK_EXTENSION = ".lock"
+INDEX_EXTENSION = ".idx"
+INDEX_VERSION = 1
+EPOCH_KEY = "journal_epoch"
+VERSION_KEY = "version"
+
+# Per snapshot path: what is already on disk, so saves can be diffed cheaply.
+_states = {}
+
+
+class VersionConflict(Exception):
+    """The chat changed on disk since the version the caller loaded."""
+
+    def __init__(self, expected, current):
+        super().__init__(f"Chat changed: expected version {expected}, found {current}")
+        self.expected = expected
+        self.current = current
+
+
+def get_journal_path(snapshot_path: str):
+    """Return the journal path that belongs to a snapshot path."""
+    return os.path.splitext(snapshot_path)[0] + JOURNAL_EXTENSION
+
+
+def get_index_path(snapshot_path: str):
+    """Return the message offset index path that belongs to a snapshot path."""
+    return os.path.splitext(snapshot_path)[0] + INDEX_EXTENSION
+
+
+@contextmanager
+def locked(snapshot_path):
+    """Hold the chat's lock (threads and processes); re-entrant within a thread."""
+    if not os.path.isdir(os.path.dirname(snapshot_path) or "."):
+        # No folder, no chat to protect (and nowhere to put the lock file)
+        yield
+        return
+    with file_lock.locked(snapshot_path + LOCK_EXTENSION):
+        yield
+
+
+def _signature(snapshot_path):
+    """Size and mtime of snapshot and journal, to notice writes by other processes."""
+    signature = []
+    for path in (snapshot_path, get_journal_path(snapshot_path)):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _version(count, last):
+    """Version token: message count plus a hash of the last message's fingerprint."""
+    if not count:
+        return "0"
+    return f"{count}-{hashlib.sha1(last.encode('utf-8')).hexdigest()[:12]}"
+
+
+def version_for(count, last_message):
+    """Version of a history of count messages ending with last_message (for other storage backends)."""
+    return _version(count, _fingerprint(last_message) if count else None)
+
+
+def version_of(history):
+    return version_for(len(history), history[-1] if history else None)
+
+
+def _fingerprint(message):
+    return json.dumps(message, sort_keys=True, ensure_ascii=False)
+
+
+def _header_of(chat_data):
+    return {k: v for k, v in chat_data.items() if k not in ("history", "timestamp", EPOCH_KEY, VERSION_KEY)}
+
+
+def _remember(snapshot_path, chat_data, epoch, journal_lines):
+    history = chat_data.get("history", [])
+    previous = _states.get(snapshot_path)
+    _states[snapshot_path] = {
+        "count": len(history),
+        "last": _fingerprint(history[-1]) if history else None,
+        "header": _fingerprint(_header_of(chat_data)),
+        "epoch": epoch,
+        "journal_lines": journal_lines,
+        # A compaction already running keeps its flag, so no second one is started
+        "compacting": previous["compacting"] if previous else False,
+        "signature": _signature(snapshot_path),
+    }
+
+
+def _dump_snapshot(path, snapshot):
+    """
+    Write snapshot as JSON with one message per line. Returns the byte offset
+    of every message, plus the end of the last one.
+    """
+    header = {k: v for k, v in snapshot.items() if k != "history"}
+    history = snapshot.get("history", [])
+    offsets = []
+    with open(path, "wb") as f:
+        lines = ["{\n"] + [f"  {json.dumps(k)}: {json.dumps(v, ensure_ascii=False)},\n" for k, v in header.items()]
+        f.write("".join(lines).encode("utf-8") + b'  "history": [\n')
+        for index, message in enumerate(history):
+            f.write(b"    ")
+            offsets.append(f.tell())
+            f.write(json.dumps(message, ensure_ascii=False).encode("utf-8"))
+            if index < len(history) - 1:
+                f.write(b",\n")
+        offsets.append(f.tell())
+        f.write(b"\n  ]\n}\n")
+    return offsets
+
+
+def _write_index(snapshot_path, epoch, offsets):
+    """Write the offset index for the snapshot now on disk."""
+    stat = os.stat(snapshot_path)
+    index_path = get_index_path(snapshot_path)
+    tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    info = {
+        "version": INDEX_VERSION,
+        "snapshot": [stat.st_mtime_ns, stat.st_size],
+        "epoch": epoch,
+        "count": len(offsets) - 1,
+    }
+    with open(tmp_path, "wb") as f:
+        f.write(json.dumps(info, ensure_ascii=False).encode("utf-8") + b"\n")
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+    os.replace(tmp_path, index_path)
+
+
+def _write_snapshot(snapshot_path, snapshot):
+    tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    offsets = _dump_snapshot(tmp_path, snapshot)
+    os.replace(tmp_path, snapshot_path)
+    _write_index(snapshot_path, snapshot.get(EPOCH_KEY, 0), offsets)
+
+
+def _journal_entries(journal_path, epoch):
+    """Journal entries of this epoch, in file order. A torn line (after a crash) is skipped."""
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for raw_line in f:
+            raw_line = raw_line.strip()
+            if not raw_line:
+                continue
+            try:
+                entry = json.loads(raw_line)
+            except json.JSONDecodeError:
+                # A torn last line after a crash; everything before it is valid.
+                logging.warning("Skipping corrupt journal line in: " + journal_path)
+                continue
+            if entry.get("epoch", 0) == epoch:
+                yield entry
+
+
+def _replay(journal_path, epoch, count, on_message):
+    """Pass journal messages from seq count on to on_message(entry). Returns (journal lines, new count)."""
+    journal_lines = 0
+    for entry in _journal_entries(journal_path, epoch):
+        journal_lines += 1
+        seq = entry.get("seq", count)
+        if seq < count:
+            # Already folded into the snapshot by a compaction.
+            continue
+        if seq > count:
+            logging.critical("Gap in chat journal %s at message %d", journal_path, count)
+            break
+        on_message(entry)
+        count += 1
+    return journal_lines, count
+
+
+def _read(snapshot_path):
+    """Read snapshot plus journal. Returns (chat_data, epoch, journal_lines) or None."""
+    journal_path = get_journal_path(snapshot_path)
+    if not os.path.exists(snapshot_path) and not os.path.exists(journal_path):
+        return None
+
+    chat_data = {"system_prompt": "", "history": []}
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, "r", encoding="utf-8") as f:
+            chat_data = json.load(f)
+    chat_data.setdefault("history", [])
+    epoch = chat_data.pop(EPOCH_KEY, 0)
+    history = chat_data["history"]
+
+    def add(entry):
+        history.append(entry["message"])
+        if entry.get("timestamp"):
+            chat_data["timestamp"] = entry["timestamp"]
+
+    journal_lines, _ = _replay(journal_path, epoch, len(history), add)
+    return chat_data, epoch, journal_lines
+
+
+def _read_index(snapshot_path):
+    """The snapshot's index as (info, offsets base position), or None if missing or stale."""
+    try:
+        stat = os.stat(snapshot_path)
+        with open(get_index_path(snapshot_path), "rb") as f:
+            info = json.loads(f.readline())
+            base = f.tell()
+    except (OSError, ValueError):
+        return None
+    if info.get("version") != INDEX_VERSION or info.get("snapshot") != [stat.st_mtime_ns, stat.st_size]:
+        return None
+    return info, base
+
+
+def _read_snapshot_range(snapshot_path, base, start, stop):
+    """Messages start..stop-1 of an indexed snapshot; only their bytes are read."""
+    if start >= stop:
+        return []
+    with open(get_index_path(snapshot_path), "rb") as f:
+        f.seek(base + 8 * start)
+        (first,) = struct.unpack("<Q", f.read(8))
+        f.seek(base + 8 * stop)
+        (last,) = struct.unpack("<Q", f.read(8))
+    with open(snapshot_path, "rb") as f:
+        f.seek(first)
+        # "message,\n    message,\n    ..." up to the next message's offset
+        data = f.read(last - first).decode("utf-8").rstrip().rstrip(",")
+    return json.loads("[" + data + "]")
+
+
+def load_window(snapshot_path: str, limit: int, before=None):
+    """
+    Load at most limit messages ending before message index before (the end
+    of the history by default). Returns (messages, start), start being the
+    index of messages[0] in the whole history, or None if there is no chat.
+    With a current index only those messages and the journal are read.
+    """
+    with locked(snapshot_path):
+        journal_path = get_journal_path(snapshot_path)
+        indexed = _read_index(snapshot_path)
+        if indexed is None:
+            result = _read(snapshot_path)
+            if result is None:
+                return None
+            chat_data, epoch, journal_lines = result
+            history = chat_data["history"]
+            stop = len(history) if before is None else min(before, len(history))
+            start = max(0, stop - limit)
+            if os.path.exists(snapshot_path):
+                # The next load gets an index: compaction rewrites the snapshot with one
+                _remember(snapshot_path, chat_data, epoch, journal_lines)
+                _start_compaction(snapshot_path, _states[snapshot_path])
+            return history[start:stop], start
+
+        info, base = indexed
+        count = info["count"]
+        journal = []
+        _replay(journal_path, info["epoch"], count, lambda entry: journal.append(entry["message"]))
+        total = count + len(journal)
+        stop = total if before is None else min(before, total)
+        start = max(0, stop - limit)
+        messages = _read_snapshot_range(snapshot_path, base, start, min(stop, count))
+        messages.extend(journal[max(start, count) - count:max(stop, count) - count])
+        return messages, start
+
+
+def load(snapshot_path: str):
+    """
+    Load a chat from its snapshot and journal. Returns None when neither
+    exists. chat_data[VERSION_KEY] is the version to pass back to save().
+    """
+    with locked(snapshot_path):
+        result = _read(snapshot_path)
+        if result is None:
+            _states.pop(snapshot_path, None)
+            return None
+        chat_data, epoch, journal_lines = result
+        _remember(snapshot_path, chat_data, epoch, journal_lines)
+        chat_data[VERSION_KEY] = version_of(chat_data["history"])
+        return chat_data
+
+
+def _current_state(snapshot_path):
+    """Cached state if the files did not change behind our back, else re-read. None for a new chat."""
+    state = _states.get(snapshot_path)
+    if state is not None and state["signature"] == _signature(snapshot_path):
+        return state
+    result = _read(snapshot_path)
+    if result is None:
+        _states.pop(snapshot_path, None)
+        return None
+    _remember(snapshot_path, *result)
+    return _states[snapshot_path]
+
+
+def _append_lines(snapshot_path, state, messages, timestamp):
+    count = state["count"]
+    with open(get_journal_path(snapshot_path), "a", encoding="utf-8") as f:
+        for offset, message in enumerate(messages):
+            f.write(json.dumps({
+                "epoch": state["epoch"],
+                "seq": count + offset,
+                "timestamp": timestamp,
+                "message": message,
+            }, ensure_ascii=False) + "\n")
+    state["count"] = count + len(messages)
+    state["last"] = _fingerprint(messages[-1])
+    state["journal_lines"] += len(messages)
+    state["signature"] = _signature(snapshot_path)
+    if state["journal_lines"] >= COMPACT_THRESHOLD:
+        _start_compaction(snapshot_path, state)
+
+
+def _start_compaction(snapshot_path, state):
+    if not state["compacting"]:
+        state["compacting"] = True
+        threading.Thread(target=compact, args=(snapshot_path,), daemon=True).start()
+
+
+def append(snapshot_path: str, messages: list, timestamp=None, header=None):
+    """
+    Add messages after whatever history is on disk now (merge mode for
+    concurrent turns) and return the new version. header (system prompt
+    etc.) is only used when the chat does not exist yet.
+    """
+    with locked(snapshot_path):
+        state = _current_state(snapshot_path)
+        if state is None:
+            chat_data = dict(header or {}, history=list(messages))
+            if timestamp:
+                chat_data["timestamp"] = timestamp
+            return save(snapshot_path, chat_data)
+        if messages:
+            _append_lines(snapshot_path, state, messages, timestamp)
+        return _version(state["count"], state["last"])
+
+
+def save(snapshot_path: str, chat_data: dict, expected_version=None):
+    """
+    Persist chat_data and return its new version. When its history extends
+    what is already on disk only the new messages are appended to the
+    journal; otherwise (first save, edited or truncated history, changed
+    header) the snapshot is rewritten. With expected_version, raises
+    VersionConflict if the chat on disk is no longer at that version.
+    """
+    history = chat_data.get("history", [])
+    with locked(snapshot_path):
+        state = _current_state(snapshot_path)
+        if expected_version is not None:
+            current = _version(state["count"], state["last"]) if state else "0"
+            if current != expected_version:
+                raise VersionConflict(expected_version, current)
+
+        count = state["count"] if state else 0
+        can_append = (
+            state is not None
+            and len(history) >= count
+            and (count == 0 or _fingerprint(history[count - 1]) == state["last"])
+            and _fingerprint(_header_of(chat_data)) == state["header"]
+        )
+
+        if can_append:
+            new_messages = history[count:]
+            if new_messages:
+                _append_lines(snapshot_path, state, new_messages, chat_data.get("timestamp"))
+            return _version(state["count"], state["last"])
+
+        # Full rewrite under a new epoch so any stale journal lines are ignored,
+        # even if we crash before the journal is removed.
+        epoch = (state["epoch"] + 1) if state else 0
+        snapshot = {k: v for k, v in chat_data.items() if k != VERSION_KEY}
+        snapshot[EPOCH_KEY] = epoch
+        _write_snapshot(snapshot_path, snapshot)
+        journal_path = get_journal_path(snapshot_path)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        _remember(snapshot_path, chat_data, epoch, 0)
+        return version_of(history)
+
+
+def compact(snapshot_path: str):
+    """Fold the journal into the snapshot. Safe to run while saves continue, in this or another process."""
+    try:
+        with locked(snapshot_path):
+            result = _read(snapshot_path)
+            if result is None:
+                return
+            chat_data, epoch, _ = result
+            folded = len(chat_data["history"])
+            snapshot_signature = _signature(snapshot_path)[0]
+
+        snapshot = dict(chat_data)
+        snapshot[EPOCH_KEY] = epoch
+        journal_path = get_journal_path(snapshot_path)
+        # Written outside the lock, so the name must not clash with another thread or process writing
+        tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        offsets = _dump_snapshot(tmp_path, snapshot)
+
+        with locked(snapshot_path):
+            state = _states.get(snapshot_path)
+            if _signature(snapshot_path)[0] != snapshot_signature:
+                # The chat was rewritten (or compacted elsewhere) meanwhile; our copy is stale.
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, snapshot_path)
+            _write_index(snapshot_path, epoch, offsets)
+
+            # Keep only lines appended after our read.
+            remaining = []
+            if os.path.exists(journal_path):
+                with open(journal_path, "r", encoding="utf-8") as f:
+                    for raw_line in f:
+                        try:
+                            entry = json.loads(raw_line)
+                        except json.JSONDecodeError:
+                            continue
+                        if entry.get("epoch", 0) == epoch and entry.get("seq", 0) >= folded:
+                            remaining.append(raw_line if raw_line.endswith("\n") else raw_line + "\n")
+                journal_tmp = journal_path + ".tmp"
+                with open(journal_tmp, "w", encoding="utf-8") as f:
+                    f.writelines(remaining)
+                os.replace(journal_tmp, journal_path)
+            if state is not None:
+                state["journal_lines"] = len(remaining)
+                state["signature"] = _signature(snapshot_path)
+            logging.debug("Compacted chat journal: " + snapshot_path)
+    except Exception as ex:
+        logging.critical("Chat journal compaction failed for %s", snapshot_path, exc_info=ex)
+    finally:
+        state = _states.get(snapshot_path)
+        if state is not None:
+            state["compacting"] = False
+
+
+def compact_all(chat_folder: str, filename: str = "chat.json"):
+    """Fold every character's journal back into its chat.json snapshot."""
+    if not os.path.exists(chat_folder):
+        return
+    for name in os.listdir(chat_folder):
+        snapshot_path = os.path.join(chat_folder, name, filename)
+        if os.path.exists(get_journal_path(snapshot_path)):
+            compact(snapshot_path)
+
+
+def forget(snapshot_path: str):
+    """Drop cached state, e.g. after the character folder was moved away."""
+    with locked(snapshot_path):
+        _states.pop(snapshot_path, None)
@@ -0,0 +1,116 @@
+"""
+Memoized rendering of stored chat history into Chatbot messages.
+
+Rendering a message (normalizing its content and applying the action
+markup formatting) is cached by (role, content), so a message is only
+formatted the first time it is seen. While a reply streams, the history
+before it is rendered once and every frame only renders the reply itself:
+per-frame formatting cost does not depend on the length of the chat.
+"""
+from collections import OrderedDict
+import threading
+
+from markup_formatter import italics_to_bold
+
+CACHE_SIZE = 50000
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _cache_key(role, content):
+    if isinstance(content, str):
+        return (role, content)
+    if isinstance(content, dict) and content.get("type") == "image":
+        return (role, "image", content.get("path", ""))
+    return None
+
+
+def _format(role, content):
+    if isinstance(content, tuple) and len(content) == 1 and isinstance(content[0], str):
+        content = content[0]
+    if isinstance(content, dict) and content.get("type") == "image":
+        content = content.get("path", "")
+    if isinstance(content, str):
+        content = italics_to_bold(content)
+    return {"role": role, "content": content}
+
+
+def render_message(role, content):
+    """Chatbot dict for one message. The result is shared; do not mutate it."""
+    key = _cache_key(role, content)
+    if key is None:
+        return _format(role, content)
+
+    with _cache_lock:
+        rendered = _cache.get(key)
+        if rendered is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return rendered
+        _stats["misses"] += 1
+
+    rendered = _format(role, content)
+    with _cache_lock:
+        _cache[key] = rendered
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return rendered
+
+
+def format_text(text):
+    """italics_to_bold through the same cache, for callers that only need the text."""
+    if not isinstance(text, str):
+        return text
+    return render_message("text", text)["content"]
+
+
+def render_history(history):
+    """Convert stored history (dicts or legacy Gradio 3.x pairs) into Chatbot messages."""
+    if history is None:
+        return []
+
+    chatbot_value = []
+    for msg in history:
+        if isinstance(msg, (list, tuple)):
+            # Support legacy Gradio 3.x pair format
+            user_text = msg[0] if len(msg) > 0 else ""
+            assistant_text = msg[1] if len(msg) > 1 else ""
+            if user_text:
+                chatbot_value.append({"role": "user", "content": user_text})
+            if assistant_text:
+                chatbot_value.append({"role": "assistant", "content": assistant_text})
+            continue
+
+        if not isinstance(msg, dict):
+            continue
+
+        role = msg.get("role")
+        if role in ("user", "assistant"):
+            chatbot_value.append(render_message(role, msg.get("content", "")))
+
+    return chatbot_value
+
+
+def render_with_tail(rendered_prefix, role, content, formatted=False):
+    """
+    Frame for a streaming reply: the already rendered history plus the
+    still-changing last message, which is not cached. Pass formatted=True
+    when the content already went through a StreamingFormatter.
+    """
+    if formatted:
+        return rendered_prefix + [{"role": role, "content": content}]
+    return rendered_prefix + [_format(role, content)]
+
+
+def cache_stats():
+    with _cache_lock:
+        return dict(_stats, size=len(_cache))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        _stats["hits"] = 0
+        _stats["misses"] = 0
@@ -0,0 +1,115 @@
+"""
+Token-budgeted context window for chat prompts.
+
+The prompt sent to Ollama keeps the system prompt and the most recent turns
+verbatim, and replaces everything older with a rolling summary. The summary is
+stored with the chat as {"summary": str, "covered": int}, where "covered" is
+how many leading history messages it stands in for. It is refreshed in the
+background after a reply (see chat_backend.schedule_summary_refresh), never
+while the user is waiting on a reply.
+"""
+import os
+
+TOKEN_BUDGET = int(os.environ.get("CHAT_CONTEXT_TOKENS", "3072"))
+# After a refresh the verbatim turns use at most this share of the budget, so
+# the summary is not rewritten on every single turn.
+REFRESH_KEEP_RATIO = 0.5
+# Images or other non-text content are counted as a fixed cost.
+NON_TEXT_TOKENS = 16
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def estimate_tokens(content):
+    """Cheap token estimate (about 4 characters per token) without a tokenizer."""
+    if isinstance(content, str):
+        return len(content) // 4 + 4
+    if isinstance(content, list):
+        # Content as a list of parts, e.g. Gradio's [{"type": "text", "text": ...}, ...]
+        texts = [_part_text(part) for part in content]
+        non_text = sum(text is None for text in texts)
+        text = "".join(text for text in texts if text is not None)
+        return (estimate_tokens(text) if text or not non_text else 0) + non_text * NON_TEXT_TOKENS
+    return NON_TEXT_TOKENS
+
+
+def _part_text(part):
+    if isinstance(part, str):
+        return part
+    if isinstance(part, dict) and isinstance(part.get("text"), str):
+        return part["text"]
+    return None
+
+
+def window_start(history, budget):
+    """Index of the oldest message that still fits in the budget, counting back from the end."""
+    used = 0
+    start = len(history)
+    for index in range(len(history) - 1, -1, -1):
+        message = history[index]
+        used += estimate_tokens(message.get("content", "") if isinstance(message, dict) else "")
+        if used > budget and start < len(history):
+            break
+        start = index
+    return start
+
+
+def valid_summary(summary, history):
+    """Return the summary if it still matches this history, otherwise None."""
+    if not summary or not summary.get("summary"):
+        return None
+    covered = summary.get("covered", 0)
+    if covered < 0 or covered > len(history):
+        return None
+    return summary
+
+
+def summary_for_window(summary, start):
+    """
+    The summary as seen from a history that begins at message start (a window
+    from chat_backend.load_history_window): "covered" then counts from the
+    window's first message, and is 0 if the summary only covers messages
+    before the window.
+    """
+    if not summary or not start:
+        return summary
+    return dict(summary, covered=max(0, summary.get("covered", 0) - start))
+
+
+def select_context(system_prompt, history, summary=None, budget=None):
+    """
+    Pick what goes into the prompt. Returns (summary_text, recent_messages):
+    summary_text is None when no summary applies, recent_messages is the
+    verbatim tail of history that fits the remaining budget.
+    """
+    budget = TOKEN_BUDGET if budget is None else budget
+    summary = valid_summary(summary, history)
+    covered = summary["covered"] if summary else 0
+    summary_text = summary["summary"] if summary else None
+
+    remaining = budget - estimate_tokens(system_prompt or "")
+    if summary_text:
+        remaining -= estimate_tokens(SUMMARY_PREFIX + summary_text)
+
+    start = max(covered, window_start(history, remaining))
+    return summary_text, history[start:]
+
+
+def pending_summary_range(system_prompt, history, summary=None, budget=None):
+    """
+    Messages that fell out of the window but are not summarized yet.
+    Returns (first, last) history indices to fold into the summary, or None.
+    """
+    budget = TOKEN_BUDGET if budget is None else budget
+    summary = valid_summary(summary, history)
+    covered = summary["covered"] if summary else 0
+
+    remaining = budget - estimate_tokens(system_prompt or "")
+    if summary:
+        remaining -= estimate_tokens(SUMMARY_PREFIX + summary["summary"])
+    if window_start(history, remaining) <= covered:
+        return None
+
+    target = window_start(history, int(remaining * REFRESH_KEEP_RATIO))
+    if target <= covered:
+        return None
+    return covered, target
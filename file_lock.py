@@ -0,0 +1,77 @@
+"""
+Advisory file locks that also hold across processes.
+
+Several server processes may share one chat_data/ folder, so in-process
+locks are not enough around a read-modify-write of a chat or the index.
+locked(path) takes an exclusive lock on a small lock file next to the data
+(fcntl.flock on POSIX, msvcrt.locking on Windows) and a thread lock for the
+same path. Re-entering the same path in the same thread is allowed.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+_guard = threading.Lock()
+_thread_locks = {}
+_held = threading.local()
+
+
+def _thread_lock(path):
+    with _guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.Lock()
+        return lock
+
+
+def _lock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            # Locks the first byte; LK_LOCK itself gives up after about 10 s
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def _unlock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked(lock_path):
+    """Hold an exclusive lock on lock_path (created if missing) for the block."""
+    lock_path = os.path.abspath(lock_path)
+    held = getattr(_held, "paths", None)
+    if held is None:
+        held = _held.paths = set()
+    if lock_path in held:
+        yield
+        return
+
+    with _thread_lock(lock_path):
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock_fd(fd)
+            held.add(lock_path)
+            try:
+                yield
+            finally:
+                held.discard(lock_path)
+                _unlock_fd(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,238 @@
+"""
+Shared, pooled HTTP client for the Ollama and Automatic1111 backends.
+
+Each backend gets one requests.Session with a keep-alive connection pool of
+a fixed size, default connect/read timeouts and a retry policy, instead of a
+bare requests.post (new TCP handshake, no timeout) per call. A semaphore of
+the pool size bounds concurrent requests per backend so we can report how
+many connections are in use and how long callers waited for one.
+
+    with http_client.stream("ollama", url, json=payload) as response:
+        for line in response.iter_lines(): ...
+
+    response = http_client.post("a1111", url, json=payload)
+
+The async handlers use get_async_client, an httpx.AsyncClient per backend and
+event loop with the same pool size and timeouts (httpx ships with Gradio).
+A loop's clients are closed and forgotten when the loop shuts down (when
+asyncio.run cancels the tasks left on it).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+    AsyncHTTPError = httpx.HTTPError
+except ImportError:
+    httpx = None
+    AsyncHTTPError = OSError
+
+BACKENDS = {
+    "ollama": {
+        "pool_size": int(os.environ.get("OLLAMA_POOL_SIZE", "8")),
+        "connect_timeout": 5,
+        "read_timeout": 60,
+        "retries": 2,
+    },
+    "a1111": {
+        "pool_size": int(os.environ.get("A1111_POOL_SIZE", "2")),
+        "connect_timeout": 5,
+        "read_timeout": 300,
+        "retries": 1,
+    },
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+# event loop -> (clients by backend, task that closes them when the loop shuts down)
+_async_clients = {}
+_async_clients_lock = threading.Lock()
+
+
+def configure(backend: str, **options):
+    """Override pool_size, connect_timeout, read_timeout or retries; the pool is rebuilt on next use."""
+    with _pools_lock:
+        BACKENDS.setdefault(backend, dict(BACKENDS["ollama"])).update(options)
+        pool = _pools.pop(backend, None)
+    if pool is not None:
+        pool["session"].close()
+
+
+def _build_session(config):
+    # Only retry failures where the request never reached the model (connect
+    # errors, 502/503/504). A read timeout mid-generation is not retried.
+    retry = Retry(
+        total=config["retries"],
+        connect=config["retries"],
+        read=0,
+        status=config["retries"],
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=0.3,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=config["pool_size"],
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_pool(backend):
+    with _pools_lock:
+        pool = _pools.get(backend)
+        if pool is None:
+            config = BACKENDS[backend]
+            pool = _pools[backend] = {
+                "config": dict(config),
+                "session": _build_session(config),
+                "semaphore": threading.BoundedSemaphore(config["pool_size"]),
+                "lock": threading.Lock(),
+                "in_use": 0,
+                "requests": 0,
+                "errors": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+            }
+        return pool
+
+
+@contextmanager
+def stream(backend: str, url: str, method: str = "POST", **kwargs):
+    """Open a request on the backend's pool; the connection is released when the block exits."""
+    pool = _get_pool(backend)
+    config = pool["config"]
+    kwargs.setdefault("timeout", (config["connect_timeout"], config["read_timeout"]))
+    kwargs.setdefault("stream", True)
+
+    started = time.monotonic()
+    pool["semaphore"].acquire()
+    waited = time.monotonic() - started
+    with pool["lock"]:
+        pool["in_use"] += 1
+        pool["requests"] += 1
+        pool["wait_total"] += waited
+        pool["wait_max"] = max(pool["wait_max"], waited)
+    if waited > 1:
+        logging.warning("Waited %.1fs for a free %s connection", waited, backend)
+
+    try:
+        try:
+            response = pool["session"].request(method, url, **kwargs)
+        except requests.RequestException:
+            with pool["lock"]:
+                pool["errors"] += 1
+            raise
+        try:
+            yield response
+        finally:
+            response.close()
+    finally:
+        with pool["lock"]:
+            pool["in_use"] -= 1
+        pool["semaphore"].release()
+
+
+def post(backend: str, url: str, **kwargs):
+    """Non-streaming POST. The body is read before the connection goes back to the pool."""
+    kwargs.setdefault("stream", False)
+    with stream(backend, url, **kwargs) as response:
+        response.content
+    return response
+
+
+def get(backend: str, url: str, **kwargs):
+    kwargs.setdefault("stream", False)
+    with stream(backend, url, method="GET", **kwargs) as response:
+        response.content
+    return response
+
+
+async def _close_on_shutdown(loop, clients):
+    # Waits until the loop cancels its leftover tasks on shutdown (asyncio.run does), then closes its clients
+    try:
+        await loop.create_future()
+    finally:
+        with _async_clients_lock:
+            _async_clients.pop(loop, None)
+        for client in list(clients.values()):
+            await client.aclose()
+
+
+def get_async_client(backend: str):
+    """Pooled httpx.AsyncClient for the backend, one per running event loop."""
+    if httpx is None:
+        raise RuntimeError("httpx is required for the async client")
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        # Loops closed without a shutdown never ran the closer; forget their clients
+        for closed in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[closed]
+        entry = _async_clients.get(loop)
+        if entry is None:
+            clients = {}
+            # Keyed by the loop itself, not id(loop), so a new loop never gets a dead loop's client
+            entry = _async_clients[loop] = (clients, loop.create_task(_close_on_shutdown(loop, clients)))
+        clients = entry[0]
+        client = clients.get(backend)
+        if client is None or client.is_closed:
+            config = BACKENDS[backend]
+            client = clients[backend] = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config["pool_size"],
+                    max_keepalive_connections=config["pool_size"],
+                ),
+                timeout=httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"]),
+                transport=httpx.AsyncHTTPTransport(retries=config["retries"]),
+            )
+    return client
+
+
+def _idle_connections(session):
+    idle = 0
+    try:
+        # The same adapter is mounted for http:// and https://
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            for key in list(adapter.poolmanager.pools.keys()):
+                connection_pool = adapter.poolmanager.pools.get(key)
+                if connection_pool is not None:
+                    idle += sum(1 for conn in list(connection_pool.pool.queue) if conn is not None)
+    except Exception:
+        # urllib3 internals; stats are best effort.
+        pass
+    return idle
+
+
+def pool_stats():
+    """Per backend: pool size, connections in use and idle, request/error counts and wait times."""
+    stats = {}
+    with _pools_lock:
+        pools = dict(_pools)
+    for backend, pool in pools.items():
+        with pool["lock"]:
+            requests_count = pool["requests"]
+            stats[backend] = {
+                "pool_size": pool["config"]["pool_size"],
+                "in_use": pool["in_use"],
+                "idle": _idle_connections(pool["session"]),
+                "requests": requests_count,
+                "errors": pool["errors"],
+                "wait_total_s": round(pool["wait_total"], 4),
+                "wait_max_s": round(pool["wait_max"], 4),
+                "wait_avg_s": round(pool["wait_total"] / requests_count, 4) if requests_count else 0.0,
+            }
+    return stats
@@ -0,0 +1,139 @@
+"""
+Content-addressed on-disk cache for Stable Diffusion renders.
+
+A txt2img payload with a fixed seed always renders the same image, so the
+PNG is stored under the SHA-256 of the canonical payload JSON and reused
+when the identical request comes again (e.g. retrying character creation).
+Payloads with a random seed (-1 or missing) are never cached. The cache is
+bounded by IMAGE_CACHE_MAX_BYTES and evicts least recently used entries.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join("cache", "images"))
+MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_lock = threading.Lock()
+# key -> size in bytes, least recently used first; loaded from disk on first use
+_index = None
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def is_cacheable(payload):
+    seed = payload.get("seed")
+    return isinstance(seed, int) and seed >= 0
+
+
+def key_for(payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _paths(key):
+    return os.path.join(CACHE_DIR, key + ".png"), os.path.join(CACHE_DIR, key + ".json")
+
+
+def _load_index():
+    global _index
+    if _index is not None:
+        return _index
+    entries = []
+    if os.path.isdir(CACHE_DIR):
+        for filename in os.listdir(CACHE_DIR):
+            if not filename.endswith(".png"):
+                continue
+            stat = os.stat(os.path.join(CACHE_DIR, filename))
+            entries.append((stat.st_mtime, filename[:-4], stat.st_size))
+    _index = OrderedDict((key, size) for _, key, size in sorted(entries))
+    return _index
+
+
+def get(key):
+    """Return (png_bytes, info_json) for a cached render, or None."""
+    png_path, info_path = _paths(key)
+    with _lock:
+        index = _load_index()
+        if key not in index:
+            _stats["misses"] += 1
+            return None
+        try:
+            with open(png_path, "rb") as f:
+                png_bytes = f.read()
+            with open(info_path, "r", encoding="utf-8") as f:
+                info_json = f.read()
+        except OSError:
+            index.pop(key, None)
+            _stats["misses"] += 1
+            return None
+        # File mtime keeps the LRU order across restarts
+        os.utime(png_path)
+        index.move_to_end(key)
+        _stats["hits"] += 1
+    logging.debug("Image cache hit: " + key)
+    return png_bytes, info_json
+
+
+def put(key, png_bytes, info_json):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(png_bytes)
+    _store(key, write, info_json)
+
+
+def put_file(key, src_path, info_json):
+    """Like put(), for a render that is already saved on disk."""
+    _store(key, lambda tmp_path: shutil.copyfile(src_path, tmp_path), info_json)
+
+
+def _store(key, write, info_json):
+    png_path, info_path = _paths(key)
+    with _lock:
+        index = _load_index()
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(info_path, "w", encoding="utf-8") as f:
+            f.write(info_json)
+        tmp_path = f"{png_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, png_path)
+        index[key] = os.path.getsize(png_path)
+        index.move_to_end(key)
+        _evict(index)
+
+
+def _evict(index):
+    total = sum(index.values())
+    while total > MAX_BYTES and len(index) > 1:
+        key, size = index.popitem(last=False)
+        for path in _paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+        total -= size
+        _stats["evictions"] += 1
+
+
+def stats():
+    with _lock:
+        index = _load_index()
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(
+            _stats,
+            entries=len(index),
+            bytes=sum(index.values()),
+            hit_rate=_stats["hits"] / lookups if lookups else 0.0,
+        )
+
+
+def reset(cache_dir=None):
+    """Forget the in-memory index (and optionally point at another directory)."""
+    global _index, CACHE_DIR
+    with _lock:
+        if cache_dir is not None:
+            CACHE_DIR = cache_dir
+        _index = None
+        for field in _stats:
+            _stats[field] = 0
@@ -0,0 +1,233 @@
+"""
+Background job queue for image generation.
+
+Image renders can take minutes, so handlers submit them here and get a job
+id back immediately instead of holding a Gradio worker. Jobs run on a small
+bounded pool (A1111 renders one image at a time anyway). While a job runs, a
+poller fills in its progress, ETA and latest preview; the UI reads that with
+get_job(job_id) and swaps in the final image once the status is "done".
+A job can time its steps with stage(name); the durations are reported in
+the job's "stages". A cancelled job stops at its next stage: stage() raises
+Cancelled, so a job cancelled while writing its prompt never starts the render.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "1"))
+POLL_INTERVAL = 1.0
+PREVIEW_DIR = os.path.join(tempfile.gettempdir(), "aichatbot_previews")
+# Finished jobs are kept this long so late polls still find them
+JOB_TTL = 3600
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+# Id of the job the current worker thread is running, for stage()
+_current = threading.local()
+
+
+class Cancelled(Exception):
+    """Raised in a job's thread to stop it once it was cancelled."""
+
+
+def _update(job_id, **fields):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+        return job
+
+
+def _save_preview(job_id, preview_bytes):
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+    path = os.path.join(PREVIEW_DIR, f"{job_id}.png")
+    with open(path, "wb") as f:
+        f.write(preview_bytes)
+    return path
+
+
+def _poll_progress(job_id, progress_fn, stop_event):
+    while not stop_event.wait(POLL_INTERVAL):
+        try:
+            progress = progress_fn()
+        except Exception as ex:
+            logging.debug("Progress poll failed for job %s: %s", job_id, ex)
+            continue
+        if not progress or stop_event.is_set():
+            continue
+        fields = {"progress": progress.get("progress", 0.0), "eta": progress.get("eta")}
+        if progress.get("preview"):
+            fields["preview"] = _save_preview(job_id, progress["preview"])
+        _update(job_id, **fields)
+
+
+def _run(job_id, fn, args, kwargs, progress_fn):
+    job = _update(job_id, status="running", started=time.time())
+    if job is None or job.get("cancel_requested"):
+        _update(job_id, status="cancelled", finished=time.time())
+        return None
+
+    stop_event = threading.Event()
+    if progress_fn is not None:
+        threading.Thread(target=_poll_progress, args=(job_id, progress_fn, stop_event), daemon=True).start()
+
+    _current.job_id = job_id
+    try:
+        result = fn(*args, **kwargs)
+    except Cancelled:
+        _update(job_id, status="cancelled", finished=time.time())
+        return None
+    except Exception as ex:
+        logging.critical("Image job %s failed", job_id, exc_info=ex)
+        cancelled = _jobs.get(job_id, {}).get("cancel_requested")
+        _update(job_id, status="cancelled" if cancelled else "failed", error=str(ex), finished=time.time())
+        return None
+    finally:
+        _current.job_id = None
+        stop_event.set()
+
+    if _jobs.get(job_id, {}).get("cancel_requested"):
+        # Interrupted renders still return an image; it is not the one that was asked for.
+        _update(job_id, status="cancelled", finished=time.time())
+        return None
+
+    _update(job_id, status="done", progress=1.0, eta=0, result=result, finished=time.time())
+    return result
+
+
+def submit(fn, *args, progress_fn=None, cancel_fn=None, cancel_stage=None, label="", **kwargs):
+    """
+    Queue fn(*args, **kwargs) and return a job id right away.
+    progress_fn() -> {"progress": 0..1, "eta": seconds, "preview": png bytes}
+    is polled while the job runs; cancel_fn() interrupts a running job (with
+    cancel_stage, only while the job is in that stage; before it the job
+    stops at its next stage() instead).
+    """
+    _expire_old_jobs()
+    job_id = uuid.uuid4().hex[:12]
+    with _jobs_lock:
+        _jobs[job_id] = {
+            "id": job_id,
+            "label": label,
+            "status": "queued",
+            "progress": 0.0,
+            "eta": None,
+            "preview": None,
+            "result": None,
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "stage": None,
+            "stages": {},
+            "cancel_requested": False,
+            "cancel_fn": cancel_fn,
+            "cancel_stage": cancel_stage,
+        }
+        _jobs[job_id]["future"] = _executor.submit(_run, job_id, fn, args, kwargs, progress_fn)
+    logging.debug("Queued image job %s (%s)", job_id, label)
+    return job_id
+
+
+def get_job(job_id):
+    """Snapshot of a job (without internals), or None if unknown."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = {k: v for k, v in job.items() if k not in ("future", "cancel_fn", "cancel_stage")}
+        snapshot["stages"] = dict(job["stages"])
+        return snapshot
+
+
+@contextmanager
+def stage(name):
+    """
+    Time one step of the job running on this thread: the job's "stage" is
+    set to name while it runs, and "stages"[name] gets its duration in
+    seconds. Raises Cancelled instead of starting the step if the job was
+    cancelled. Does nothing outside a job.
+    """
+    job_id = getattr(_current, "job_id", None)
+    if job_id is None:
+        yield
+        return
+    with _jobs_lock:
+        # Checked and set together with cancel(), so a cancel either stops the job here or sees the stage
+        job = _jobs.get(job_id)
+        if job is not None:
+            if job["cancel_requested"]:
+                raise Cancelled(f"Job {job_id} was cancelled")
+            job["stage"] = name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _jobs_lock:
+            job = _jobs.get(job_id)
+            if job is not None:
+                job["stages"][name] = elapsed
+                job["stage"] = None
+
+
+def cancel_requested():
+    """True if the job running on this thread was cancelled (False outside a job)."""
+    job_id = getattr(_current, "job_id", None)
+    with _jobs_lock:
+        job = _jobs.get(job_id) if job_id is not None else None
+        return bool(job and job["cancel_requested"])
+
+
+def check_cancelled():
+    """Raise Cancelled if the job running on this thread was cancelled."""
+    if cancel_requested():
+        raise Cancelled("Job was cancelled")
+
+
+def wait(job_id, timeout=None):
+    """Block until the job finishes; returns its result (None if it failed or was cancelled)."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return None
+    return job["future"].result(timeout=timeout)
+
+
+def cancel(job_id):
+    """Cancel a queued job, or interrupt a running one. Returns False if it already finished."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job["status"] in ("done", "failed", "cancelled"):
+            return False
+        job["cancel_requested"] = True
+        future, cancel_fn, status = job["future"], job["cancel_fn"], job["status"]
+        if job["cancel_stage"] is not None and job["stage"] != job["cancel_stage"]:
+            # Not in the interruptible stage (e.g. still writing the prompt): it stops at its next stage()
+            cancel_fn = None
+
+    if status == "queued" and future.cancel():
+        _update(job_id, status="cancelled", finished=time.time())
+        return True
+    if cancel_fn is not None:
+        try:
+            cancel_fn()
+        except Exception as ex:
+            logging.warning("Could not interrupt job %s: %s", job_id, ex)
+    return True
+
+
+def _expire_old_jobs():
+    cutoff = time.time() - JOB_TTL
+    with _jobs_lock:
+        expired = [k for k, job in _jobs.items() if job["finished"] and job["finished"] < cutoff]
+        for job_id in expired:
+            preview = _jobs.pop(job_id).get("preview")
+            if preview and os.path.exists(preview):
+                os.remove(preview)
@@ -2,6 +2,12 @@ import logging
 import gradio as gr
 from ui_components import build_chat_ui
 import os
+import render_scheduler
+import thumbnails
+import model_residency
+import ollama_pool
+import workers
+from starlette.middleware import Middleware
 
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
@@ -14,6 +20,29 @@ css = """
 }
 """
 
+# Optional typing effect, done by the browser instead of by delaying server frames
+if render_scheduler.TYPING_EFFECT:
+    css += """
+#chatbot .generating .bot-row:last-child .message p:last-child::after,
+#chatbot.generating .bot-row:last-child .message p:last-child::after {
+    content: "\\258D";
+    animation: typing-caret 1s steps(1) infinite;
+}
+#chatbot .bot-row:last-child .message {
+    animation: typing-reveal 0.25s ease-out;
+}
+@keyframes typing-caret {
+    50% { opacity: 0; }
+}
+@keyframes typing-reveal {
+    from { opacity: 0.6; }
+    to { opacity: 1; }
+}
+"""
+
+# Thumbnails are served straight from disk (no copy into the Gradio cache)
+gr.set_static_paths(paths=[thumbnails.THUMB_DIR])
+
 # Get the path to scrolldown.js in the same directory as this script
 js_path = os.path.join(os.path.dirname(__file__), "scrolldown.js")
 
@@ -184,4 +213,16 @@ with gr.Blocks(title="AI Chat bot") as demo:
     """)
 
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=7860, css=css, js=js_path)
+    if workers.WORKERS > 1:
+        # WEB_WORKERS=N: N copies of this app behind a sticky proxy, see workers.py
+        workers.serve(os.path.abspath(__file__))
+    else:
+        # Load the chat model while the UI starts, not on the first message (once, in the first worker)
+        if workers.WORKER_INDEX == 0:
+            model_residency.warm_up_in_background()
+        ollama_pool.start_health_checks()
+        demo.launch(
+            server_name=workers.SERVER_NAME, server_port=workers.SERVER_PORT, css=css, js=js_path,
+            quiet=workers.WORKER_INDEX > 0,
+            app_kwargs={"middleware": [Middleware(thumbnails.CacheHeadersMiddleware)]},
+        )
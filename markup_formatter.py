@@ -0,0 +1,192 @@
+"""
+Action markup formatter: *text*, _text_, (text) and [text] become ***text***.
+
+One tokenizer pass replaces the four chained re.sub calls that used to live
+in both chat_backend and ui_components, and gives the same output (see
+tests/test_markup_formatter.py). The rules, per delimiter kind, are the
+ones those regexes implemented:
+
+- ``*``: a lone star (no star on either side) opens; the last star of the
+  next run of stars on the same line closes.
+- ``_``: underscores pair up in order within a line.
+- ``(`` / ``[``: opens; the first ``)`` / ``]`` after it closes, across lines,
+  unless it immediately follows the opener (empty content never matches).
+
+A matched delimiter is replaced by ``***``; anything unmatched is kept.
+Since the kinds never look at each other's characters, all four can be
+decided in the same pass. StreamingFormatter applies them to a reply as it
+arrives and only returns text that can no longer change.
+"""
+import re
+
+ACTION = "***"
+_TOKEN = re.compile(r"[*_()\[\]\n]|[^*_()\[\]\n]+")
+_CLOSERS = {")": "(", "]": "["}
+_OPENERS = {"(": ")", "[": "]"}
+_ANY_OPENER = re.compile(r"[*_(\[]")
+
+
+class StreamingFormatter:
+    """
+    Incremental formatter. feed(chunk) returns the newly finalized output,
+    preview() how the undecided tail renders if the stream ended now, and
+    finish() the rest of the output once the stream is over.
+    """
+
+    def __init__(self):
+        # Output cells: str once decided, None while the delimiter is undecided
+        self._cells = []
+        self._base = 0
+        # Pending opener per kind: (absolute cell index, original char)
+        self._open = {"*": None, "_": None, "(": None, "[": None}
+        # Whether a pending ( or [ has no content yet
+        self._empty = {"(": False, "[": False}
+        self._star_run = []
+        # Text only the last cell may absorb; pending cells must stay separate
+        self._cell_open = False
+
+    # --- cell helpers ---
+
+    def _append_text(self, text):
+        if self._cell_open:
+            self._cells[-1] += text
+        else:
+            self._cells.append(text)
+            self._cell_open = True
+
+    def _append_pending(self):
+        self._cells.append(None)
+        self._cell_open = False
+        return self._base + len(self._cells) - 1
+
+    def _set(self, index, text):
+        self._cells[index - self._base] = text
+
+    def _drain(self):
+        ready = 0
+        for cell in self._cells:
+            if cell is None:
+                break
+            ready += 1
+        if not ready:
+            return ""
+        out = "".join(self._cells[:ready])
+        del self._cells[:ready]
+        self._base += ready
+        self._cell_open = bool(self._cells) and self._cells[-1] is not None
+        return out
+
+    # --- delimiter rules ---
+
+    def _end_star_run(self):
+        run = self._star_run
+        if not run:
+            return
+        self._star_run = []
+        opener = self._open["*"]
+        if opener is not None:
+            self._set(opener[0], ACTION)
+            for index in run[:-1]:
+                self._set(index, "*")
+            self._set(run[-1], ACTION)
+            self._open["*"] = None
+        elif len(run) == 1:
+            self._open["*"] = (run[0], "*")
+        else:
+            for index in run:
+                self._set(index, "*")
+
+    def _release(self, kind):
+        opener = self._open[kind]
+        if opener is not None:
+            self._set(opener[0], opener[1])
+            self._open[kind] = None
+
+    def _token(self, token):
+        # Anything but its own closer is content for a pending ( or [
+        for kind, closer in _OPENERS.items():
+            if self._open[kind] is not None and token != closer:
+                self._empty[kind] = False
+
+        if token == "*":
+            self._star_run.append(self._append_pending())
+            return
+
+        self._end_star_run()
+
+        if token == "\n":
+            self._release("*")
+            self._release("_")
+            self._append_text(token)
+        elif token == "_":
+            opener = self._open["_"]
+            if opener is None:
+                self._open["_"] = (self._append_pending(), "_")
+            else:
+                self._set(opener[0], ACTION)
+                self._open["_"] = None
+                self._append_text(ACTION)
+        elif token in ("(", "["):
+            if self._open[token] is None:
+                self._open[token] = (self._append_pending(), token)
+                self._empty[token] = True
+            else:
+                self._append_text(token)
+        elif token in _CLOSERS:
+            kind = _CLOSERS[token]
+            opener = self._open[kind]
+            if opener is not None and not self._empty[kind]:
+                self._set(opener[0], ACTION)
+                self._open[kind] = None
+                self._append_text(ACTION)
+            else:
+                # "()" never matches; the opener is given up, like the regex does
+                self._release(kind)
+                self._append_text(token)
+        else:
+            self._append_text(token)
+
+    # --- public API ---
+
+    def feed(self, chunk):
+        """Consume a chunk of raw text; return output that is now final."""
+        for token in _TOKEN.findall(chunk):
+            self._token(token)
+        return self._drain()
+
+    def finish(self):
+        """End of stream: unmatched delimiters stay as typed. Returns the remaining output."""
+        self._end_star_run()
+        for kind in ("*", "_", "(", "["):
+            self._release(kind)
+        return self._drain()
+
+    def preview(self):
+        """Rendering of the undecided tail as if the stream ended now (state is unchanged)."""
+        if not self._cells and not self._star_run:
+            return ""
+        clone = StreamingFormatter()
+        clone._cells = list(self._cells)
+        clone._base = self._base
+        clone._open = dict(self._open)
+        clone._empty = dict(self._empty)
+        clone._star_run = list(self._star_run)
+        clone._cell_open = self._cell_open
+        return clone.finish()
+
+
+def italics_to_bold(text):
+    """
+    Converts action-style markup to bold-italic text.
+
+    Supported action formatting:
+    - *text* or _text_
+    - (text)
+    - [text]
+    """
+    if not isinstance(text, str):
+        return text
+    if not _ANY_OPENER.search(text):
+        return text
+    formatter = StreamingFormatter()
+    return formatter.feed(text) + formatter.finish()
@@ -0,0 +1,190 @@
+"""
+Keeps the chat model loaded in Ollama while prompter models come and go.
+
+Chat, the avatar prompter and the image-request prompter are three different
+models; on a box that fits one of them, every switch evicts and reloads
+weights. This module:
+
+- pins the chat model with keep_alive (OLLAMA_CHAT_KEEP_ALIVE, default
+  forever) and gives prompter models a short one (OLLAMA_PROMPTER_KEEP_ALIVE);
+- asks Ollama which models are loaded (/api/ps) so callers can check;
+- holds prompter calls back while a reply is streaming (up to
+  PROMPTER_MAX_DEFER seconds) and runs them one after another, so queued
+  prompter work shares one model load; after the last one the chat model
+  is warmed up again in the background instead of on the next message;
+- with OLLAMA_ROUTE_PROMPTER_TO_RESIDENT=1, sends prompter work to the chat
+  model when the prompter model is not loaded but the chat model is;
+- warms models up at startup (warm_up_in_background);
+- loads the chat model with one context size (OLLAMA_CHAT_NUM_CTX) for every
+  request, since Ollama reloads a model whose load options change.
+
+With several endpoints (ollama_pool), "loaded" means loaded on any of them
+and warm_up loads the model on every one.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import http_client
+import ollama_pool
+
+CHAT_MODEL = "gemma3:4b"
+
+
+def _keep_alive(value):
+    # Ollama reads a bare number as seconds (negative: forever) and a string as a duration ("5m")
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+CHAT_KEEP_ALIVE = _keep_alive(os.environ.get("OLLAMA_CHAT_KEEP_ALIVE", "-1"))
+PROMPTER_KEEP_ALIVE = _keep_alive(os.environ.get("OLLAMA_PROMPTER_KEEP_ALIVE", "1m"))
+ROUTE_TO_RESIDENT = os.environ.get("OLLAMA_ROUTE_PROMPTER_TO_RESIDENT", "0") == "1"
+WARM_MODELS = [m for m in os.environ.get("OLLAMA_WARM_MODELS", CHAT_MODEL).split(",") if m.strip()]
+PROMPTER_MAX_DEFER = float(os.environ.get("OLLAMA_PROMPTER_MAX_DEFER", "30"))
+CHAT_NUM_CTX = int(os.environ.get("OLLAMA_CHAT_NUM_CTX", "8192"))
+# /api/ps answers are reused for this long
+PS_TTL = 2.0
+
+_loaded = {"models": set(), "checked": 0.0}
+_loaded_lock = threading.Lock()
+
+_activity = threading.Condition()
+_active_chats = 0
+_prompter_lock = threading.Lock()
+_pending_prompters = 0
+
+
+def keep_alive_for(model):
+    return CHAT_KEEP_ALIVE if model == CHAT_MODEL else PROMPTER_KEEP_ALIVE
+
+
+def load_options(model):
+    """Options Ollama loads model with; every request to that model must send the same ones."""
+    return {"num_ctx": CHAT_NUM_CTX} if model == CHAT_MODEL else {}
+
+
+def loaded_models(refresh=False):
+    """Names of the models Ollama has in memory (empty if Ollama cannot be reached)."""
+    with _loaded_lock:
+        if not refresh and time.monotonic() - _loaded["checked"] < PS_TTL:
+            return set(_loaded["models"])
+    models = set()
+    for base_url in ollama_pool.endpoints():
+        try:
+            response = http_client.get("ollama", f"{base_url}/api/ps", timeout=(2, 5))
+            response.raise_for_status()
+            for entry in response.json().get("models", []):
+                models.update(name for name in (entry.get("name"), entry.get("model")) if name)
+        except Exception as ex:
+            logging.debug("Could not list loaded models on %s: %s", base_url, ex)
+    with _loaded_lock:
+        _loaded["models"] = models
+        _loaded["checked"] = time.monotonic()
+    return set(models)
+
+
+def is_resident(model):
+    return model in loaded_models()
+
+
+def _forget_loaded():
+    with _loaded_lock:
+        _loaded["checked"] = 0.0
+
+
+def choose_model(preferred):
+    """The model to send prompter work to: preferred, or the loaded chat model if routing is on."""
+    if not ROUTE_TO_RESIDENT or preferred == CHAT_MODEL:
+        return preferred
+    loaded = loaded_models()
+    if preferred not in loaded and CHAT_MODEL in loaded:
+        logging.info("Routing prompter call to resident model %s instead of loading %s", CHAT_MODEL, preferred)
+        return CHAT_MODEL
+    return preferred
+
+
+def warm_up(model):
+    """Load model into memory with its keep_alive (an empty generate request only loads it)."""
+    logging.debug("Warming up Ollama model %s", model)
+    payload = {"model": model, "keep_alive": keep_alive_for(model)}
+    if load_options(model):
+        payload["options"] = load_options(model)
+    warmed = False
+    for base_url in ollama_pool.endpoints():
+        try:
+            response = http_client.post(
+                "ollama", f"{base_url}/api/generate",
+                json=payload,
+                timeout=(5, 300),
+            )
+            response.raise_for_status()
+            warmed = True
+        except Exception as ex:
+            logging.warning("Could not warm up Ollama model %s on %s: %s", model, base_url, ex)
+    _forget_loaded()
+    return warmed
+
+
+def warm_up_in_background(models=None):
+    models = WARM_MODELS if models is None else models
+
+    def run():
+        for model in models:
+            warm_up(model.strip())
+
+    thread = threading.Thread(target=run, name="ollama-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+@contextmanager
+def chat_activity():
+    """Wrap a streamed chat reply; prompter calls wait while any is active."""
+    global _active_chats
+    with _activity:
+        _active_chats += 1
+    try:
+        yield
+    finally:
+        with _activity:
+            _active_chats -= 1
+            _activity.notify_all()
+
+
+def wait_for_chat_idle(max_wait=None):
+    """Block until no reply is streaming (or max_wait passed). Returns the seconds waited."""
+    max_wait = PROMPTER_MAX_DEFER if max_wait is None else max_wait
+    start = time.monotonic()
+    with _activity:
+        _activity.wait_for(lambda: _active_chats == 0, timeout=max_wait)
+    return time.monotonic() - start
+
+
+@contextmanager
+def prompter_call(model):
+    """
+    Wrap one request to a prompter model. Waits for streaming replies to end,
+    runs prompter calls one at a time, and re-warms the chat model after the
+    last queued one if it was evicted.
+    """
+    global _pending_prompters
+    with _activity:
+        _pending_prompters += 1
+    try:
+        waited = wait_for_chat_idle()
+        if waited >= 0.05:
+            logging.debug("Prompter call for %s deferred %.2fs while chat was streaming", model, waited)
+        with _prompter_lock:
+            yield
+    finally:
+        with _activity:
+            _pending_prompters -= 1
+            last = _pending_prompters == 0
+        _forget_loaded()
+        if last and model != CHAT_MODEL and CHAT_MODEL not in loaded_models():
+            warm_up_in_background([CHAT_MODEL])
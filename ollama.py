@@ -1,22 +1,61 @@
-import requests
+import asyncio
 import json
 import logging
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+import context_window
+import http_client
+import model_residency
+import ollama_pool
+import profiles
+import prompt_cache
 
 logging.basicConfig(level=logging.INFO) # DEBUG, INFO, WARNING, ERROR, CRITICAL
 
-def chat_with_ollama(system_prompt, history, history_input):
-    logging.debug("Calling Ollama")
-    url = "http://localhost:11434/api/chat"
-    payload = {"model": "gemma3:4b", "messages": []}
+# Appended to a base URL from ollama_pool (OLLAMA_ENDPOINTS)
+CHAT_PATH = "/api/chat"
+CHAT_MODEL = model_residency.CHAT_MODEL
+AVATAR_PROMPT_MODEL = "hf.co/mradermacher/IceLemonTeaRP-32k-7b-GGUF:Q8_0"
+REQUEST_PROMPT_MODEL = "hf.co/TheDrummer/Tiger-Gemma-9B-v2-GGUF:Q2_K"
+
+# A warmup only needs the prompt evaluated; one token is the least that reliably limits generation
+WARMUP_NUM_PREDICT = 1
+
+_prefix_stats = {"warmups": 0, "warmup_tokens": 0, "turns": 0, "cache_hits": 0, "prompt_tokens": 0, "estimated_tokens": 0}
+_prefix_stats_lock = threading.Lock()
+
+def build_messages(system_prompt, history_input, summary=None, budget=None):
+    """
+    Prompt messages for a chat: system prompt, summary and the recent history.
+    Messages are rebuilt with only role and content, always in that order, so
+    the same conversation serializes to the same bytes and Ollama can reuse
+    its KV cache for the prefix from one turn to the next.
+    """
+    messages = []
+
+    # Keep the prompt under the token budget: older turns are replaced by the summary
+    summary_text, recent_history = context_window.select_context(system_prompt, history_input, summary, budget)
 
     # Add system prompt
     if system_prompt:
-        payload["messages"].append({"role": "system", "content": system_prompt})
+        messages.append({"role": "system", "content": system_prompt})
+    if summary_text:
+        messages.append({"role": "system", "content": context_window.SUMMARY_PREFIX + summary_text})
 
     # Add history
-    for message_history in history_input:
+    for message_history in recent_history:
         if "role" in message_history and "content" in message_history:
-            payload["messages"].append(message_history)
+            messages.append({"role": message_history["role"], "content": message_history["content"]})
+
+    return messages
+
+def build_chat_payload(system_prompt, history_input, summary=None, profile=None):
+    # keep_alive pins the chat model so prompter calls don't leave it unloaded
+    payload = {"model": CHAT_MODEL, "messages": [], "keep_alive": model_residency.CHAT_KEEP_ALIVE}
+    payload["messages"] = build_messages(system_prompt, history_input, summary, profiles.context_tokens(profile))
+    payload["options"] = dict(profiles.chat_options(profile), **model_residency.load_options(CHAT_MODEL))
 
     if payload["messages"] and payload["messages"][-1]["role"] == "assistant":
         logging.debug("Last message was: %s", payload["messages"][-1]["content"])
@@ -24,80 +63,341 @@ def chat_with_ollama(system_prompt, history, history_input):
         if payload["messages"]:
             logging.debug("New last message: %s", payload["messages"][-1]["content"])
 
-    logging.debug("Sending message to Ollama and waiting for response")
-    bot_reply = ""
-    response = None
+    return payload
+
+def parse_stream_line(raw_line):
+    """Parse one line of Ollama's streaming reply. Returns the decoded dict, "[DONE]" or None."""
+    if not raw_line:
+        return None
+    line = raw_line.decode("utf-8").strip() if isinstance(raw_line, bytes) else raw_line.strip()
+    if line == "[DONE]":
+        return line
+    if line.startswith("data: "):
+        line = line[len("data: "):]
+
     try:
-        logging.debug(payload)
-        response = requests.post(url, json=payload, stream=True, timeout=60)
-        response.raise_for_status()
+        obj = json.loads(line)
+    except json.JSONDecodeError:
+        logging.debug("Skipping non-JSON line from Ollama: %s", line)
+        return None
 
-        for raw_line in response.iter_lines(decode_unicode=True):
-            if not raw_line:
-                continue
-            line = raw_line.decode("utf-8").strip() if isinstance(raw_line, bytes) else raw_line.strip()
-            if line == "[DONE]":
-                break
-            if line.startswith("data: "):
-                line = line[len("data: "):]
+    return obj if isinstance(obj, dict) else None
 
+def content_of(obj):
+    """Text carried by one decoded Ollama frame."""
+    message = obj.get("message") if isinstance(obj.get("message"), dict) else None
+    if isinstance(message, dict):
+        return message.get("content", "")
+    if isinstance(obj.get("content"), str):
+        return obj.get("content", "")
+    return ""
+
+# Fields of Ollama's final frame worth keeping for latency accounting
+STAT_FIELDS = (
+    "total_duration", "load_duration", "prompt_eval_count",
+    "prompt_eval_duration", "eval_count", "eval_duration", "done_reason",
+)
+
+class ChatDelta(NamedTuple):
+    """One step of a streamed reply: new text only, plus stats on the final delta."""
+    text: str
+    done: bool = False
+    stats: Optional[dict] = None
+
+def stats_of(obj):
+    return {field: obj[field] for field in STAT_FIELDS if field in obj}
+
+# Set OLLAMA_HEDGE=0 to never send a duplicate request
+HEDGE_ENABLED = os.environ.get("OLLAMA_HEDGE", "1") == "1"
+
+_sync_loop = None
+_sync_loop_lock = threading.Lock()
+
+def _background_loop():
+    """Event loop in a daemon thread that runs async_stream_chat for the blocking stream_chat."""
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="ollama-stream", daemon=True).start()
+            _sync_loop = loop
+    return _sync_loop
+
+async def _next_delta(stream):
+    return await stream.__anext__()
+
+def stream_chat(system_prompt, history_input, summary=None, profile=None, affinity=None):
+    """
+    Stream a reply as ChatDelta items. Only the new text of each frame is
+    yielded; the last item has done=True and Ollama's eval stats. Errors end
+    the stream with an empty done delta whose stats carry "error".
+    Runs async_stream_chat on a background event loop, so blocking callers
+    get the same routing, hedging and failover.
+    """
+    loop = _background_loop()
+    stream = async_stream_chat(system_prompt, history_input, summary, profile, affinity)
+    try:
+        while True:
             try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                logging.debug("Skipping non-JSON line from Ollama: %s", line)
-                continue
-
-            if not isinstance(obj, dict):
-                continue
-
-            message = obj.get("message") if isinstance(obj.get("message"), dict) else None
-            content_piece = ""
-            if isinstance(message, dict):
-                content_piece = message.get("content", "")
-            elif isinstance(obj.get("content"), str):
-                content_piece = obj.get("content", "")
-
-            if content_piece:
-                bot_reply += content_piece
-                partial_history = history_input + [{"role": "assistant", "content": bot_reply}]
-                yield partial_history
-
-        if not bot_reply and response is not None:
-            try:
-                text = response.text.strip()
-                for line in text.splitlines():
-                    line = line.strip()
-                    if not line or line == "[DONE]":
-                        continue
-                    if line.startswith("data: "):
-                        line = line[len("data: "):]
-                    try:
-                        obj = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
-                    if isinstance(obj, dict):
-                        message = obj.get("message") if isinstance(obj.get("message"), dict) else None
-                        if isinstance(message, dict):
-                            bot_reply = message.get("content", bot_reply)
-                        elif isinstance(obj.get("content"), str):
-                            bot_reply = obj.get("content", bot_reply)
-            except Exception:
-                pass
-    except requests.RequestException as ex:
-        if response is not None:
-            logging.critical("Ollama request failed [%s]: %s", response.status_code, response.text)
-        logging.critical("Ollama API call failed", exc_info=ex)
-        bot_reply = ""
+                delta = asyncio.run_coroutine_threadsafe(_next_delta(stream), loop).result()
+            except StopAsyncIteration:
+                break
+            yield delta
+    finally:
+        # Closing the stream cancels a request still in flight when the caller stops early
+        asyncio.run_coroutine_threadsafe(stream.aclose(), loop).result()
+
+async def _stream_attempt(base_url, payload, queue):
+    """
+    Send payload to one endpoint and put ("text", piece), then ("done", stats)
+    or ("error", exception) on queue. Cancelling the task closes the request.
+    """
+    started = time.monotonic()
+    got_text = False
+    try:
+        client = http_client.get_async_client("ollama")
+        async with client.stream("POST", base_url + CHAT_PATH, json=payload) as response:
+            response.raise_for_status()
+            stats = {}
+            async for raw_line in response.aiter_lines():
+                obj = parse_stream_line(raw_line)
+                if obj == "[DONE]":
+                    break
+                if obj is None:
+                    continue
+
+                content_piece = content_of(obj)
+                if content_piece:
+                    if not got_text:
+                        got_text = True
+                        ollama_pool.record_ttft(base_url, time.monotonic() - started)
+                    queue.put_nowait(("text", content_piece))
+                if obj.get("done"):
+                    stats = stats_of(obj)
+    except Exception as ex:
+        # Any failure has to reach the reader of queue, which is waiting on it
+        if ollama_pool.is_connection_error(ex):
+            ollama_pool.mark_failed(base_url)
+        else:
+            ollama_pool.record_failure(base_url)
+        queue.put_nowait(("error", ex))
+        return
+    ollama_pool.record_success(base_url)
+    queue.put_nowait(("done", stats))
+
+async def async_stream_chat(system_prompt, history_input, summary=None, profile=None, affinity=None):
+    """
+    Async variant of stream_chat over a non-blocking HTTP stream.
+    The request goes to the endpoint ollama_pool picks for affinity (by
+    default the system prompt, so a character stays where its KV cache is).
+    If that endpoint fails before the first token, the next one is tried. If
+    its first token is later than the endpoint's usual p95, the same request
+    is also sent to the next endpoint (a hedge); whichever answers first is
+    streamed and the other request is cancelled.
+    """
+    logging.debug("Calling Ollama (async)")
+    payload = build_chat_payload(system_prompt, history_input, summary, profile)
+    affinity = system_prompt if affinity is None else affinity
+    logging.debug(payload)
+
+    candidates = ollama_pool.candidates(affinity)
+    attempts = {}  # base_url -> (task, queue)
+    stats = {"error": "No Ollama endpoint available (all down or circuit open)"} if not candidates else {}
+    winner = None
+    first = None
+    hedged = False
+
+    def start(base_url):
+        # Counted as outstanding right away (not when the task first runs), so chats that pick
+        # an endpoint in the meantime see the load
+        tracking = ollama_pool.track(base_url)
+        tracking.__enter__()
+        queue = asyncio.Queue()
+        task = asyncio.ensure_future(_stream_attempt(base_url, payload, queue))
+        task.add_done_callback(lambda _: tracking.__exit__(None, None, None))
+        attempts[base_url] = (task, queue)
+
+    try:
+        with model_residency.chat_activity():
+            if candidates:
+                start(candidates.pop(0))
+            # Wait for the first answer of any attempt, hedging or failing over on the way
+            while winner is None and attempts:
+                delay = None
+                if HEDGE_ENABLED and not hedged and candidates and len(attempts) == 1:
+                    delay = ollama_pool.hedge_delay(next(iter(attempts)))
+                getters = {asyncio.ensure_future(queue.get()): base_url for base_url, (_, queue) in attempts.items()}
+                done, pending = await asyncio.wait(getters, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                for getter in pending:
+                    getter.cancel()
+                if not done:
+                    hedged = True
+                    logging.info("No first token after %.2fs (p95), hedging on %s", delay, candidates[0])
+                    start(candidates.pop(0))
+                    continue
+                for getter in done:
+                    base_url = getters[getter]
+                    kind, item = getter.result()
+                    if kind == "error":
+                        stats = {"error": str(item)}
+                        logging.warning("Ollama request to %s failed: %s", base_url, item)
+                        del attempts[base_url]
+                        if not attempts and candidates:
+                            start(candidates.pop(0))
+                    elif winner is None:
+                        winner, first = base_url, (kind, item)
+
+            for base_url, (task, _) in attempts.items():
+                if base_url != winner:
+                    task.cancel()
+            if winner is not None:
+                ollama_pool.assign(affinity, winner)
+                queue = attempts[winner][1]
+                kind, item = first
+                while kind == "text":
+                    yield ChatDelta(item)
+                    kind, item = await queue.get()
+                if kind == "done":
+                    stats = item
+                else:
+                    stats = {"error": str(item)}
+                    logging.critical("Ollama API call failed", exc_info=item)
+    finally:
+        for task, _ in attempts.values():
+            task.cancel()
 
     logging.debug("Full message has been sent")
+    _record_turn(payload, stats)
+    yield ChatDelta("", True, stats)
+
+def warm_prefix(system_prompt, history, summary=None, profile=None):
+    """
+    Have Ollama evaluate the prompt prefix of the next turn (system prompt,
+    summary and history) without generating a reply, so that when the user
+    sends the next message only that message still needs prompt evaluation.
+    Returns the number of prompt tokens Ollama evaluated, or None on failure.
+    """
+    # Same model, budget and options as the next turn, or the cached prefix would not match.
+    # Unlike a turn, the prefix keeps a trailing assistant reply.
+    payload = build_chat_payload(system_prompt, [], None, profile)
+    messages = payload["messages"] = build_messages(system_prompt, history, summary, profiles.context_tokens(profile))
+    if not messages:
+        return None
+    payload["stream"] = False
+    payload["options"] = dict(payload.get("options", {}), num_predict=WARMUP_NUM_PREDICT)
+    try:
+        # Same affinity as stream_chat, so the prefix is cached where the next turn goes
+        response = ollama_pool.call(
+            lambda base_url: http_client.post("ollama", base_url + CHAT_PATH, json=payload, timeout=(5, 300)),
+            affinity=system_prompt,
+        )
+        response.raise_for_status()
+        evaluated = response.json().get("prompt_eval_count", 0)
+    except Exception as ex:
+        logging.warning("Prompt prefix warmup failed: %s", ex)
+        return None
+
+    with _prefix_stats_lock:
+        _prefix_stats["warmups"] += 1
+        _prefix_stats["warmup_tokens"] += evaluated
+    logging.debug("Warmed prompt prefix of %d messages (%d tokens evaluated)", len(messages), evaluated)
+    return evaluated
+
+def _record_turn(payload, stats):
+    """Compare the prompt tokens Ollama evaluated with the size of the whole prompt."""
+    evaluated = stats.get("prompt_eval_count")
+    if evaluated is None:
+        return
+    estimated = sum(context_window.estimate_tokens(message.get("content")) for message in payload["messages"])
+    # With a warm prefix only the new message is evaluated, a small part of the prompt
+    hit = evaluated * 2 < estimated
+    with _prefix_stats_lock:
+        _prefix_stats["turns"] += 1
+        _prefix_stats["cache_hits"] += hit
+        _prefix_stats["prompt_tokens"] += evaluated
+        _prefix_stats["estimated_tokens"] += estimated
+    logging.debug("Prompt: evaluated %d of ~%d tokens%s", evaluated, estimated, " (prefix cache hit)" if hit else "")
+
+def prefix_cache_stats():
+    """Warmup and per-turn prompt evaluation counters; cache_hits counts turns that reused a cached prefix."""
+    with _prefix_stats_lock:
+        stats = dict(_prefix_stats)
+    stats["hit_rate"] = stats["cache_hits"] / stats["turns"] if stats["turns"] else 0.0
+    return stats
+
+def chat_with_ollama(system_prompt, history, history_input, summary=None, profile=None):
+    """Compatibility wrapper over stream_chat that yields whole partial histories. Raises RuntimeError if no reply came."""
+    bot_reply = ""
+    for delta in stream_chat(system_prompt, history_input, summary, profile):
+        if delta.text:
+            bot_reply += delta.text
+            yield history_input + [{"role": "assistant", "content": bot_reply}]
+        elif delta.done and not bot_reply and "error" in delta.stats:
+            raise RuntimeError("Ollama request failed: " + delta.stats["error"])
 
     history_input.append({"role": "assistant", "content": bot_reply})
     yield history_input
 
-def generate_image_prompt(prompt):
+async def async_chat_with_ollama(system_prompt, history, history_input, summary=None, profile=None):
+    """Compatibility wrapper over async_stream_chat that yields whole partial histories. Raises RuntimeError if no reply came."""
+    bot_reply = ""
+    async for delta in async_stream_chat(system_prompt, history_input, summary, profile):
+        if delta.text:
+            bot_reply += delta.text
+            yield history_input + [{"role": "assistant", "content": bot_reply}]
+        elif delta.done and not bot_reply and "error" in delta.stats:
+            raise RuntimeError("Ollama request failed: " + delta.stats["error"])
+
+    history_input.append({"role": "assistant", "content": bot_reply})
+    yield history_input
+
+def summarize_conversation(previous_summary, messages):
+    """Fold messages into previous_summary. Returns the previous summary if Ollama fails."""
+    logging.debug("Summarizing %d messages with Ollama", len(messages))
+    payload = {"model": CHAT_MODEL, "messages": [], "stream": False, "keep_alive": model_residency.CHAT_KEEP_ALIVE,
+               "options": model_residency.load_options(CHAT_MODEL)}
+
+    system_prompt = "You summarize role-play conversations. Keep names, facts about the characters, promises, " \
+    "relationships and the current situation. Write in third person, plain prose, at most 200 words."
+    payload["messages"].append({"role": "system", "content": system_prompt})
+
+    transcript = "\n".join(
+        f"{message.get('role', 'user')}: {message.get('content')}"
+        for message in messages
+        if isinstance(message, dict) and isinstance(message.get("content"), str)
+    )
+    prompt = "Current summary:\n" + (previous_summary or "(none)") + \
+    "\n\nNew messages:\n" + transcript + "\n\nRespond only with the updated summary."
+    payload["messages"].append({"role": "user", "content": prompt})
+
+    try:
+        response = ollama_pool.call(
+            lambda base_url: http_client.post("ollama", base_url + CHAT_PATH, json=payload, timeout=(5, 120))
+        )
+        response.raise_for_status()
+        return response.json()["message"]["content"].strip()
+    except Exception as ex:
+        logging.critical("Summary request failed", exc_info=ex)
+        return previous_summary
+
+def _prompter_reply(model, payload):
+    """Reply text of a non-streaming prompter request; identical requests share one call (prompt_cache)."""
+    def call():
+        with model_residency.prompter_call(model):
+            response = ollama_pool.call(
+                lambda base_url: http_client.post("ollama", base_url + CHAT_PATH, json=payload, timeout=(5, 300))
+            )
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+    return prompt_cache.get_or_call(payload, call)
+
+def generate_image_prompt(prompt, profile=None):
     logging.debug("Generating prompt for avatar with Ollama")
-    url = "http://localhost:11434/api/chat"
-    payload = {"model": "hf.co/mradermacher/IceLemonTeaRP-32k-7b-GGUF:Q8_0", "messages": [], "stream": False}
+    model = model_residency.choose_model(AVATAR_PROMPT_MODEL)
+    payload = {"model": model, "messages": [], "stream": False, "keep_alive": model_residency.keep_alive_for(model)}
+    options = dict(profiles.prompter_options(profile), **model_residency.load_options(model))
+    if options:
+        payload["options"] = options
 
     system_prompt= "You are prompter, my AI assistant that helps me creates prompts for stable diffusion, removing information not needed and "
     "focusing more on the details that can create an image, representing both obvious details like hair color, body type, race and also adapting "
@@ -112,21 +412,24 @@ def generate_image_prompt(prompt):
 
     # Add latest user message
     logging.debug("Sending message to Ollama and waiting for response")
-    response = None
     try:
-        response = requests.post(url, json=payload, stream=False)
+        content = _prompter_reply(model, payload)
     except Exception as ex:
-        logging.critical("Oh no ",ex)
+        logging.critical("Avatar prompt request failed", exc_info=ex)
+        raise
 
     extra_prompts = ",masterpiece, (photorealistic:1.4), best quality, soft lighting, photograph, RAW photo, 8k uhd, film grain, (low quality amateur:1.3), (fisheye lens:0.9) (bokeh:0.9), slightly blurred, (morning light:0.5), (ambient occlusion:0.6), (realistic shadows), portrait photography, (social media style:0.8), (vertical composition), 85mm lens, f/2.8, ISO 400 <lora:DarkLighting:0.1> <lora:InstantPhotoX3:0.15> <lora:add_detail:1.1>"
-    reponse_prompt = response.json()["message"]["content"] + extra_prompts
+    reponse_prompt = content + extra_prompts
     logging.debug("Full message has been sent")
     return reponse_prompt
 
-def generate_image_request_prompt(user_prompt, character_info):
+def generate_image_request_prompt(user_prompt, character_info, profile=None):
     logging.debug("Generating prompt for requested image with Ollama")
-    url = "http://localhost:11434/api/chat"
-    payload = {"model": "hf.co/TheDrummer/Tiger-Gemma-9B-v2-GGUF:Q2_K", "messages": [], "stream": False}
+    model = model_residency.choose_model(REQUEST_PROMPT_MODEL)
+    payload = {"model": model, "messages": [], "stream": False, "keep_alive": model_residency.keep_alive_for(model)}
+    options = dict(profiles.prompter_options(profile), **model_residency.load_options(model))
+    if options:
+        payload["options"] = options
 
     system_prompt= "You are prompter, my AI assistant that helps me creates prompts for stable diffusion, removing information not needed and "
     "focusing more on the details that can create an image, representing both obvious details like hair color, body type, race and also adapting "
@@ -148,11 +451,12 @@ def generate_image_request_prompt(user_prompt, character_info):
     # Add latest user message
     logging.debug("Sending message to Ollama and waiting for response")
     try:
-        response = requests.post(url, json=payload, stream=False)
+        content = _prompter_reply(model, payload)
     except Exception as ex:
-        logging.critical("Oh no ",ex)
+        logging.critical("Image request prompt failed", exc_info=ex)
+        raise
 
     extra_prompts = ",masterpiece, (photorealistic:1.4), best quality, soft lighting, photograph, RAW photo, 8k uhd, film grain, (low quality amateur:1.3), (fisheye lens:0.9) (bokeh:0.9), slightly blurred, (morning light:0.5), (ambient occlusion:0.6), (realistic shadows), 85mm lens, f/2.8, ISO 400 <lora:DarkLighting:0.1> <lora:InstantPhotoX3:0.15> <lora:add_detail:1.1>"
-    reponse_prompt = response.json()["message"]["content"] + extra_prompts
+    reponse_prompt = content + extra_prompts
     logging.debug("Full message has been sent")
     return reponse_prompt
\ No newline at end of file
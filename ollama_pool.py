@@ -0,0 +1,305 @@
+"""
+Pool of Ollama endpoints with health checks and least-loaded routing.
+
+OLLAMA_ENDPOINTS lists one or more base URLs (comma separated, default
+http://localhost:11434). Each request goes to the healthy endpoint with the
+fewest requests in flight, except that a chat keeps going to the endpoint it
+used last (session affinity, keyed by the caller, e.g. the character's
+system prompt) so its KV cache is reused there. Connection failures mark an
+endpoint down and the request is retried on the next candidate; a down
+endpoint gets traffic again after a passing health check or RETRY_AFTER
+seconds.
+
+Each endpoint also keeps its recent time-to-first-token samples (for
+hedging, see ollama.async_stream_chat) and a circuit breaker: after
+BREAKER_THRESHOLD failures in a row it stops getting requests for
+BREAKER_COOLDOWN seconds, so callers fail fast instead of waiting out a
+timeout. Health checks leave an open breaker alone (a server can answer
+/api/version and still fail every chat): after the cooldown one caller gets
+the endpoint as a trial, a success closes the breaker and one more failure
+opens it again.
+
+    for base_url in ollama_pool.candidates(affinity):
+        with ollama_pool.track(base_url):
+            ...  # on a connection error: ollama_pool.mark_failed(base_url); continue
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import requests
+
+import http_client
+
+try:
+    import httpx
+    _CONNECTION_ERRORS = (requests.ConnectionError, requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)
+except ImportError:
+    _CONNECTION_ERRORS = (requests.ConnectionError, requests.ConnectTimeout)
+
+DEFAULT_ENDPOINTS = os.environ.get("OLLAMA_ENDPOINTS", "http://localhost:11434")
+HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10"))
+RETRY_AFTER = 15.0
+BREAKER_THRESHOLD = int(os.environ.get("OLLAMA_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("OLLAMA_BREAKER_COOLDOWN", "30"))
+# Time-to-first-token samples kept per endpoint, and how many are needed before hedging
+TTFT_WINDOW = 200
+TTFT_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.25
+# Affinity entries kept (least recently used are dropped)
+AFFINITY_SIZE = 1000
+
+_lock = threading.Lock()
+_endpoints = OrderedDict()
+_affinity = OrderedDict()
+_health_thread = None
+
+
+def _new_endpoint(url):
+    return {
+        "url": url, "healthy": True, "breaker_open": False, "down_until": 0.0, "outstanding": 0, "requests": 0,
+        "failures": 0, "consecutive_failures": 0, "ttft": deque(maxlen=TTFT_WINDOW),
+    }
+
+
+def configure(urls):
+    """Replace the pool with these base URLs (a list or a comma separated string)."""
+    if isinstance(urls, str):
+        urls = urls.split(",")
+    urls = [url.strip().rstrip("/") for url in urls if url.strip()]
+    with _lock:
+        _endpoints.clear()
+        _affinity.clear()
+        for url in urls:
+            _endpoints[url] = _new_endpoint(url)
+
+
+configure(DEFAULT_ENDPOINTS)
+
+
+def endpoints():
+    with _lock:
+        return list(_endpoints)
+
+
+def _available(endpoint, now):
+    return endpoint["healthy"] or now >= endpoint["down_until"]
+
+
+def candidates(affinity=None):
+    """
+    Endpoints to try, best first: the affinity endpoint if it is up, else the
+    least loaded available one, then the remaining available ones by load.
+    Endpoints that are down or have an open breaker are left out, so this is
+    empty when nothing can take the request.
+    """
+    now = time.monotonic()
+    with _lock:
+        ranked = sorted(
+            (endpoint for endpoint in _endpoints.values() if _available(endpoint, now)),
+            key=lambda endpoint: endpoint["outstanding"],
+        )
+        for endpoint in ranked:
+            if endpoint["breaker_open"]:
+                # Half-open: this caller has the trial, others wait another cooldown
+                endpoint["down_until"] = now + BREAKER_COOLDOWN
+        order = [endpoint["url"] for endpoint in ranked]
+        sticky = _affinity.get(affinity) if affinity is not None else None
+        if sticky in order:
+            order.remove(sticky)
+            order.insert(0, sticky)
+        if affinity is not None and order:
+            _remember(affinity, order[0])
+    return order
+
+
+def _remember(affinity, url):
+    _affinity[affinity] = url
+    _affinity.move_to_end(affinity)
+    while len(_affinity) > AFFINITY_SIZE:
+        _affinity.popitem(last=False)
+
+
+def assign(affinity, url):
+    """Pin affinity to url (after a failover, so the next turn goes where the cache now is)."""
+    if affinity is None:
+        return
+    with _lock:
+        _remember(affinity, url)
+
+
+@contextmanager
+def track(url):
+    """Count a request to url as outstanding while the block runs."""
+    with _lock:
+        endpoint = _endpoints.get(url)
+        if endpoint is not None:
+            endpoint["outstanding"] += 1
+            endpoint["requests"] += 1
+    try:
+        yield url
+    finally:
+        with _lock:
+            if endpoint is not None:
+                endpoint["outstanding"] -= 1
+
+
+def is_connection_error(ex):
+    """True for errors where the request never reached Ollama, so another endpoint may take it."""
+    return isinstance(ex, _CONNECTION_ERRORS)
+
+
+def mark_failed(url):
+    """The endpoint could not be reached: take it out of rotation for RETRY_AFTER seconds."""
+    with _lock:
+        endpoint = _endpoints.get(url)
+        if endpoint is None:
+            return
+        endpoint["failures"] += 1
+        endpoint["consecutive_failures"] += 1
+        if endpoint["healthy"]:
+            logging.warning("Ollama endpoint %s is down", url)
+        endpoint["healthy"] = False
+        endpoint["down_until"] = max(endpoint["down_until"], time.monotonic() + RETRY_AFTER)
+
+
+def mark_healthy(url):
+    """The endpoint answered a health check: back in rotation, unless its breaker is open."""
+    with _lock:
+        endpoint = _endpoints.get(url)
+        if endpoint is None or endpoint["breaker_open"]:
+            return
+        if not endpoint["healthy"]:
+            logging.info("Ollama endpoint %s is back", url)
+        endpoint["healthy"] = True
+        endpoint["down_until"] = 0.0
+
+
+def record_failure(url):
+    """A request failed (timeout, HTTP error, broken stream); opens the breaker after BREAKER_THRESHOLD in a row."""
+    with _lock:
+        endpoint = _endpoints.get(url)
+        if endpoint is None:
+            return
+        endpoint["failures"] += 1
+        endpoint["consecutive_failures"] += 1
+        if endpoint["consecutive_failures"] >= BREAKER_THRESHOLD:
+            if endpoint["healthy"]:
+                logging.warning(
+                    "Circuit breaker open for %s after %d failures", url, endpoint["consecutive_failures"]
+                )
+            endpoint["healthy"] = False
+            endpoint["breaker_open"] = True
+            endpoint["down_until"] = time.monotonic() + BREAKER_COOLDOWN
+
+
+def record_success(url):
+    """A request completed: closes the breaker."""
+    with _lock:
+        endpoint = _endpoints.get(url)
+        if endpoint is not None:
+            endpoint["consecutive_failures"] = 0
+            endpoint["breaker_open"] = False
+    mark_healthy(url)
+
+
+def record_ttft(url, seconds):
+    with _lock:
+        endpoint = _endpoints.get(url)
+        if endpoint is not None:
+            endpoint["ttft"].append(seconds)
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def ttft_percentile(url, q=0.95):
+    """Time-to-first-token percentile of the endpoint, or None until TTFT_MIN_SAMPLES are recorded."""
+    with _lock:
+        endpoint = _endpoints.get(url)
+        if endpoint is None or len(endpoint["ttft"]) < TTFT_MIN_SAMPLES:
+            return None
+        samples = list(endpoint["ttft"])
+    return _percentile(samples, q)
+
+
+def hedge_delay(url):
+    """How long to wait for a first token from url before sending a duplicate elsewhere (None: don't hedge)."""
+    p95 = ttft_percentile(url)
+    return None if p95 is None else max(HEDGE_MIN_DELAY, p95)
+
+
+def call(fn, affinity=None):
+    """
+    Run fn(base_url) on the best endpoint, failing over to the next one on
+    connection errors. Returns fn's result; raises the last error if every
+    endpoint failed.
+    """
+    last_error = None
+    for url in candidates(affinity):
+        with track(url):
+            try:
+                result = fn(url)
+            except Exception as ex:
+                if not is_connection_error(ex):
+                    record_failure(url)
+                    raise
+                mark_failed(url)
+                last_error = ex
+                continue
+        if getattr(result, "status_code", 200) >= 500:
+            record_failure(url)
+        else:
+            record_success(url)
+        assign(affinity, url)
+        return result
+    raise last_error if last_error else RuntimeError("No Ollama endpoint available (all down or circuit open)")
+
+
+def check_health():
+    """Probe every endpoint once (GET /api/version)."""
+    for url in endpoints():
+        try:
+            response = http_client.get("ollama", f"{url}/api/version", timeout=(1, 3))
+            response.raise_for_status()
+        except Exception as ex:
+            logging.debug("Health check failed for %s: %s", url, ex)
+            mark_failed(url)
+        else:
+            mark_healthy(url)
+
+
+def start_health_checks(interval=None):
+    """Probe the endpoints every interval seconds in a daemon thread (once per process)."""
+    global _health_thread
+    interval = HEALTH_INTERVAL if interval is None else interval
+    with _lock:
+        if _health_thread is not None:
+            return _health_thread
+
+        def run():
+            while True:
+                check_health()
+                time.sleep(interval)
+
+        _health_thread = threading.Thread(target=run, name="ollama-health", daemon=True)
+    _health_thread.start()
+    return _health_thread
+
+
+def stats():
+    """Per endpoint: health, load, failure counts and time-to-first-token p50/p95 (seconds)."""
+    result = {}
+    with _lock:
+        for url, endpoint in _endpoints.items():
+            entry = {k: v for k, v in endpoint.items() if k not in ("url", "ttft")}
+            samples = list(endpoint["ttft"])
+            entry["ttft_p50"] = _percentile(samples, 0.5) if samples else None
+            entry["ttft_p95"] = _percentile(samples, 0.95) if samples else None
+            result[url] = entry
+    return result
@@ -0,0 +1,140 @@
+"""
+Byte-level PNG writing: attach a text chunk without decoding the image.
+
+A1111 already returns a finished PNG; the only change made before saving is
+the "parameters" text chunk carrying the generation info. Splicing that
+chunk into the byte stream keeps the compressed image data untouched, where
+PIL would decode and re-compress every pixel. Text chunks that already use
+the same keyword are dropped, as PIL's save(pnginfo=...) did.
+"""
+import base64
+import os
+import struct
+import threading
+import zlib
+from io import BytesIO
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_TEXT_TYPES = (b"tEXt", b"zTXt", b"iTXt")
+# Base64 characters decoded per block; a multiple of 4 so blocks decode on their own
+B64_BLOCK = 256 * 1024
+
+
+def _chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+
+def text_chunk(keyword, text):
+    """tEXt chunk, or an uncompressed iTXt chunk when text is not Latin-1 (PIL makes the same choice)."""
+    key = keyword.encode("latin-1")
+    try:
+        return _chunk(b"tEXt", key + b"\0" + text.encode("latin-1"))
+    except UnicodeEncodeError:
+        # keyword, compression flag + method, empty language tag and translated keyword
+        return _chunk(b"iTXt", key + b"\0\0\0\0\0" + text.encode("utf-8"))
+
+
+class _TextChunkWriter:
+    """
+    File-like filter: bytes of a PNG go in, the same PNG with the text chunk
+    right after IHDR comes out. Chunks are copied through as they arrive, so
+    the whole image never has to be in memory at once.
+    """
+
+    def __init__(self, out, keyword, text):
+        self.out = out
+        self.key_prefix = keyword.encode("latin-1") + b"\0"
+        self.extra = text_chunk(keyword, text)
+        self.buffer = bytearray()
+        self.signature_done = False
+        self.chunks = 0
+        self.remaining = 0
+        self.copying = True
+
+    def write(self, data):
+        self.buffer += data
+        while self.buffer:
+            if self.remaining:
+                n = min(self.remaining, len(self.buffer))
+                if self.copying:
+                    self.out.write(memoryview(self.buffer)[:n])
+                del self.buffer[:n]
+                self.remaining -= n
+                continue
+
+            if not self.signature_done:
+                if len(self.buffer) < len(SIGNATURE):
+                    return
+                if self.buffer[:len(SIGNATURE)] != SIGNATURE:
+                    raise ValueError("Not a PNG image")
+                self.out.write(SIGNATURE)
+                del self.buffer[:len(SIGNATURE)]
+                self.signature_done = True
+                continue
+
+            if len(self.buffer) < 8:
+                return
+            length, chunk_type = struct.unpack(">I4s", self.buffer[:8])
+            if self.chunks == 0 and chunk_type != b"IHDR":
+                raise ValueError("PNG does not start with IHDR")
+
+            replaced = False
+            if chunk_type in _TEXT_TYPES:
+                needed = 8 + min(length, len(self.key_prefix))
+                if len(self.buffer) < needed:
+                    # Header split across writes: nothing is written until it is complete
+                    return
+                replaced = self.buffer[8:8 + len(self.key_prefix)] == self.key_prefix
+
+            if self.chunks == 1:
+                self.out.write(self.extra)
+
+            self.copying = not replaced
+            # data + type/length header + CRC
+            self.remaining = length + 12
+            self.chunks += 1
+
+    def close(self):
+        if self.remaining or self.buffer or self.chunks < 2:
+            raise ValueError("Truncated PNG image")
+
+
+def _write_atomic(path, feed):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            feed(f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def insert_text(png_bytes, keyword, text):
+    """Return png_bytes with the text chunk added (replacing one with the same keyword)."""
+    out = BytesIO()
+    writer = _TextChunkWriter(out, keyword, text)
+    writer.write(png_bytes)
+    writer.close()
+    return out.getvalue()
+
+
+def write_png(path, png_bytes, keyword, text):
+    """Write png_bytes to path with the text chunk added."""
+    def feed(f):
+        writer = _TextChunkWriter(f, keyword, text)
+        writer.write(png_bytes)
+        writer.close()
+    _write_atomic(path, feed)
+
+
+def write_b64_png(path, b64_text, keyword, text):
+    """Decode a base64 PNG block by block straight to path, adding the text chunk on the way."""
+    def feed(f):
+        writer = _TextChunkWriter(f, keyword, text)
+        for start in range(0, len(b64_text), B64_BLOCK):
+            writer.write(base64.b64decode(b64_text[start:start + B64_BLOCK]))
+        writer.close()
+    _write_atomic(path, feed)
@@ -0,0 +1,96 @@
+"""
+Performance profiles behind the "Response Type" setting (Slow, Average, Fast).
+
+Each profile sets the chat context budget and Ollama sampling options,
+options for the prompter models and A1111 overrides (steps, resolution,
+ADetailer). They are stored in profiles.json (CHAT_PROFILES_FILE) and the
+file is read again whenever it changes, so edits apply without a restart.
+Profiles share the chat model and the options it is loaded with (num_ctx,
+num_thread...; see model_residency): Ollama reloads a model when those
+change, so profiles cannot set them (they are dropped with a warning).
+The UI keeps the selected profile name per session and passes it along;
+callers resolve it with get_profile() at the moment they build a request.
+Options set to null in the file are left to Ollama's defaults.
+"""
+import json
+import logging
+import os
+import threading
+
+PROFILES_FILE = os.environ.get("CHAT_PROFILES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles.json"))
+DEFAULT_PROFILE = "Average"
+# A1111 payload fields a profile may override
+IMAGE_FIELDS = ("steps", "width", "height", "cfg_scale", "sampler_name")
+# Ollama options that are fixed when a model is loaded
+LOAD_OPTIONS = ("num_ctx", "num_batch", "num_gpu", "main_gpu", "num_thread", "use_mmap", "use_mlock", "low_vram")
+
+_lock = threading.Lock()
+_loaded = {"mtime": None, "profiles": {}}
+_warned = set()
+
+
+def load_profiles():
+    """All profiles by name, re-read from disk if the file changed. Keeps the last good copy on errors."""
+    try:
+        mtime = os.path.getmtime(PROFILES_FILE)
+    except OSError:
+        logging.warning("Profiles file not found: %s", PROFILES_FILE)
+        return _loaded["profiles"]
+
+    with _lock:
+        if mtime != _loaded["mtime"]:
+            try:
+                with open(PROFILES_FILE, "r", encoding="utf-8") as f:
+                    _loaded["profiles"] = json.load(f)
+                logging.info("Loaded performance profiles: %s", ", ".join(_loaded["profiles"]))
+            except (OSError, ValueError) as ex:
+                logging.critical("Could not read profiles file %s: %s", PROFILES_FILE, ex)
+            _loaded["mtime"] = mtime
+        return _loaded["profiles"]
+
+
+def profile_names():
+    return list(load_profiles())
+
+
+def get_profile(name=None):
+    """The named profile, falling back to DEFAULT_PROFILE (or {} if there is none)."""
+    profiles = load_profiles()
+    return profiles.get(name or DEFAULT_PROFILE) or profiles.get(DEFAULT_PROFILE) or {}
+
+
+def _options(section):
+    options = {key: value for key, value in (section.get("options") or {}).items() if value is not None}
+    for key in options:
+        if key in LOAD_OPTIONS and key not in _warned:
+            _warned.add(key)
+            logging.warning("Ignoring profile option %s: it would make Ollama reload the model", key)
+    return {key: value for key, value in options.items() if key not in LOAD_OPTIONS}
+
+
+def chat_options(name):
+    """Ollama options for chat requests (num_predict, sampling...)."""
+    return _options(get_profile(name).get("chat", {}))
+
+
+def context_tokens(name):
+    """Prompt token budget for the chat, or None for context_window's default."""
+    return get_profile(name).get("chat", {}).get("context_tokens")
+
+
+def prompter_options(name):
+    return _options(get_profile(name).get("prompter", {}))
+
+
+def apply_image_profile(payload, name):
+    """Apply the profile's A1111 overrides to a txt2img payload (in place) and return it."""
+    image = get_profile(name).get("image", {})
+    for field in IMAGE_FIELDS:
+        if image.get(field) is not None:
+            payload[field] = image[field]
+    if image.get("adetailer") is False:
+        scripts = payload.get("alwayson_scripts") or {}
+        scripts.pop("Adetailer", None)
+        if not scripts:
+            payload.pop("alwayson_scripts", None)
+    return payload
@@ -0,0 +1,106 @@
+"""
+Single-flight result cache for non-streaming prompter calls.
+
+The avatar and image-request prompters run 7B-9B models for several seconds
+per call. The same request often comes twice: a double-clicked "Create
+Character", or a retry after the image step failed. Requests are keyed on
+model, messages and options (keep_alive and stream do not change the
+answer). A request identical to one still in flight waits for that call
+instead of starting another. A finished result is reused for
+PROMPT_CACHE_TTL seconds, and at most PROMPT_CACHE_MAX_ENTRIES are kept,
+least recently used dropped first. Failures are shared with the waiting
+callers but not cached.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TTL = float(os.environ.get("PROMPT_CACHE_TTL", "3600"))
+MAX_ENTRIES = int(os.environ.get("PROMPT_CACHE_MAX_ENTRIES", "256"))
+KEY_FIELDS = ("model", "messages", "options")
+
+_lock = threading.Lock()
+# key -> (expires at, result), least recently used first
+_results = OrderedDict()
+# key -> {"done": Event, "result": ..., "error": ...} for calls in flight
+_in_flight = {}
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+
+def key_for(payload):
+    relevant = {field: payload.get(field) for field in KEY_FIELDS}
+    canonical = json.dumps(relevant, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _cached(key, now):
+    entry = _results.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= now:
+        del _results[key]
+        return None
+    _results.move_to_end(key)
+    return entry
+
+
+def get_or_call(payload, fn):
+    """Return fn()'s result for payload, from the cache or a call already in flight when there is one."""
+    key = key_for(payload)
+    with _lock:
+        entry = _cached(key, time.monotonic())
+        if entry is not None:
+            _stats["hits"] += 1
+            return entry[1]
+        flight = _in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _in_flight[key] = {"done": threading.Event(), "result": None, "error": None}
+            _stats["misses"] += 1
+        else:
+            _stats["coalesced"] += 1
+
+    if not leader:
+        logging.debug("Prompter request %s already in flight, waiting for it", key[:12])
+        flight["done"].wait()
+        if flight["error"] is not None:
+            raise flight["error"]
+        return flight["result"]
+
+    try:
+        flight["result"] = fn()
+    except Exception as ex:
+        flight["error"] = ex
+        raise
+    else:
+        with _lock:
+            _results[key] = (time.monotonic() + TTL, flight["result"])
+            _results.move_to_end(key)
+            while len(_results) > MAX_ENTRIES:
+                _results.popitem(last=False)
+                _stats["evictions"] += 1
+        return flight["result"]
+    finally:
+        with _lock:
+            del _in_flight[key]
+        flight["done"].set()
+
+
+def stats():
+    """Counters; hit_rate counts coalesced requests as hits, since they did not start a call either."""
+    with _lock:
+        requests = _stats["hits"] + _stats["coalesced"] + _stats["misses"]
+        saved = _stats["hits"] + _stats["coalesced"]
+        return dict(_stats, entries=len(_results), in_flight=len(_in_flight),
+                    hit_rate=saved / requests if requests else 0.0)
+
+
+def reset():
+    with _lock:
+        _results.clear()
+        for field in _stats:
+            _stats[field] = 0
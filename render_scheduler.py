@@ -0,0 +1,46 @@
+"""
+Frame scheduler for streaming replies into the Chatbot component.
+
+The first frame is always sent immediately, so the first token shows up as
+soon as the model produces it. Later updates are coalesced into at most
+MAX_FPS frames per second: tokens that arrive in between only mark the frame
+dirty and go out with the next one. Nothing here sleeps; the reply finishes
+as fast as the model does.
+
+The "typing" animation is optional and purely client-side (CSS, see main.py),
+enabled with CHAT_TYPING_EFFECT=1.
+"""
+import os
+import time
+
+MAX_FPS = float(os.environ.get("CHAT_MAX_FPS", "15"))
+TYPING_EFFECT = os.environ.get("CHAT_TYPING_EFFECT", "0") == "1"
+
+
+class FrameScheduler:
+    def __init__(self, max_fps=None, clock=time.monotonic):
+        fps = max_fps if max_fps is not None else MAX_FPS
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.clock = clock
+        self.dirty = False
+        self.frames = 0
+        self._last_frame = None
+
+    def mark_dirty(self):
+        """New content arrived that is not on screen yet."""
+        self.dirty = True
+
+    def time_until_ready(self):
+        """Seconds until the next frame may be sent (0 when it may be sent now)."""
+        if self._last_frame is None:
+            return 0.0
+        return max(0.0, self._last_frame + self.interval - self.clock())
+
+    def ready(self):
+        """True when a dirty frame should be sent now; records the frame if so."""
+        if not self.dirty or self.time_until_ready() > 0:
+            return False
+        self._last_frame = self.clock()
+        self.dirty = False
+        self.frames += 1
+        return True
@@ -0,0 +1,337 @@
+"""
+SQLite storage backend for characters, metadata, the chats index and history.
+
+Selected with the CHAT_STORAGE_BACKEND=sqlite environment variable (see
+chat_backend.get_storage). Everything the file backend keeps in loose JSON
+files lives in one WAL-mode database, so listing characters, switching chats
+and saving a turn are indexed queries instead of directory scans and full
+file rewrites. Generated images stay on disk under chat_data/<name>/assets.
+
+Import an existing chat_data/ tree with:
+    python sqlite_storage.py import [chat_data] [chat_data/chats.db]
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+import chat_journal
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    name TEXT PRIMARY KEY,
+    metadata TEXT,
+    index_info TEXT,
+    chat_header TEXT NOT NULL DEFAULT '{}',
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    character TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (character, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    character TEXT PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SqliteStorage:
+    """Same API as the file functions in chat_backend, backed by SQLite."""
+
+    def __init__(self, db_path, chat_folder="chat_data", backup_folder="backup/chat_data"):
+        self.db_path = db_path
+        self.chat_folder = chat_folder
+        self.backup_folder = backup_folder
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads, Gradio handlers run on many.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ------------------------
+    # Characters / index
+    # ------------------------
+
+    def list_characters(self):
+        rows = self._connect().execute("SELECT name FROM characters ORDER BY name").fetchall()
+        return [row[0] for row in rows]
+
+    def load_index(self):
+        rows = self._connect().execute(
+            "SELECT name, index_info FROM characters WHERE index_info IS NOT NULL"
+        ).fetchall()
+        return {name: json.loads(info) for name, info in rows}
+
+    def save_index(self, name, character_info):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO characters (name, index_info) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET index_info = excluded.index_info",
+                (name, json.dumps(character_info, ensure_ascii=False)),
+            )
+
+    def remove_from_index(self, name):
+        with self._connect() as conn:
+            conn.execute("UPDATE characters SET index_info = NULL WHERE name = ?", (name,))
+
+    # ------------------------
+    # Last chat tracking
+    # ------------------------
+
+    def save_last_chat_name(self, name):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO settings (key, value) VALUES ('last_chat', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (name,),
+            )
+
+    def load_last_chat_name(self):
+        row = self._connect().execute("SELECT value FROM settings WHERE key = 'last_chat'").fetchone()
+        return row[0] if row else ""
+
+    # ------------------------
+    # Metadata
+    # ------------------------
+
+    def get_metadata(self, name):
+        row = self._connect().execute("SELECT metadata FROM characters WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] is None:
+            logging.critical("Metadata not found for character: " + name)
+            return None
+        return json.loads(row[0])
+
+    def save_metadata(self, character_info):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO characters (name, metadata, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET metadata = excluded.metadata, updated_at = excluded.updated_at",
+                (character_info["name"], json.dumps(character_info, ensure_ascii=False), datetime.now().isoformat()),
+            )
+        return character_info
+
+    # ------------------------
+    # Chat CRUD
+    # ------------------------
+
+    def load_chat(self, name):
+        conn = self._connect()
+        row = conn.execute("SELECT chat_header, metadata FROM characters WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            logging.info("Creating empty chat for: " + name)
+            return {"system_prompt": "", "history": []}, {}
+
+        chat_data = json.loads(row[0])
+        chat_data.setdefault("system_prompt", "")
+        chat_data["history"] = [
+            json.loads(message) for (message,) in conn.execute(
+                "SELECT message FROM messages WHERE character = ? ORDER BY seq", (name,)
+            )
+        ]
+        chat_data[chat_journal.VERSION_KEY] = chat_journal.version_of(chat_data["history"])
+        metadata = json.loads(row[1]) if row[1] else {}
+        if not metadata:
+            logging.critical("No metadata found for character: " + name)
+        return chat_data, metadata
+
+    def load_history_window(self, name, limit, before=None):
+        """Same as chat_journal.load_window: (messages, start) of at most limit messages before index before."""
+        conn = self._connect()
+        last_seq = conn.execute("SELECT MAX(seq) FROM messages WHERE character = ?", (name,)).fetchone()[0]
+        total = 0 if last_seq is None else last_seq + 1
+        before = total if before is None else min(before, total)
+        start = max(0, before - limit)
+        messages = [
+            json.loads(message) for (message,) in conn.execute(
+                "SELECT message FROM messages WHERE character = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (name, start, before),
+            )
+        ]
+        return messages, start
+
+    def _version(self, conn, name):
+        row = conn.execute(
+            "SELECT seq, message FROM messages WHERE character = ? ORDER BY seq DESC LIMIT 1", (name,)
+        ).fetchone()
+        if row is None:
+            return chat_journal.version_for(0, None)
+        return chat_journal.version_for(row[0] + 1, json.loads(row[1]))
+
+    def save_chat(self, name, chat_data, metadata=None, expected_version=None):
+        """Same as chat_journal.save: returns the new version, raises VersionConflict on a stale expected_version."""
+        history = chat_data.get("history", [])
+        header = {k: v for k, v in chat_data.items() if k not in ("history", chat_journal.VERSION_KEY)}
+
+        with self._connect() as conn:
+            # The first write takes SQLite's write lock, so the check below cannot race another process
+            conn.execute(
+                "INSERT INTO characters (name, chat_header, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET chat_header = excluded.chat_header, updated_at = excluded.updated_at",
+                (name, json.dumps(header, ensure_ascii=False), header.get("timestamp")),
+            )
+            if expected_version is not None:
+                current = self._version(conn, name)
+                if current != expected_version:
+                    raise chat_journal.VersionConflict(expected_version, current)
+            last_seq = conn.execute("SELECT MAX(seq) FROM messages WHERE character = ?", (name,)).fetchone()[0]
+            count = 0 if last_seq is None else last_seq + 1
+            prefix_matches = count == 0
+            if 0 < count <= len(history):
+                stored = conn.execute(
+                    "SELECT message FROM messages WHERE character = ? AND seq = ?", (name, count - 1)
+                ).fetchone()
+                prefix_matches = stored is not None and stored[0] == json.dumps(history[count - 1], ensure_ascii=False)
+
+            if not prefix_matches:
+                # History was edited or truncated: replace it.
+                conn.execute("DELETE FROM messages WHERE character = ?", (name,))
+                count = 0
+
+            conn.executemany(
+                "INSERT INTO messages (character, seq, message) VALUES (?, ?, ?)",
+                [
+                    (name, seq, json.dumps(message, ensure_ascii=False))
+                    for seq, message in enumerate(history[count:], start=count)
+                ],
+            )
+            if metadata:
+                conn.execute(
+                    "UPDATE characters SET metadata = ? WHERE name = ?",
+                    (json.dumps(metadata, ensure_ascii=False), name),
+                )
+        return chat_journal.version_of(history)
+
+    def append_messages(self, name, messages, timestamp=None, header=None):
+        """Same as chat_journal.append: add messages after the stored history and return the new version."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO characters (name, chat_header, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET updated_at = excluded.updated_at",
+                (name, json.dumps(dict(header or {}, timestamp=timestamp), ensure_ascii=False), timestamp),
+            )
+            for message in messages:
+                # seq is taken inside the statement, so appends from other connections cannot collide
+                conn.execute(
+                    "INSERT INTO messages (character, seq, message) "
+                    "SELECT ?, COALESCE(MAX(seq), -1) + 1, ? FROM messages WHERE character = ?",
+                    (name, json.dumps(message, ensure_ascii=False), name),
+                )
+            return self._version(conn, name)
+
+    def load_summary(self, name):
+        row = self._connect().execute("SELECT summary FROM summaries WHERE character = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_summary(self, name, summary):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO summaries (character, summary) VALUES (?, ?) "
+                "ON CONFLICT(character) DO UPDATE SET summary = excluded.summary",
+                (name, json.dumps(summary, ensure_ascii=False)),
+            )
+
+    def remove_chat(self, name):
+        """Archive the character as JSON files next to its assets, then delete its rows."""
+        chat_data, metadata = self.load_chat(name)
+        chat_data.pop(chat_journal.VERSION_KEY, None)
+        dst_folder = os.path.join(self.backup_folder, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        src_folder = os.path.join(self.chat_folder, name)
+        if os.path.exists(src_folder):
+            shutil.move(src_folder, dst_folder)
+        os.makedirs(dst_folder, exist_ok=True)
+        with open(os.path.join(dst_folder, "chat.json"), "w", encoding="utf-8") as f:
+            json.dump(chat_data, f, indent=2, ensure_ascii=False)
+        with open(os.path.join(dst_folder, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE character = ?", (name,))
+            conn.execute("DELETE FROM summaries WHERE character = ?", (name,))
+            conn.execute("DELETE FROM characters WHERE name = ?", (name,))
+        logging.debug(f"Chat {name} backed up to {dst_folder}")
+
+    # ------------------------
+    # Import
+    # ------------------------
+
+    def import_chat_data(self, chat_folder=None, last_chat_file="last_chat.json"):
+        """Import a chat_data/ tree written by the file backend. Returns imported names."""
+        chat_folder = chat_folder or self.chat_folder
+        imported = []
+        if not os.path.exists(chat_folder):
+            logging.warning("Nothing to import, folder not found: " + chat_folder)
+            return imported
+
+        for name in sorted(os.listdir(chat_folder)):
+            character_folder = os.path.join(chat_folder, name)
+            if not os.path.isdir(character_folder):
+                continue
+
+            metadata_path = os.path.join(character_folder, "metadata.json")
+            if os.path.exists(metadata_path):
+                with open(metadata_path, "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+                metadata.setdefault("name", name)
+                self.save_metadata(metadata)
+
+            chat_data = chat_journal.load(os.path.join(character_folder, "chat.json"))
+            self.save_chat(name, chat_data or {"history": []})
+
+            summary_path = os.path.join(character_folder, "summary.json")
+            if os.path.exists(summary_path):
+                with open(summary_path, "r", encoding="utf-8") as f:
+                    self.save_summary(name, json.load(f))
+            imported.append(name)
+            logging.info("Imported character: " + name)
+
+        index_path = os.path.join(chat_folder, "chats_index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                for name, info in json.load(f).items():
+                    self.save_index(name, info)
+
+        if os.path.exists(last_chat_file):
+            with open(last_chat_file, "r", encoding="utf-8") as f:
+                last_chat = json.load(f).get("last_chat", "")
+            if last_chat:
+                self.save_last_chat_name(last_chat)
+
+        return imported
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Usage: python sqlite_storage.py import [chat_folder] [db_path]")
+        sys.exit(1)
+    folder = sys.argv[2] if len(sys.argv) > 2 else "chat_data"
+    db = sys.argv[3] if len(sys.argv) > 3 else os.path.join(folder, "chats.db")
+    names = SqliteStorage(db, chat_folder=folder).import_chat_data(folder)
+    print(f"Imported {len(names)} characters into {db}")
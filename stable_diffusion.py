@@ -1,10 +1,15 @@
 import base64
 import os
 import json
-import requests
+import http_client
+import image_jobs
+import image_cache
+import png_chunks
+import thumbnails
+import profiles
+import hashlib
 import logging
-from PIL import Image, PngImagePlugin
-from io import BytesIO
+import threading
 from datetime import datetime
 
 logging.basicConfig(level=logging.INFO) # DEBUG, INFO, WARNING, ERROR, CRITICAL
@@ -14,11 +19,13 @@ logging.basicConfig(level=logging.INFO) # DEBUG, INFO, WARNING, ERROR, CRITICAL
 # ------------------------
 A1111_URL = "http://127.0.0.1:7861"   # change if different host/port
 ASSETS_DIR = "assets"
+# PNG text chunk that carries the generation info (what A1111's PNG Info tab reads)
+PNG_INFO_KEY = "parameters"
 
 def generate_avatar_a1111(name, system_prompt, *,
                           width=512, height=512,
                           steps=20, cfg_scale=7.0, sampler_name="DPM++ 2M",
-                          seed=-1, negative_prompt=None):
+                          seed=-1, negative_prompt=None, profile=None):
     logging.debug("Generating image for: " + name)
     # 1) Build prompt
     prompt = (
@@ -56,11 +63,19 @@ def generate_avatar_a1111(name, system_prompt, *,
         }
     }
 
-    filename = "Avatar.png"
-    img, metadata = generate_image(payload, -1)
-    return save_image(img, filename, metadata, name)
+    # Same name chat_backend.get_avatar_file_path looks for (case matters outside Windows)
+    filename = "avatar.png"
+    with image_jobs.stage("render"):
+        path = generate_image(payload, seed, image_path(name, filename), profile)
+    try:
+        with image_jobs.stage("thumbnails"):
+            thumbnails.make_thumbnails(path)
+    except Exception as ex:
+        # Not fatal: the UI renders missing thumbnails on first use
+        logging.warning("Could not create avatar thumbnails: %s", ex)
+    return path
 
-def generate_requested_image(name, request_prompt):
+def generate_requested_image(name, request_prompt, seed=-1, profile=None):
     logging.debug("Generating requested image for: " + name)
     # 1) Build prompt
     prompt = (
@@ -100,32 +115,76 @@ def generate_requested_image(name, request_prompt):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{name}_{timestamp}.png"
 
-    img, metadata = generate_image(payload, -1)
-    return save_image(img, filename, metadata, name)
+    return generate_image(payload, seed, image_path(name, filename), profile)
+
+def get_progress():
+    """Progress of the render A1111 is working on: {"progress", "eta", "preview" (PNG bytes)}."""
+    resp = http_client.get("a1111", f"{A1111_URL}/sdapi/v1/progress?skip_current_image=false", timeout=(2, 5))
+    resp.raise_for_status()
+    data = resp.json()
+    preview = data.get("current_image")
+    return {
+        "progress": data.get("progress", 0.0),
+        "eta": data.get("eta_relative"),
+        "preview": base64.b64decode(preview) if preview else None,
+    }
 
-def save_image(img, filename, metadata, name):
+def was_interrupted():
+    """True if A1111's last render was interrupted (e.g. from its own UI); False if that cannot be told."""
     try:
-        base_path = os.path.join("chat_data", name)
-        avatar_folder = os.path.join(base_path, "assets")
-        os.makedirs(avatar_folder, exist_ok=True)
-        path = os.path.join(avatar_folder, filename)
-        img.save(path, pnginfo=metadata)
+        resp = http_client.get("a1111", f"{A1111_URL}/sdapi/v1/progress?skip_current_image=true", timeout=(2, 5))
+        resp.raise_for_status()
+        return bool(resp.json().get("state", {}).get("interrupted"))
     except Exception as ex:
-        logging.critical("Image could not be saved: ", ex)
-        raise ex
-    
-    return path
-
-
-def generate_image(payload, seed):
+        logging.debug("Could not read A1111 state: %s", ex)
+        return False
+
+def interrupt():
+    """Ask A1111 to stop the current render."""
+    http_client.post("a1111", f"{A1111_URL}/sdapi/v1/interrupt", timeout=(2, 5))
+
+def submit_image_job(fn, *args, label="", **kwargs):
+    """Run an image generation function in the background job queue; returns a job id."""
+    # Interrupting A1111 only helps while it renders for this job; before that it is idle or busy with another
+    return image_jobs.submit(fn, *args, progress_fn=get_progress, cancel_fn=interrupt, cancel_stage="render", label=label, **kwargs)
+
+def image_path(name, filename):
+    base_path = os.path.join("chat_data", name)
+    avatar_folder = os.path.join(base_path, "assets")
+    os.makedirs(avatar_folder, exist_ok=True)
+    return os.path.join(avatar_folder, filename)
+
+
+def seed_for(*parts):
+    """Stable seed derived from the inputs, so an identical retry renders (and caches) the same image."""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") & 0x7FFFFFFF
+
+def generate_image(payload, seed, path, profile=None):
+    """
+    Render payload and save the PNG to path, with the generation info in its
+    "parameters" text chunk. The PNG from A1111 is written as is (the chunk is
+    spliced in at the byte level), so the image is never decoded here.
+    The performance profile's steps/resolution overrides are applied first.
+    """
+    profiles.apply_image_profile(payload, profile)
     if seed is not None:
         payload["seed"] = seed
 
+    # Fixed-seed renders are deterministic: reuse an identical earlier one
+    cache_key = image_cache.key_for(payload) if image_cache.is_cacheable(payload) else None
+    if cache_key:
+        cached = image_cache.get(cache_key)
+        if cached is not None:
+            png_bytes, info_json = cached
+            png_chunks.write_png(path, png_bytes, PNG_INFO_KEY, info_json)
+            return path
+
     url = f"{A1111_URL}/sdapi/v1/txt2img"
     result = ""
 
     try:
-        resp = requests.post(url, json=payload, timeout=300)
+        resp = http_client.post("a1111", url, json=payload)
         resp.raise_for_status()
         result = resp.json()
     except Exception as ex:
@@ -137,17 +196,24 @@ def generate_image(payload, seed):
         logging.critical("No image returned from A1111")
         raise RuntimeError("No images returned from A1111")
 
+    # Written next to path first: an interrupted render must not replace the image or enter the cache
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
         img_b64 = result["images"][0]  # take first
-        image_bytes = base64.b64decode(img_b64.split(",", 1)[-1] if "," in img_b64 else img_b64)
-        img = Image.open(BytesIO(image_bytes))
-
+        if "," in img_b64:
+            img_b64 = img_b64.split(",", 1)[-1]
         info_json = json.dumps(result.get("info", {}))
-
-        metadata = PngImagePlugin.PngInfo()
-        metadata.add_text("parameters", info_json)
-        
+        png_chunks.write_b64_png(tmp_path, img_b64, PNG_INFO_KEY, info_json)
     except Exception as ex:
-        logging.critical("Image could not be generated: " + ex)
+        logging.critical("Image could not be saved: %s", ex)
+        raise ex
+
+    if image_jobs.cancel_requested() or was_interrupted():
+        # The seed makes the cache key repeatable, so a cached partial image would be served to every retry
+        os.remove(tmp_path)
+        raise image_jobs.Cancelled("Render was interrupted")
 
-    return img, metadata
\ No newline at end of file
+    if cache_key:
+        image_cache.put_file(cache_key, tmp_path, info_json)
+    os.replace(tmp_path, path)
+    return path
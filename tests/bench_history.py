@@ -0,0 +1,61 @@
+"""
+Benchmark: cost of switching to a character, by length of its chat.
+
+Compares loading and rendering the whole history (load_chat, as switching
+used to) with loading and rendering only the last page through the offset
+index (load_history_window), for chats of 50 to 50k messages. Both read
+from disk each time (caches cleared).
+
+Run: python tests/bench_history.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+# Ensure the repository root is on sys.path when run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import chat_backend
+import chat_journal
+import chat_render
+
+RUNS = 5
+
+def make_history(count):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": f"*waves* Message number {i} (smiling) with some [actions] and _emphasis_ text."}
+        for i in range(count)
+    ]
+
+def switch_ms(fn):
+    total = 0.0
+    for _ in range(RUNS):
+        chat_render.clear_cache()
+        chat_journal._states.clear()
+        started = time.perf_counter()
+        fn()
+        total += time.perf_counter() - started
+    return total * 1000 / RUNS
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        chat_backend.CHAT_FOLDER = folder
+        print(f"{'messages':>9} {'whole chat ms':>14} {'last page ms':>13}   (page = {chat_backend.HISTORY_PAGE_SIZE} messages)")
+        for count in (50, 500, 5000, 50000):
+            name = f"chat{count}"
+            chat_backend.save_chat(name, {"system_prompt": "", "history": make_history(count)})
+
+            def whole():
+                chat_data, _ = chat_backend.load_chat(name)
+                chat_render.render_history(chat_data["history"])
+
+            def page():
+                history, _ = chat_backend.load_history_window(name)
+                chat_render.render_history(history)
+
+            print(f"{count:>9} {switch_ms(whole):>14.2f} {switch_ms(page):>13.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: time to first token, reply time and avatar render time per
+performance profile (Slow, Average, Fast).
+
+Runs against local stand-ins with a simple cost model instead of real
+models: fake_ollama waits PROMPT_TOKEN_DELAY per prompt token before the
+first word (prompt evaluation) and WORD_DELAY per word after it, and the
+fake A1111 below takes STEP_DELAY per sampling step at 512x512 (scaled by
+pixel count) plus ADETAILER_STEPS steps per ADetailer model. The chat is
+HISTORY_MESSAGES long, so every profile's context budget is filled. The
+numbers show what each profile's settings cost relative to the others, not
+what a given GPU or CPU will do.
+
+Run: python tests/bench_profiles.py
+"""
+import base64
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+# Ensure the repository root is on sys.path when run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_ollama
+import ollama
+import ollama_pool
+import profiles
+import stable_diffusion
+from PIL import Image
+
+REPEATS = 3
+HISTORY_MESSAGES = 400
+REPLY_WORDS = 400
+PROMPT_TOKEN_DELAY = 0.0002
+WORD_DELAY = 0.002
+STEP_DELAY = 0.02
+ADETAILER_STEPS = 8
+
+class CostModelA1111Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        scale = payload.get("width", 512) * payload.get("height", 512) / (512 * 512)
+        steps = payload.get("steps", 20)
+        adetailer = (payload.get("alwayson_scripts") or {}).get("Adetailer")
+        if adetailer:
+            steps += ADETAILER_STEPS * len(adetailer.get("args", []))
+        time.sleep(STEP_DELAY * steps * scale)
+        buffer = BytesIO()
+        Image.new("RGB", (64, 64), (200, 150, 120)).save(buffer, format="PNG")
+        self.reply({"images": [base64.b64encode(buffer.getvalue()).decode("ascii")], "info": "{}"})
+
+    def do_GET(self):
+        # /sdapi/v1/progress, read after the render to check for an interrupt
+        self.reply({"progress": 0.0, "state": {"interrupted": False}})
+
+    def reply(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def time_reply(history, profile):
+    start = time.perf_counter()
+    first = None
+    for delta in ollama.stream_chat("You are Bob.", history, profile=profile):
+        if first is None and delta.text:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+def time_avatar(profile):
+    start = time.perf_counter()
+    stable_diffusion.generate_avatar_a1111("Bob", "a friendly baker", profile=profile)
+    return time.perf_counter() - start
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    server, url = fake_ollama.start(" ".join(["word"] * REPLY_WORDS), delay=WORD_DELAY)
+    server.prompt_token_delay = PROMPT_TOKEN_DELAY
+    a1111 = ThreadingHTTPServer(("127.0.0.1", 0), CostModelA1111Handler)
+    threading.Thread(target=a1111.serve_forever, daemon=True).start()
+    ollama_pool.configure([url])
+    stable_diffusion.A1111_URL = f"http://127.0.0.1:{a1111.server_address[1]}"
+
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "word " * 40}
+        for i in range(HISTORY_MESSAGES)
+    ] + [{"role": "user", "content": "How was your day?"}]
+
+    print(f"{'profile':>8} {'prompt tok':>11} {'TTFT ms':>9} {'reply ms':>9} {'image ms':>9}")
+    # generate_avatar_a1111 writes under chat_data/ in the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            for profile in profiles.profile_names():
+                payload = ollama.build_chat_payload("You are Bob.", history, profile=profile)
+                prompt_tokens = sum(len(m["content"]) for m in payload["messages"]) // 4
+                replies = [time_reply(history, profile) for _ in range(REPEATS)]
+                images = [time_avatar(profile) for _ in range(REPEATS)]
+                print(f"{profile:>8} {prompt_tokens:>11} "
+                      f"{statistics.median(r[0] for r in replies) * 1000:>9.0f} "
+                      f"{statistics.median(r[1] for r in replies) * 1000:>9.0f} "
+                      f"{statistics.median(images) * 1000:>9.0f}")
+        finally:
+            os.chdir(cwd)
+    server.shutdown()
+    a1111.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark: per-frame cost of rendering the chat while a reply streams.
+
+Compares the old path (format every message on every frame) with the
+memoized path (chat_render: history rendered once, only the reply per frame)
+for histories of 10 to 10k messages.
+
+Run: python tests/bench_render.py
+"""
+import os
+import re
+import sys
+import time
+
+# Ensure the repository root is on sys.path when run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import chat_render
+
+FRAMES = 50
+
+def old_italics_to_bold(text):
+    text = re.sub(r'(?<!\*)\*(?!\*)(.*?)\*(?!\*)', r'***\1***', text)
+    text = re.sub(r'_(.*?)_', r'***\1***', text)
+    text = re.sub(r'\(([^)]+)\)', r'***\1***', text)
+    text = re.sub(r'\[([^\]]+)\]', r'***\1***', text)
+    return text
+
+def old_render(history):
+    return [{"role": m["role"], "content": old_italics_to_bold(m["content"])} for m in history]
+
+def make_history(count):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": f"*waves* Message number {i} (smiling) with some [actions] and _emphasis_ text."}
+        for i in range(count)
+    ]
+
+def per_frame_ms(fn):
+    started = time.perf_counter()
+    for frame in range(FRAMES):
+        fn(frame)
+    return (time.perf_counter() - started) * 1000 / FRAMES
+
+def main():
+    print(f"{'messages':>9} {'old ms/frame':>13} {'memoized ms/frame':>18} {'format-only ms/frame':>21}")
+    for count in (10, 100, 1000, 10000):
+        history = make_history(count)
+        chat_render.clear_cache()
+
+        def old_frame(frame):
+            old_render(history + [{"role": "assistant", "content": "*typing* reply " * frame}])
+
+        rendered_prefix = chat_render.render_history(history)
+
+        def new_frame(frame):
+            chat_render.render_with_tail(rendered_prefix, "assistant", "*typing* reply " * frame)
+
+        def format_only(frame):
+            chat_render._format("assistant", "*typing* reply " * frame)
+
+        print(f"{count:>9} {per_frame_ms(old_frame):>13.3f} {per_frame_ms(new_frame):>18.3f} {per_frame_ms(format_only):>21.3f}")
+    print("memoized = cached prefix + formatting the streaming reply; the remaining growth is the list copy Gradio needs.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark: chat throughput of main.py with one process vs WEB_WORKERS=N.
+
+Starts the full app (main.py) against the local stand-in LLM (fake_ollama,
+streaming a fixed reply word by word) in a scratch folder with one
+character per simulated user. Every user opens its own Gradio session
+(gradio_client, which keeps the proxy's session cookie), switches to its
+character and sends TURNS messages back to back. Reports completed turns
+per second and per-turn latency.
+
+Run: python tests/bench_workers.py [workers ...]    (default: 1 4)
+"""
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Ensure the repository root is on sys.path when run directly.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_ollama
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+USERS = int(os.environ.get("BENCH_USERS", "8"))
+TURNS = int(os.environ.get("BENCH_TURNS", "4"))
+REPLY_WORDS = 60
+WORD_DELAY = 0.01
+# Server output goes here; set BENCH_LOG to a file to see it
+LOG = open(os.environ["BENCH_LOG"], "a") if os.environ.get("BENCH_LOG") else subprocess.DEVNULL
+
+def free_port(count=1):
+    """First of count consecutive free ports (workers use WEB_WORKER_BASE_PORT + i)."""
+    while True:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            base = s.getsockname()[1]
+        try:
+            for port in range(base, base + count):
+                with socket.socket() as s:
+                    s.bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+
+def create_characters(folder):
+    # chat_backend paths are relative to the working directory, like the server's
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        import chat_backend
+        import write_behind
+        chat_backend.clear_cache()
+        for i in range(USERS):
+            name = f"user{i}"
+            chat_backend.save_metadata(chat_backend.new_metadata(name, f"You are {name}."))
+            chat_backend.save_chat(name, {"history": []})
+        write_behind.flush()
+    finally:
+        os.chdir(cwd)
+
+def wait_for_http(port, process, timeout=180):
+    import httpx
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"main.py exited with code {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/config", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("main.py did not start")
+
+def run_users(port):
+    from gradio_client import Client
+    latencies, errors = [], []
+
+    def user(i):
+        try:
+            client = Client(f"http://127.0.0.1:{port}/", verbose=False, download_files=False)
+            client.predict(f"user{i}", api_name="/switch_chat")
+            history = []
+            for turn in range(TURNS):
+                started = time.perf_counter()
+                history, _ = client.predict(f"Message {turn} from user {i}", history, api_name="/send_message")
+                latencies.append(time.perf_counter() - started)
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(USERS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies), errors
+
+def bench(workers, ollama_url):
+    with tempfile.TemporaryDirectory() as folder:
+        create_characters(folder)
+        port = free_port()
+        env = dict(
+            os.environ,
+            OLLAMA_ENDPOINTS=ollama_url,
+            WEB_WORKERS=str(workers),
+            WEB_SERVER_NAME="127.0.0.1",
+            WEB_SERVER_PORT=str(port),
+            WEB_WORKER_BASE_PORT=str(free_port(workers)),
+        )
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=folder, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=LOG)
+        try:
+            wait_for_http(port, process)
+            return run_users(port)
+        finally:
+            process.terminate()
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 4]
+    server, url = fake_ollama.start(" ".join(["word"] * REPLY_WORDS), delay=WORD_DELAY)
+    print(f"{USERS} users x {TURNS} turns, stand-in reply {REPLY_WORDS} words at {WORD_DELAY * 1000:.0f} ms/word, {os.cpu_count()} CPU(s)")
+    print(f"{'workers':>8} {'turns/s':>8} {'p50 s':>7} {'p95 s':>7} {'errors':>7}")
+    for workers in counts:
+        elapsed, latencies, errors = bench(workers, url)
+        p50 = latencies[len(latencies) // 2] if latencies else float("nan")
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else float("nan")
+        print(f"{workers:>8} {len(latencies) / elapsed:>8.2f} {p50:>7.2f} {p95:>7.2f} {len(errors):>7}")
+        if errors:
+            print(f"         first error: {errors[0]!r}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
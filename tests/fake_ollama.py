@@ -0,0 +1,106 @@
+"""
+Local stand-in for the Ollama HTTP API, used by tests that must not need a
+running Ollama. Streams a fixed reply word by word as NDJSON frames;
+/api/generate without a prompt "loads" a model and /api/ps lists them.
+Set first_token_delay to hold back the first frame, or status to make chat
+requests fail with that HTTP status. With prompt_token_delay the first frame
+also waits that long per prompt token (about 4 characters), like prompt
+evaluation does; options.num_predict cuts the reply to that many words.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _json(self, obj):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self._json({"models": [{"name": name, "model": name} for name in sorted(self.server.loaded)]})
+            return
+        if self.path == "/api/version":
+            self._json({"version": "0.0.0-fake"})
+            return
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        payload = json.loads(body or b"{}")
+        if self.path == "/api/generate":
+            self.server.warmups.append(payload)
+            self.server.loaded.add(payload.get("model"))
+            self._json({"model": payload.get("model"), "response": "", "done": True})
+            return
+        self.server.requests.append(payload)
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        reply = self.server.reply
+        if payload.get("stream", True) is False:
+            self._json({
+                "message": {"role": "assistant", "content": reply},
+                "done": True,
+                "prompt_eval_count": len(payload.get("messages", [])),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = reply.split(" ")
+        num_predict = (payload.get("options") or {}).get("num_predict", -1)
+        if num_predict > 0:
+            words = words[:num_predict]
+        prompt_chars = sum(len(m.get("content") or "") for m in payload.get("messages", []) if isinstance(m.get("content"), str))
+        if self.server.first_token_delay or self.server.prompt_token_delay:
+            time.sleep(self.server.first_token_delay + self.server.prompt_token_delay * prompt_chars / 4)
+        for i, word in enumerate(words):
+            piece = word if i == 0 else " " + word
+            self._chunk(json.dumps({"message": {"role": "assistant", "content": piece}, "done": False}) + "\n")
+            if self.server.delay:
+                time.sleep(self.server.delay)
+        self._chunk(json.dumps({
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "prompt_eval_count": len(payload.get("messages", [])),
+            "eval_count": len(words),
+        }) + "\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(reply="Hello there friend", delay=0.0):
+    """Start a fake server in a daemon thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    server.reply = reply
+    server.delay = delay
+    server.first_token_delay = 0.0
+    server.prompt_token_delay = 0.0
+    server.status = 200
+    server.requests = []
+    server.warmups = []
+    server.loaded = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
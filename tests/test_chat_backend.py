@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import chat_backend
+import ollama
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (chat_backend.CHAT_FOLDER, chat_backend.BACKUP_CHAT_FOLDER,
+                         chat_backend.STORAGE_BACKEND, chat_backend.CACHE_CHECK_INTERVAL)
+        chat_backend.CHAT_FOLDER = os.path.join(self.tmpdir.name, "chat_data")
+        chat_backend.BACKUP_CHAT_FOLDER = os.path.join(self.tmpdir.name, "backup")
+        chat_backend.STORAGE_BACKEND = "file"
+        os.makedirs(chat_backend.CHAT_FOLDER)
+        os.makedirs(chat_backend.BACKUP_CHAT_FOLDER)
+        chat_backend.clear_cache()
+
+    def tearDown(self):
+        (chat_backend.CHAT_FOLDER, chat_backend.BACKUP_CHAT_FOLDER,
+         chat_backend.STORAGE_BACKEND, chat_backend.CACHE_CHECK_INTERVAL) = self.original
+        chat_backend.clear_cache()
+        self.tmpdir.cleanup()
+
+    def create(self, name):
+        chat_backend.save_metadata(chat_backend.new_metadata(name, f"You are {name}."))
+        chat_backend.save_chat(name, {"history": []})
+
+    def test_steady_state_does_no_filesystem_reads(self):
+        self.create("Bob")
+        self.assertEqual(chat_backend.get_character_list(), ["Bob"])
+        with mock.patch("os.stat") as stat, mock.patch("builtins.open") as opened, mock.patch("os.listdir") as listdir:
+            for _ in range(3):
+                self.assertEqual(chat_backend.get_metadata("Bob")["system_prompt"], "You are Bob.")
+                self.assertEqual(chat_backend.get_character_list(), ["Bob"])
+        self.assertFalse(stat.called or opened.called or listdir.called)
+        self.assertEqual(chat_backend.cache_stats()["hits"], 6)
+
+    def test_callers_get_copies(self):
+        self.create("Bob")
+        chat_backend.get_metadata("Bob")["system_prompt"] = "changed"
+        self.assertEqual(chat_backend.get_metadata("Bob")["system_prompt"], "You are Bob.")
+
+    def test_own_writes_update_the_cache(self):
+        self.create("Bob")
+        self.create("Eve")
+        self.assertEqual(sorted(chat_backend.load_characters_list()), ["Bob", "Eve"])
+
+        metadata = chat_backend.get_metadata("Bob")
+        metadata["system_prompt"] = "You are Robert."
+        chat_backend.save_metadata(metadata)
+        self.assertEqual(chat_backend.load_chat("Bob")[1]["system_prompt"], "You are Robert.")
+
+        chat_backend.remove_chat("Eve")
+        self.assertEqual(chat_backend.load_characters_list(), ["Bob"])
+        self.assertIsNone(chat_backend.get_metadata("Eve"))
+
+    def test_outside_edits_are_seen_after_check_interval(self):
+        chat_backend.CACHE_CHECK_INTERVAL = 0.05
+        self.create("Bob")
+        chat_backend.get_metadata("Bob")
+
+        with open(chat_backend.get_metadata_file_path("Bob"), "w", encoding="utf-8") as f:
+            json.dump({"name": "Bob", "system_prompt": "Edited by hand, longer than before."}, f)
+        os.makedirs(os.path.join(chat_backend.CHAT_FOLDER, "Zed"))
+        time.sleep(0.1)
+
+        self.assertEqual(chat_backend.get_metadata("Bob")["system_prompt"], "Edited by hand, longer than before.")
+        self.assertEqual(sorted(chat_backend.get_character_list()), ["Bob", "Zed"])
+        self.assertGreaterEqual(chat_backend.cache_stats()["misses"], 2)
+
+class TestConcurrentSessions(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (chat_backend.CHAT_FOLDER, chat_backend.INDEX_FILE, chat_backend.STORAGE_BACKEND)
+        chat_backend.CHAT_FOLDER = os.path.join(self.tmpdir.name, "chat_data")
+        chat_backend.INDEX_FILE = os.path.join(chat_backend.CHAT_FOLDER, "chats_index.json")
+        chat_backend.STORAGE_BACKEND = "file"
+        os.makedirs(chat_backend.CHAT_FOLDER)
+        chat_backend.clear_cache()
+
+    def tearDown(self):
+        chat_backend.CHAT_FOLDER, chat_backend.INDEX_FILE, chat_backend.STORAGE_BACKEND = self.original
+        chat_backend.clear_cache()
+        self.tmpdir.cleanup()
+
+    def test_two_tabs_appending_keep_both_turns(self):
+        chat_backend.append_messages("Bob", [{"role": "user", "content": "Hi"}], {"system_prompt": "You are Bob."})
+        tab_b, _ = chat_backend.load_chat("Bob")
+
+        chat_backend.append_messages("Bob", [{"role": "user", "content": "A?"}, {"role": "assistant", "content": "A!"}])
+        chat_backend.append_messages("Bob", [{"role": "user", "content": "B?"}, {"role": "assistant", "content": "B!"}])
+        chat_data, _ = chat_backend.load_chat("Bob")
+        self.assertEqual([m["content"] for m in chat_data["history"]], ["Hi", "A?", "A!", "B?", "B!"])
+        self.assertEqual(chat_data["system_prompt"], "You are Bob.")
+
+        # A whole-history save from a tab that missed those turns is refused
+        tab_b["history"].append({"role": "user", "content": "stale"})
+        with self.assertRaises(chat_backend.chat_journal.VersionConflict):
+            chat_backend.save_chat("Bob", tab_b, expected_version=tab_b["version"])
+
+    def test_index_updates_are_not_lost(self):
+        threads = [threading.Thread(target=chat_backend.save_index, args=(f"char{i}", {"n": i})) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(sorted(chat_backend.load_index()), sorted(f"char{i}" for i in range(8)))
+
+        index = chat_backend.remove_from_index("char0", {})
+        self.assertNotIn("char0", index)
+        self.assertEqual(len(chat_backend.load_index()), 7)
+
+    def test_failed_metadata_and_summary_writes_keep_the_old_file(self):
+        metadata = chat_backend.new_metadata("Bob", "You are Bob.")
+        chat_backend.save_metadata(metadata)
+        chat_backend.save_summary("Bob", {"summary": "Bob met Alice.", "covered": 2})
+
+        # A write that dies half way (crash, full disk) leaves the previous file in place
+        with mock.patch("json.dump", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                chat_backend.save_metadata(dict(metadata, system_prompt="You are Eve."))
+            with self.assertRaises(OSError):
+                chat_backend.save_summary("Bob", {"summary": "lost", "covered": 4})
+        chat_backend.clear_cache()
+        self.assertEqual(chat_backend.get_metadata("Bob"), metadata)
+        self.assertEqual(chat_backend.load_summary("Bob"), {"summary": "Bob met Alice.", "covered": 2})
+
+class TestHistoryWindow(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (chat_backend.CHAT_FOLDER, chat_backend.STORAGE_BACKEND)
+        chat_backend.CHAT_FOLDER = os.path.join(self.tmpdir.name, "chat_data")
+        chat_backend.STORAGE_BACKEND = "file"
+        chat_backend.clear_cache()
+        self.history = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "word " * 40}
+            for i in range(300)
+        ]
+        for name in ("Bob", "Eve"):
+            chat_backend.save_chat(name, {"system_prompt": "You are Bob.", "history": list(self.history)})
+
+    def tearDown(self):
+        chat_backend.CHAT_FOLDER, chat_backend.STORAGE_BACKEND = self.original
+        chat_backend.clear_cache()
+        self.tmpdir.cleanup()
+
+    def test_window_and_paging(self):
+        window, start = chat_backend.load_history_window("Bob", 20)
+        self.assertEqual((window, start), (self.history[280:], 280))
+        self.assertEqual(chat_backend.load_history_window("Bob", 20, before=start), (self.history[260:280], 260))
+        self.assertEqual(chat_backend.load_history_window("Nobody"), ([], 0))
+
+    def test_prompt_from_a_window_matches_the_whole_history(self):
+        window, start = chat_backend.load_history_window("Bob", 20)
+        for summary in (None, {"summary": "Bob met Alice.", "covered": 250}, {"summary": "Long ago.", "covered": 10}):
+            if summary:
+                chat_backend.save_summary("Bob", summary)
+            history, window_summary = chat_backend.prompt_context("Bob", window, start)
+            self.assertEqual(ollama.build_messages("You are Bob.", history, window_summary),
+                             ollama.build_messages("You are Bob.", self.history, summary))
+
+    def test_summary_refresh_from_a_window_matches_the_whole_history(self):
+        chat_backend.save_summary("Bob", {"summary": "Earlier.", "covered": 100})
+        chat_backend.save_summary("Eve", {"summary": "Earlier.", "covered": 100})
+        window, start = chat_backend.load_history_window("Eve", 20)
+        with mock.patch.object(chat_backend.ollama, "summarize_conversation", return_value="Later.") as summarize:
+            chat_backend.refresh_summary("Bob", "You are Bob.", self.history, 2000)
+            chat_backend.refresh_summary("Eve", "You are Bob.", window, 2000, start)
+        self.assertEqual(summarize.call_args_list[0], summarize.call_args_list[1])
+        self.assertEqual(chat_backend.load_summary("Eve")["covered"], chat_backend.load_summary("Bob")["covered"])
+
+    def test_stream_reads_the_prompt_off_the_event_loop(self):
+        window, start = chat_backend.load_history_window("Bob", 20)
+        prompt_context = chat_backend.prompt_context
+        threads = []
+
+        def slow_prompt_context(*args):
+            threads.append(threading.get_ident())
+            time.sleep(0.2)
+            return prompt_context(*args)
+
+        async def fake_stream(system_prompt, history, summary=None, profile=None):
+            yield len(history)
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            stream = chat_backend.make_async_stream_fn("You are Bob.", "Bob")(window, start)
+            result = [delta async for delta in stream]
+            ticker.cancel()
+            return result, ticks
+
+        with mock.patch.object(chat_backend, "prompt_context", side_effect=slow_prompt_context), \
+                mock.patch.object(chat_backend.ollama, "async_stream_chat", side_effect=fake_stream):
+            result, ticks = asyncio.run(run())
+        self.assertEqual(result, [len(prompt_context("Bob", window, start)[0])])
+        self.assertNotEqual(threads, [threading.get_ident()])
+        # Other sessions' tasks kept running while the prompt was read
+        self.assertGreater(ticks, 5)
+
+if __name__ == '__main__':
+    unittest.main()
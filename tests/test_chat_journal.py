@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import unittest
+import multiprocessing
+from unittest import mock
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import chat_journal
+
+def append_turns(path, writer, turns):
+    # Runs in a separate process
+    for i in range(turns):
+        chat_journal.append(path, [{"role": "user", "content": f"{writer}-{i}"}, {"role": "assistant", "content": f"{writer}-{i}"}])
+
+class TestChatJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "chat.json")
+
+    def tearDown(self):
+        chat_journal.forget(self.path)
+        self.tmpdir.cleanup()
+
+    def test_appends_only_new_messages(self):
+        history = [{"role": "user", "content": "Hi"}]
+        chat_journal.save(self.path, {"history": list(history)})
+        snapshot_mtime = os.path.getmtime(self.path)
+
+        history.append({"role": "assistant", "content": "Hello"})
+        chat_journal.save(self.path, {"history": list(history)})
+
+        with open(chat_journal.get_journal_path(self.path), "r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["seq"], 1)
+        self.assertEqual(os.path.getmtime(self.path), snapshot_mtime)
+
+        chat_journal.forget(self.path)
+        self.assertEqual(chat_journal.load(self.path)["history"], history)
+
+    def test_legacy_chat_json_is_read_as_snapshot(self):
+        history = [{"role": "user", "content": "Old message"}]
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"history": history, "system_prompt": ""}, f, indent=2)
+
+        chat_data = chat_journal.load(self.path)
+        self.assertEqual(chat_data["history"], history)
+
+        chat_data["history"].append({"role": "assistant", "content": "New"})
+        chat_journal.save(self.path, chat_data)
+        chat_journal.forget(self.path)
+        self.assertEqual(len(chat_journal.load(self.path)["history"]), 2)
+
+    def test_rewrite_discards_stale_journal(self):
+        history = [{"role": "user", "content": str(i)} for i in range(3)]
+        chat_journal.save(self.path, {"history": history[:1]})
+        chat_journal.save(self.path, {"history": history})
+        chat_journal.save(self.path, {"history": [{"role": "user", "content": "reset"}]})
+
+        chat_journal.forget(self.path)
+        self.assertEqual(chat_journal.load(self.path)["history"], [{"role": "user", "content": "reset"}])
+
+    def test_compact_folds_journal_into_snapshot(self):
+        history = []
+        for i in range(5):
+            history.append({"role": "user", "content": str(i)})
+            chat_journal.save(self.path, {"history": list(history)})
+
+        chat_journal.compact(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)["history"]), 5)
+        with open(chat_journal.get_journal_path(self.path), "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "")
+
+        chat_journal.forget(self.path)
+        self.assertEqual(chat_journal.load(self.path)["history"], history)
+
+    def test_version_check_refuses_stale_overwrite(self):
+        chat_journal.save(self.path, {"history": [{"role": "user", "content": "Hi"}]})
+        tab_a = chat_journal.load(self.path)
+        tab_b = chat_journal.load(self.path)
+
+        tab_a["history"].append({"role": "assistant", "content": "from A"})
+        version = chat_journal.save(self.path, tab_a, expected_version=tab_a[chat_journal.VERSION_KEY])
+        self.assertEqual(version, chat_journal.version_of(tab_a["history"]))
+
+        tab_b["history"].append({"role": "assistant", "content": "from B"})
+        with self.assertRaises(chat_journal.VersionConflict):
+            chat_journal.save(self.path, tab_b, expected_version=tab_b[chat_journal.VERSION_KEY])
+        self.assertEqual(chat_journal.load(self.path)["history"][-1]["content"], "from A")
+        self.assertNotIn(chat_journal.VERSION_KEY, json.load(open(self.path, encoding="utf-8")))
+
+    def test_append_merges_concurrent_turns(self):
+        chat_journal.save(self.path, {"history": [{"role": "user", "content": "Hi"}]})
+        chat_journal.append(self.path, [{"role": "assistant", "content": "A"}])
+        # A write from elsewhere that this process has not seen
+        with open(chat_journal.get_journal_path(self.path), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"epoch": 0, "seq": 2, "message": {"role": "user", "content": "other process"}}) + "\n")
+        version = chat_journal.append(self.path, [{"role": "assistant", "content": "B"}])
+
+        history = chat_journal.load(self.path)["history"]
+        self.assertEqual([m["content"] for m in history], ["Hi", "A", "other process", "B"])
+        self.assertEqual(version, chat_journal.version_of(history))
+
+    def test_appends_from_several_processes_are_all_kept(self):
+        chat_journal.save(self.path, {"history": []})
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=append_turns, args=(self.path, writer, 20)) for writer in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+
+        history = chat_journal.load(self.path)["history"]
+        self.assertEqual(len(history), 4 * 20 * 2)
+        # Each turn stays together and each writer's turns stay in order
+        for user, reply in zip(history[::2], history[1::2]):
+            self.assertEqual(user["content"], reply["content"])
+        for writer in range(4):
+            own = [m["content"] for m in history[::2] if m["content"].startswith(f"{writer}-")]
+            self.assertEqual(own, [f"{writer}-{i}" for i in range(20)])
+
+    def test_window_reads_tail_and_pages_back(self):
+        history = [{"role": "user", "content": f"m{i} \"quoted\", ünïcode"} for i in range(30)]
+        chat_journal.save(self.path, {"system_prompt": "You are Bob.", "history": history[:25]})
+        chat_journal.append(self.path, history[25:])
+        self.assertTrue(os.path.exists(chat_journal.get_index_path(self.path)))
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["history"], history[:25])
+
+        # The snapshot is only read through its index
+        with mock.patch("json.load", side_effect=AssertionError("full read")):
+            self.assertEqual(chat_journal.load_window(self.path, 10), (history[20:], 20))
+            self.assertEqual(chat_journal.load_window(self.path, 10, before=20), (history[10:20], 10))
+            self.assertEqual(chat_journal.load_window(self.path, 10, before=5), (history[:5], 0))
+            self.assertEqual(chat_journal.load_window(self.path, 50), (history, 0))
+        self.assertIsNone(chat_journal.load_window(os.path.join(self.tmpdir.name, "none.json"), 10))
+
+    def test_window_without_index_falls_back_and_builds_one(self):
+        history = [{"role": "user", "content": str(i)} for i in range(8)]
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"history": history, "system_prompt": ""}, f, indent=2)
+
+        self.assertEqual(chat_journal.load_window(self.path, 3), (history[5:], 5))
+        self.wait_for_compaction()
+        with mock.patch("json.load", side_effect=AssertionError("full read")):
+            self.assertEqual(chat_journal.load_window(self.path, 3, before=4), (history[1:4], 1))
+
+        # An edit by hand makes the index stale; the window is still right
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"history": history[:6]}, f)
+        self.assertEqual(chat_journal.load_window(self.path, 3), (history[3:6], 3))
+        self.wait_for_compaction()
+
+    def test_window_loads_on_legacy_chat_start_one_compaction(self):
+        history = [{"role": "user", "content": f"Message {i} " * 10} for i in range(20000)]
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"history": history, "system_prompt": ""}, f)
+        message = {"role": "assistant", "content": "new"}
+
+        compact = chat_journal.compact
+        with mock.patch("chat_journal.compact", side_effect=compact) as compaction:
+            chat_journal.load_window(self.path, 50)
+            chat_journal.append(self.path, [message])
+            self.assertEqual(chat_journal.load_window(self.path, 50, before=100), (history[50:100], 50))
+            self.wait_for_compaction()
+        self.assertEqual(compaction.call_count, 1)
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            json.load(f)
+        self.assertEqual(chat_journal.load(self.path)["history"], history + [message])
+
+    def wait_for_compaction(self):
+        # Compaction writes the index in the background
+        for _ in range(100):
+            if not chat_journal._states[self.path]["compacting"]:
+                return
+            time.sleep(0.05)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import chat_render
+
+class TestChatRender(unittest.TestCase):
+    def setUp(self):
+        chat_render.clear_cache()
+
+    def test_messages_are_formatted_once(self):
+        history = [
+            {"role": "user", "content": "*waves* hi"},
+            {"role": "assistant", "content": "(smiles) hello"},
+            {"role": "system", "content": "ignored"},
+        ]
+        first = chat_render.render_history(history)
+        second = chat_render.render_history(history)
+
+        self.assertEqual(first, [
+            {"role": "user", "content": "***waves*** hi"},
+            {"role": "assistant", "content": "***smiles*** hello"},
+        ])
+        self.assertIs(first[0], second[0])
+        self.assertEqual(chat_render.cache_stats()["misses"], 2)
+        self.assertEqual(chat_render.cache_stats()["hits"], 2)
+
+    def test_images_and_streaming_tail(self):
+        prefix = chat_render.render_history([{"role": "assistant", "content": {"type": "image", "path": "a.png"}}])
+        self.assertEqual(prefix, [{"role": "assistant", "content": "a.png"}])
+
+        frame = chat_render.render_with_tail(prefix, "assistant", "*typ")
+        self.assertEqual(frame[-1], {"role": "assistant", "content": "*typ"})
+        self.assertEqual(chat_render.cache_stats()["size"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
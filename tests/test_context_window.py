@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import context_window
+
+def make_history(count, words=40):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "word " * words}
+        for i in range(count)
+    ]
+
+class TestContextWindow(unittest.TestCase):
+    def test_short_history_is_sent_verbatim(self):
+        history = make_history(4)
+        summary_text, recent = context_window.select_context("You are Bob.", history, budget=4096)
+        self.assertIsNone(summary_text)
+        self.assertEqual(recent, history)
+
+    def test_long_history_is_cut_to_budget(self):
+        history = make_history(200)
+        _, recent = context_window.select_context("You are Bob.", history, budget=1000)
+        self.assertLess(len(recent), len(history))
+        self.assertEqual(recent[-1], history[-1])
+        used = sum(context_window.estimate_tokens(m["content"]) for m in recent)
+        self.assertLessEqual(used, 1000)
+
+    def test_list_content_is_counted_by_its_text(self):
+        # Chatbot values come back from Gradio as lists of text blocks
+        text = "message " + "word " * 400
+        self.assertEqual(context_window.estimate_tokens([{"type": "text", "text": text}]), context_window.estimate_tokens(text))
+        self.assertEqual(
+            context_window.estimate_tokens([{"type": "text", "text": text}, {"type": "file", "path": "a.png"}]),
+            context_window.estimate_tokens(text) + context_window.NON_TEXT_TOKENS,
+        )
+
+        # The same window as with plain strings
+        plain = make_history(200)
+        history = [{"role": m["role"], "content": [{"type": "text", "text": m["content"]}]} for m in plain]
+        _, recent = context_window.select_context("You are Bob.", history, budget=1000)
+        _, recent_plain = context_window.select_context("You are Bob.", plain, budget=1000)
+        self.assertEqual(len(recent), len(recent_plain))
+        self.assertLess(len(recent), len(history))
+
+    def test_summary_replaces_covered_messages(self):
+        history = make_history(10)
+        summary = {"summary": "Bob met Alice.", "covered": 6}
+        summary_text, recent = context_window.select_context("", history, summary, budget=100000)
+        self.assertEqual(summary_text, "Bob met Alice.")
+        self.assertEqual(recent, history[6:])
+
+    def test_stale_summary_is_ignored(self):
+        history = make_history(3)
+        summary = {"summary": "Too far ahead.", "covered": 8}
+        summary_text, recent = context_window.select_context("", history, summary, budget=100000)
+        self.assertIsNone(summary_text)
+        self.assertEqual(recent, history)
+
+    def test_pending_range_only_when_window_overflows(self):
+        self.assertIsNone(context_window.pending_summary_range("", make_history(4), budget=4096))
+
+        history = make_history(200)
+        first, last = context_window.pending_summary_range("", history, budget=1000)
+        self.assertEqual(first, 0)
+        _, recent = context_window.select_context("", history, budget=1000)
+        self.assertGreater(last, len(history) - len(recent))
+
+    def test_summary_for_window(self):
+        history = make_history(10)
+        summary = {"summary": "Bob met Alice.", "covered": 6}
+        # The window history[4:] sees the summary covering its first two messages
+        self.assertEqual(context_window.select_context("", history[4:], context_window.summary_for_window(summary, 4), budget=100000),
+                         context_window.select_context("", history, summary, budget=100000))
+        # A summary of messages before the window still applies, but covers nothing in it
+        summary_text, recent = context_window.select_context("", history[8:], context_window.summary_for_window(summary, 8), budget=100000)
+        self.assertEqual((summary_text, recent), ("Bob met Alice.", history[8:]))
+        self.assertIs(context_window.summary_for_window(summary, 0), summary)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import http_client
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_POST(self):
+        EchoHandler.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        data = json.dumps({"echo": json.loads(body or b"{}")}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestHttpClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/api/chat"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        http_client.configure("test", pool_size=2, connect_timeout=2, read_timeout=5, retries=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_connections_are_reused(self):
+        EchoHandler.connections.clear()
+        for i in range(5):
+            response = http_client.post("test", self.url, json={"n": i})
+            self.assertEqual(response.json()["echo"], {"n": i})
+        self.assertEqual(len(EchoHandler.connections), 1)
+
+        stats = http_client.pool_stats()["test"]
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["idle"], 1)
+        self.assertGreaterEqual(stats["requests"], 5)
+
+    def test_stream_releases_connection(self):
+        with http_client.stream("test", self.url, json={}) as response:
+            self.assertEqual(http_client.pool_stats()["test"]["in_use"], 1)
+            response.raise_for_status()
+        self.assertEqual(http_client.pool_stats()["test"]["in_use"], 0)
+
+    def test_async_clients_are_closed_with_their_loop(self):
+        async def request():
+            client = http_client.get_async_client("test")
+            self.assertIs(http_client.get_async_client("test"), client)
+            response = await client.post(self.url, json={"n": 1})
+            self.assertEqual(response.json()["echo"], {"n": 1})
+            return client
+
+        first = asyncio.run(request())
+        second = asyncio.run(request())
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed and second.is_closed)
+        self.assertEqual(http_client._async_clients, {})
+
+if __name__ == '__main__':
+    unittest.main()
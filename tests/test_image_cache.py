@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import base64
+import tempfile
+import threading
+import unittest
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import image_cache
+import image_jobs
+import stable_diffusion
+from PIL import Image
+
+def png_bytes(color=(255, 0, 0)):
+    buffer = BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+class FakeA1111Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    calls = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        FakeA1111Handler.calls += 1
+        data = json.dumps({"images": [base64.b64encode(png_bytes()).decode("ascii")], "info": "{}"}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class InterruptibleA1111Handler(BaseHTTPRequestHandler):
+    """Renders until /sdapi/v1/interrupt is posted, then returns the partial image, as A1111 does."""
+    protocol_version = "HTTP/1.1"
+    rendering = threading.Event()
+    interrupted = threading.Event()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/interrupt"):
+            InterruptibleA1111Handler.interrupted.set()
+            self.reply({})
+            return
+        InterruptibleA1111Handler.rendering.set()
+        InterruptibleA1111Handler.interrupted.wait(5)
+        self.reply({"images": [base64.b64encode(png_bytes((0, 0, 255))).decode("ascii")], "info": "{}"})
+
+    def do_GET(self):
+        self.reply({"progress": 0.5, "eta_relative": 1, "state": {"interrupted": InterruptibleA1111Handler.interrupted.is_set()}})
+
+    def reply(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = image_cache.CACHE_DIR
+        self.original_max = image_cache.MAX_BYTES
+        image_cache.reset(self.tmpdir.name)
+
+    def tearDown(self):
+        image_cache.MAX_BYTES = self.original_max
+        image_cache.reset(self.original_dir)
+        self.tmpdir.cleanup()
+
+    def test_key_is_canonical_and_seed_gated(self):
+        self.assertEqual(image_cache.key_for({"a": 1, "b": 2}), image_cache.key_for({"b": 2, "a": 1}))
+        self.assertFalse(image_cache.is_cacheable({"seed": -1}))
+        self.assertFalse(image_cache.is_cacheable({}))
+        self.assertTrue(image_cache.is_cacheable({"seed": 42}))
+
+    def test_put_get_and_lru_eviction(self):
+        image_cache.MAX_BYTES = 25
+        image_cache.put("a", b"0123456789", "{}")
+        image_cache.put("b", b"0123456789", "{}")
+        self.assertEqual(image_cache.get("a"), (b"0123456789", "{}"))
+        image_cache.put("c", b"0123456789", "{}")
+
+        self.assertIsNone(image_cache.get("b"))
+        self.assertIsNotNone(image_cache.get("a"))
+        stats = image_cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_generate_image_uses_cache_for_fixed_seed(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeA1111Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        original_url = stable_diffusion.A1111_URL
+        stable_diffusion.A1111_URL = f"http://127.0.0.1:{server.server_address[1]}"
+        FakeA1111Handler.calls = 0
+        try:
+            stable_diffusion.generate_image({"prompt": "cat"}, 7, os.path.join(self.tmpdir.name, "out.png"))
+            stable_diffusion.generate_image({"prompt": "cat"}, 7, os.path.join(self.tmpdir.name, "out.png"))
+            self.assertEqual(FakeA1111Handler.calls, 1)
+
+            stable_diffusion.generate_image({"prompt": "cat"}, -1, os.path.join(self.tmpdir.name, "out.png"))
+            stable_diffusion.generate_image({"prompt": "cat"}, -1, os.path.join(self.tmpdir.name, "out.png"))
+            self.assertEqual(FakeA1111Handler.calls, 3)
+        finally:
+            stable_diffusion.A1111_URL = original_url
+            server.shutdown()
+            server.server_close()
+
+    def test_cancelled_render_keeps_avatar_and_cache(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), InterruptibleA1111Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        original_url = stable_diffusion.A1111_URL
+        stable_diffusion.A1111_URL = f"http://127.0.0.1:{server.server_address[1]}"
+        folder = os.path.join(self.tmpdir.name, "avatar")
+        os.makedirs(folder)
+        path = os.path.join(folder, "avatar.png")
+        with open(path, "wb") as f:
+            f.write(png_bytes())
+        payload = {"prompt": "cat"}
+
+        def render():
+            with image_jobs.stage("render"):
+                return stable_diffusion.generate_image(payload, 7, path)
+
+        try:
+            for cancel in (True, False):
+                InterruptibleA1111Handler.rendering.clear()
+                InterruptibleA1111Handler.interrupted.clear()
+                job_id = stable_diffusion.submit_image_job(render, label="Bob")
+                self.assertTrue(InterruptibleA1111Handler.rendering.wait(5))
+                if cancel:
+                    self.assertTrue(image_jobs.cancel(job_id))
+                else:
+                    # Interrupted from A1111's own UI
+                    stable_diffusion.interrupt()
+                self.assertIsNone(image_jobs.wait(job_id, timeout=10))
+                self.assertEqual(image_jobs.get_job(job_id)["status"], "cancelled")
+
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), png_bytes())
+                self.assertEqual(os.listdir(folder), ["avatar.png"])
+                self.assertIsNone(image_cache.get(image_cache.key_for(payload)))
+        finally:
+            stable_diffusion.A1111_URL = original_url
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
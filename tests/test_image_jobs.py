@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import image_jobs
+
+class TestImageJobs(unittest.TestCase):
+    def setUp(self):
+        self.original_interval = image_jobs.POLL_INTERVAL
+        image_jobs.POLL_INTERVAL = 0.01
+
+    def tearDown(self):
+        image_jobs.POLL_INTERVAL = self.original_interval
+
+    def test_job_reports_progress_and_result(self):
+        release = threading.Event()
+
+        def render():
+            release.wait(5)
+            return "avatar.png"
+
+        job_id = image_jobs.submit(render, progress_fn=lambda: {"progress": 0.5, "eta": 3, "preview": b"png"}, label="Bob")
+        self.assertIn(image_jobs.get_job(job_id)["status"], ("queued", "running"))
+
+        for _ in range(500):
+            if image_jobs.get_job(job_id)["progress"] == 0.5:
+                break
+            threading.Event().wait(0.01)
+        job = image_jobs.get_job(job_id)
+        self.assertEqual(job["progress"], 0.5)
+        self.assertTrue(os.path.exists(job["preview"]))
+
+        release.set()
+        self.assertEqual(image_jobs.wait(job_id, timeout=5), "avatar.png")
+        job = image_jobs.get_job(job_id)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"], "avatar.png")
+
+    def test_cancel_running_job(self):
+        started = threading.Event()
+        interrupted = threading.Event()
+
+        def render():
+            started.set()
+            interrupted.wait(5)
+            return "partial.png"
+
+        job_id = image_jobs.submit(render, cancel_fn=interrupted.set, label="Bob")
+        started.wait(5)
+        self.assertTrue(image_jobs.cancel(job_id))
+        self.assertIsNone(image_jobs.wait(job_id, timeout=5))
+        self.assertEqual(image_jobs.get_job(job_id)["status"], "cancelled")
+        self.assertFalse(image_jobs.cancel(job_id))
+
+    def test_cancel_before_the_render_stage_skips_it(self):
+        in_prompt = threading.Event()
+        release = threading.Event()
+        interrupts = []
+        rendered = []
+
+        def render():
+            with image_jobs.stage("prompt"):
+                in_prompt.set()
+                release.wait(5)
+            with image_jobs.stage("render"):
+                rendered.append(True)
+            return "avatar.png"
+
+        job_id = image_jobs.submit(render, cancel_fn=lambda: interrupts.append(True), cancel_stage="render", label="Bob")
+        in_prompt.wait(5)
+        self.assertTrue(image_jobs.cancel(job_id))
+        release.set()
+        self.assertIsNone(image_jobs.wait(job_id, timeout=5))
+        job = image_jobs.get_job(job_id)
+        self.assertEqual(job["status"], "cancelled")
+        self.assertIsNone(job["error"])
+        # The idle backend was not interrupted, and the render never started
+        self.assertEqual((interrupts, rendered), ([], []))
+
+    def test_cancel_in_the_render_stage_interrupts(self):
+        in_render = threading.Event()
+        interrupted = threading.Event()
+
+        def render():
+            with image_jobs.stage("render"):
+                in_render.set()
+                interrupted.wait(5)
+            return "partial.png"
+
+        job_id = image_jobs.submit(render, cancel_fn=interrupted.set, cancel_stage="render", label="Bob")
+        in_render.wait(5)
+        image_jobs.cancel(job_id)
+        self.assertIsNone(image_jobs.wait(job_id, timeout=5))
+        self.assertTrue(interrupted.is_set())
+        self.assertEqual(image_jobs.get_job(job_id)["status"], "cancelled")
+
+    def test_stages_are_timed(self):
+        in_render = threading.Event()
+        release = threading.Event()
+
+        def render():
+            with image_jobs.stage("prompt"):
+                time.sleep(0.05)
+            with image_jobs.stage("render"):
+                in_render.set()
+                release.wait(5)
+            return "avatar.png"
+
+        job_id = image_jobs.submit(render, label="Eve")
+        in_render.wait(5)
+        job = image_jobs.get_job(job_id)
+        self.assertEqual(job["stage"], "render")
+        self.assertEqual(list(job["stages"]), ["prompt"])
+        self.assertGreaterEqual(job["stages"]["prompt"], 0.05)
+
+        release.set()
+        image_jobs.wait(job_id, timeout=5)
+        job = image_jobs.get_job(job_id)
+        self.assertIsNone(job["stage"])
+        self.assertEqual(list(job["stages"]), ["prompt", "render"])
+
+        # Outside a job stage() is a no-op
+        with image_jobs.stage("prompt"):
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
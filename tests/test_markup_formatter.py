@@ -0,0 +1,74 @@
+import os
+import re
+import sys
+import random
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from markup_formatter import StreamingFormatter, italics_to_bold
+
+def regex_italics_to_bold(text):
+    """The four-regex implementation the formatter replaces."""
+    text = re.sub(r'(?<!\*)\*(?!\*)(.*?)\*(?!\*)', r'***\1***', text)
+    text = re.sub(r'_(.*?)_', r'***\1***', text)
+    text = re.sub(r'\(([^)]+)\)', r'***\1***', text)
+    text = re.sub(r'\[([^\]]+)\]', r'***\1***', text)
+    return text
+
+CORPUS = [
+    "",
+    "Plain text without markup.",
+    "*waves* Hello there!",
+    "_whispers_ and (smiles) then [leans in]",
+    "**bold** stays bold",
+    "***already formatted***",
+    "*a **b* c",
+    "*unclosed star\nnext line*",
+    "_one\ntwo_",
+    "(multi\nline)",
+    "() and [] are empty",
+    "((nested) parens)",
+    "[a (b] c)",
+    "snake_case_name and *x*y*",
+    "*\n*",
+    "She said (quietly [with a grin]) *nods*",
+    "3 * 4 = 12 and 5 * 6 = 30",
+    "trailing star *",
+]
+
+class TestMarkupFormatter(unittest.TestCase):
+    def test_conformance_corpus(self):
+        for text in CORPUS:
+            with self.subTest(text=text):
+                self.assertEqual(italics_to_bold(text), regex_italics_to_bold(text))
+
+    def test_random_conformance_with_chunked_stream(self):
+        rnd = random.Random(42)
+        alphabet = "**__()[]\nab "
+        for _ in range(5000):
+            text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 40)))
+            expected = regex_italics_to_bold(text)
+            self.assertEqual(italics_to_bold(text), expected, repr(text))
+
+            formatter = StreamingFormatter()
+            output = []
+            position = 0
+            while position < len(text):
+                step = rnd.randint(1, 5)
+                output.append(formatter.feed(text[position:position + step]))
+                position += step
+                self.assertEqual("".join(output) + formatter.preview(), regex_italics_to_bold(text[:position]))
+            output.append(formatter.finish())
+            self.assertEqual("".join(output), expected, repr(text))
+
+    def test_feed_only_emits_final_text(self):
+        formatter = StreamingFormatter()
+        self.assertEqual(formatter.feed("Hi (wav"), "Hi ")
+        self.assertEqual(formatter.preview(), "(wav")
+        self.assertEqual(formatter.feed("es) there"), "***waves*** there")
+        self.assertEqual(formatter.finish(), "")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import model_residency
+import ollama_pool
+import ollama
+import fake_ollama
+
+class TestModelResidency(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, cls.base_url = fake_ollama.start("portrait of Bob")
+        cls.original = (ollama_pool.endpoints(), model_residency.ROUTE_TO_RESIDENT, model_residency.PROMPTER_MAX_DEFER)
+        ollama_pool.configure([cls.base_url])
+
+    @classmethod
+    def tearDownClass(cls):
+        endpoints, model_residency.ROUTE_TO_RESIDENT, model_residency.PROMPTER_MAX_DEFER = cls.original
+        ollama_pool.configure(endpoints)
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.loaded.clear()
+        self.server.warmups.clear()
+        model_residency.ROUTE_TO_RESIDENT = False
+        model_residency._forget_loaded()
+
+    def test_warm_up_pins_chat_model(self):
+        self.assertFalse(model_residency.is_resident(model_residency.CHAT_MODEL))
+        model_residency.warm_up_in_background().join(5)
+        self.assertEqual(self.server.warmups[-1], {"model": model_residency.CHAT_MODEL, "keep_alive": model_residency.CHAT_KEEP_ALIVE,
+                                                   "options": {"num_ctx": model_residency.CHAT_NUM_CTX}})
+        self.assertTrue(model_residency.is_resident(model_residency.CHAT_MODEL))
+        self.assertEqual(ollama.build_chat_payload("", [])["keep_alive"], model_residency.CHAT_KEEP_ALIVE)
+
+    def test_every_chat_model_request_loads_it_the_same_way(self):
+        # A different num_ctx would make Ollama reload the chat model
+        load = {"num_ctx": model_residency.CHAT_NUM_CTX}
+        for profile in ("Slow", "Average", "Fast"):
+            payload = ollama.build_chat_payload("", [{"role": "user", "content": "Hi"}], profile=profile)
+            self.assertEqual((payload["model"], payload["options"]["num_ctx"]), (model_residency.CHAT_MODEL, load["num_ctx"]))
+        self.assertEqual(model_residency.load_options(model_residency.CHAT_MODEL), load)
+        self.assertEqual(model_residency.load_options("prompter"), {})
+
+    def test_routing_to_resident_model_is_optional(self):
+        self.server.loaded.add(model_residency.CHAT_MODEL)
+        self.assertEqual(model_residency.choose_model("prompter"), "prompter")
+        model_residency.ROUTE_TO_RESIDENT = True
+        self.assertEqual(model_residency.choose_model("prompter"), model_residency.CHAT_MODEL)
+        self.server.loaded.add("prompter")
+        model_residency._forget_loaded()
+        self.assertEqual(model_residency.choose_model("prompter"), "prompter")
+
+    def test_prompter_waits_for_chat_then_rewarms_chat_model(self):
+        model_residency.PROMPTER_MAX_DEFER = 5
+        entered = threading.Event()
+
+        def prompter():
+            with model_residency.prompter_call("prompter"):
+                entered.set()
+
+        with model_residency.chat_activity():
+            thread = threading.Thread(target=prompter)
+            thread.start()
+            time.sleep(0.1)
+            self.assertFalse(entered.is_set())
+        thread.join(5)
+        self.assertTrue(entered.is_set())
+
+        # The chat model was not loaded, so it is warmed up again in the background
+        deadline = time.monotonic() + 5
+        while not self.server.warmups and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.warmups[-1]["model"], model_residency.CHAT_MODEL)
+
+    def test_prompter_defer_is_bounded(self):
+        model_residency.PROMPTER_MAX_DEFER = 0.1
+        self.server.loaded.add(model_residency.CHAT_MODEL)
+        with model_residency.chat_activity():
+            start = time.monotonic()
+            with model_residency.prompter_call("prompter"):
+                pass
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(self.server.warmups, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import os
+import sys
+import socket
+import time
+import asyncio
+import threading
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import ollama
+import ollama_pool
+import fake_ollama
+
+def dead_url():
+    # A port nothing listens on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+class TestOllamaPool(unittest.TestCase):
+    def setUp(self):
+        self.original_endpoints = ollama_pool.endpoints()
+        self.servers = []
+        self.urls = []
+        for reply in ("one", "two"):
+            server, url = fake_ollama.start(reply)
+            self.servers.append(server)
+            self.urls.append(url)
+        ollama_pool.configure(self.urls)
+
+    def tearDown(self):
+        ollama_pool.configure(self.original_endpoints)
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def reply(self, system_prompt):
+        return "".join(delta.text for delta in ollama.stream_chat(system_prompt, [{"role": "user", "content": "Hi"}]))
+
+    def test_least_outstanding_and_affinity(self):
+        with ollama_pool.track(self.urls[0]):
+            self.assertEqual(ollama_pool.candidates("Bob")[0], self.urls[1])
+        # Bob stays on the node that has his cache even when it is the busier one
+        with ollama_pool.track(self.urls[1]):
+            self.assertEqual(ollama_pool.candidates("Bob")[0], self.urls[1])
+            self.assertEqual(ollama_pool.candidates("Alice")[0], self.urls[0])
+
+        self.assertEqual(self.reply("You are Bob."), self.reply("You are Bob."))
+        self.assertEqual(sum(len(server.requests) for server in self.servers), 2)
+        self.assertEqual(sorted(len(server.requests) for server in self.servers), [0, 2])
+
+    def test_concurrent_chats_spread_over_endpoints(self):
+        for server in self.servers:
+            server.delay = 0.05
+        threads = [threading.Thread(target=self.reply, args=(f"You are character {i}.",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual([len(server.requests) for server in self.servers], [2, 2])
+
+    def test_failover_before_first_token(self):
+        dead = dead_url()
+        ollama_pool.configure([dead, self.urls[0]])
+        ollama_pool.assign("You are Bob.", dead)
+
+        self.assertEqual(self.reply("You are Bob."), "one")
+        stats = ollama_pool.stats()
+        self.assertFalse(stats[dead]["healthy"])
+        self.assertEqual(stats[dead]["failures"], 1)
+        # The chat moved, and the next turn goes straight to the live node
+        self.assertEqual(ollama_pool.candidates("You are Bob.")[0], self.urls[0])
+
+        async def collect():
+            ollama_pool.assign("You are Eve.", dead)
+            ollama_pool.mark_healthy(dead)
+            return "".join([d.text async for d in ollama.async_stream_chat("You are Eve.", [{"role": "user", "content": "Hi"}])])
+
+        self.assertEqual(asyncio.run(collect()), "one")
+
+    def test_call_and_health_checks(self):
+        dead = dead_url()
+        ollama_pool.configure([dead, self.urls[1]])
+        ollama_pool.check_health()
+        self.assertEqual(ollama_pool.candidates()[0], self.urls[1])
+        self.assertEqual(ollama.summarize_conversation("", [{"role": "user", "content": "Hi"}]), "two")
+
+        ollama_pool.configure([dead])
+        with self.assertRaises(Exception):
+            ollama_pool.call(lambda base_url: ollama.http_client.post("ollama", base_url + "/api/chat", json={}, timeout=(1, 1)))
+        deltas = list(ollama.stream_chat("You are Bob.", [{"role": "user", "content": "Hi"}]))
+        self.assertIn("error", deltas[-1].stats)
+
+    def test_hedge_when_first_token_is_late(self):
+        # Endpoint one usually answers in 10 ms, so 0.25 s (HEDGE_MIN_DELAY) without a token is late
+        for _ in range(ollama_pool.TTFT_MIN_SAMPLES):
+            ollama_pool.record_ttft(self.urls[0], 0.01)
+        self.assertEqual(ollama_pool.hedge_delay(self.urls[0]), ollama_pool.HEDGE_MIN_DELAY)
+        self.servers[0].first_token_delay = 2.0
+        ollama_pool.assign("You are Bob.", self.urls[0])
+
+        start = time.monotonic()
+        self.assertEqual(self.reply("You are Bob."), "two")
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual([len(server.requests) for server in self.servers], [1, 1])
+        # The loser was cancelled and the chat follows the winner
+        self.assertEqual(ollama_pool.stats()[self.urls[0]]["outstanding"], 0)
+        self.assertEqual(ollama_pool.candidates("You are Bob.")[0], self.urls[1])
+
+    def test_no_hedge_without_enough_samples(self):
+        self.assertIsNone(ollama_pool.hedge_delay(self.urls[0]))
+        self.servers[0].first_token_delay = 0.3
+        ollama_pool.assign("You are Bob.", self.urls[0])
+        self.assertEqual(self.reply("You are Bob."), "one")
+        self.assertEqual([len(server.requests) for server in self.servers], [1, 0])
+
+    def test_circuit_breaker_fails_fast(self):
+        ollama_pool.configure([self.urls[0]])
+        self.servers[0].status = 500
+        for _ in range(ollama_pool.BREAKER_THRESHOLD):
+            deltas = list(ollama.stream_chat("You are Bob.", [{"role": "user", "content": "Hi"}]))
+            self.assertIn("error", deltas[-1].stats)
+        self.assertEqual(len(self.servers[0].requests), ollama_pool.BREAKER_THRESHOLD)
+        self.assertFalse(ollama_pool.stats()[self.urls[0]]["healthy"])
+
+        # Open breaker: no request is sent and the error comes back at once
+        start = time.monotonic()
+        deltas = list(ollama.stream_chat("You are Bob.", [{"role": "user", "content": "Hi"}]))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertIn("error", deltas[-1].stats)
+        self.assertEqual(len(self.servers[0].requests), ollama_pool.BREAKER_THRESHOLD)
+        with self.assertRaises(RuntimeError):
+            list(ollama.chat_with_ollama("You are Bob.", [], [{"role": "user", "content": "Hi"}]))
+
+        # A success after the cooldown closes it again
+        self.servers[0].status = 200
+        ollama_pool.record_success(self.urls[0])
+        self.assertEqual(self.reply("You are Bob."), "one")
+        self.assertEqual(ollama_pool.stats()[self.urls[0]]["consecutive_failures"], 0)
+
+    def test_health_check_does_not_close_breaker(self):
+        url = self.urls[0]
+        ollama_pool.configure([url])
+        original = ollama_pool.BREAKER_COOLDOWN
+        ollama_pool.BREAKER_COOLDOWN = 0.2
+        try:
+            for _ in range(ollama_pool.BREAKER_THRESHOLD):
+                ollama_pool.record_failure(url)
+            # /api/version answers, but the breaker stays open for the cooldown
+            ollama_pool.check_health()
+            self.assertEqual(ollama_pool.candidates(), [])
+
+            # Half-open: one caller gets the trial, the next one waits
+            time.sleep(0.3)
+            ollama_pool.check_health()
+            self.assertEqual(ollama_pool.candidates(), [url])
+            self.assertEqual(ollama_pool.candidates(), [])
+
+            # A failed trial opens it again; a successful one closes it
+            ollama_pool.record_failure(url)
+            self.assertEqual(ollama_pool.candidates(), [])
+            time.sleep(0.3)
+            self.assertEqual(ollama_pool.candidates(), [url])
+            ollama_pool.record_success(url)
+            self.assertEqual(ollama_pool.candidates(), [url])
+            self.assertEqual(ollama_pool.candidates(), [url])
+        finally:
+            ollama_pool.BREAKER_COOLDOWN = original
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import asyncio
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import ollama
+import fake_ollama
+
+class TestOllamaStream(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, base_url = fake_ollama.start("Hello there friend")
+        cls.original_endpoints = ollama.ollama_pool.endpoints()
+        ollama.ollama_pool.configure([base_url])
+
+    @classmethod
+    def tearDownClass(cls):
+        ollama.ollama_pool.configure(cls.original_endpoints)
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_sync_stream(self):
+        history = [{"role": "user", "content": "Hi"}]
+        result = list(ollama.chat_with_ollama("You are Bob.", history, history))
+        self.assertEqual(result[-1][-1], {"role": "assistant", "content": "Hello there friend"})
+        self.assertEqual(result[0][-1]["content"], "Hello")
+
+    def test_async_stream(self):
+        async def collect():
+            history = [{"role": "user", "content": "Hi"}]
+            return [item async for item in ollama.async_chat_with_ollama("You are Bob.", history, history)]
+
+        result = asyncio.run(collect())
+        self.assertEqual(result[-1][-1], {"role": "assistant", "content": "Hello there friend"})
+        self.assertEqual(len(result), 4)
+
+    def test_delta_stream(self):
+        history = [{"role": "user", "content": "Hi"}]
+        deltas = list(ollama.stream_chat("You are Bob.", history))
+        self.assertEqual("".join(delta.text for delta in deltas), "Hello there friend")
+        self.assertTrue(deltas[-1].done)
+        self.assertEqual(deltas[-1].stats["eval_count"], 3)
+        self.assertFalse(any(delta.done for delta in deltas[:-1]))
+        self.assertEqual(history, [{"role": "user", "content": "Hi"}])
+
+    def test_prefix_serializes_identically_next_turn(self):
+        history = [
+            {"role": "user", "content": "Hi", "time": "12:00"},
+            {"content": "Hello!", "role": "assistant"},
+        ]
+        prefix = ollama.build_messages("You are Bob.", history)
+        next_turn = ollama.build_chat_payload("You are Bob.", history + [{"role": "user", "content": "How are you?"}])
+        self.assertEqual(next_turn["messages"][:len(prefix)], prefix)
+        self.assertTrue(json.dumps(next_turn["messages"]).startswith(json.dumps(prefix)[:-1]))
+        self.assertEqual(prefix[1], {"role": "user", "content": "Hi"})
+
+    def test_warm_prefix_and_cache_hit_accounting(self):
+        before = ollama.prefix_cache_stats()
+        history = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
+        self.assertEqual(ollama.warm_prefix("You are Bob.", history), 3)
+        warmup = self.server.requests[-1]
+        self.assertEqual(warmup["options"], {"num_ctx": ollama.model_residency.CHAT_NUM_CTX, "num_predict": ollama.WARMUP_NUM_PREDICT})
+        self.assertEqual(warmup["keep_alive"], ollama.model_residency.CHAT_KEEP_ALIVE)
+        self.assertEqual(warmup["messages"][-1], {"role": "assistant", "content": "Hello!"})
+
+        # The fake server reports one evaluated token per message, far less than this prompt
+        long_history = history + [{"role": "user", "content": "word " * 400}]
+        list(ollama.stream_chat("You are Bob.", long_history))
+        stats = ollama.prefix_cache_stats()
+        self.assertEqual(stats["warmups"], before["warmups"] + 1)
+        self.assertEqual(stats["turns"], before["turns"] + 1)
+        self.assertEqual(stats["cache_hits"], before["cache_hits"] + 1)
+
+if __name__ == '__main__':
+    unittest.main()
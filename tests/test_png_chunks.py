@@ -0,0 +1,81 @@
+import os
+import sys
+import base64
+import tempfile
+import unittest
+from io import BytesIO
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import png_chunks
+from PIL import Image, PngImagePlugin
+
+def png_bytes(info=None, size=(64, 48)):
+    buffer = BytesIO()
+    pnginfo = None
+    if info is not None:
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text("parameters", info)
+        pnginfo.add_text("Software", "test")
+    Image.effect_noise(size, 40).convert("RGB").save(buffer, format="PNG", pnginfo=pnginfo)
+    return buffer.getvalue()
+
+class TestPngChunks(unittest.TestCase):
+    def test_insert_text_keeps_image_data(self):
+        original = png_bytes()
+        annotated = png_chunks.insert_text(original, "parameters", '{"seed": 7}')
+
+        img = Image.open(BytesIO(annotated))
+        self.assertEqual(img.text["parameters"], '{"seed": 7}')
+        self.assertEqual(img.tobytes(), Image.open(BytesIO(original)).tobytes())
+        self.assertEqual(len(annotated), len(original) + len(png_chunks.text_chunk("parameters", '{"seed": 7}')))
+
+    def test_existing_chunk_with_same_keyword_is_replaced(self):
+        annotated = png_chunks.insert_text(png_bytes(info="old"), "parameters", "new")
+        img = Image.open(BytesIO(annotated))
+        self.assertEqual(img.text, {"parameters": "new", "Software": "test"})
+
+    def test_non_latin1_text_uses_itxt(self):
+        annotated = png_chunks.insert_text(png_bytes(), "parameters", "Portrait of Zoë, 東京")
+        self.assertIn(b"iTXt", annotated)
+        self.assertEqual(Image.open(BytesIO(annotated)).text["parameters"], "Portrait of Zoë, 東京")
+
+    def test_streamed_base64_matches_in_memory_insert(self):
+        original = png_bytes(size=(256, 256))
+        b64_text = base64.b64encode(original).decode("ascii")
+        block = png_chunks.B64_BLOCK
+        png_chunks.B64_BLOCK = 12  # force many tiny blocks, splitting chunk headers
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, "out.png")
+                png_chunks.write_b64_png(path, b64_text, "parameters", "{}")
+                with open(path, "rb") as f:
+                    written = f.read()
+        finally:
+            png_chunks.B64_BLOCK = block
+        self.assertEqual(written, png_chunks.insert_text(original, "parameters", "{}"))
+
+    def test_byte_at_a_time_matches_in_memory_insert(self):
+        # The chunk after IHDR is a text chunk, so its header arrives split across writes
+        original = png_bytes(info="old")
+        self.assertEqual(original[8 + 25 + 4:8 + 25 + 8], b"tEXt")
+        out = BytesIO()
+        writer = png_chunks._TextChunkWriter(out, "parameters", "new")
+        for i in range(len(original)):
+            writer.write(original[i:i + 1])
+        writer.close()
+        self.assertEqual(out.getvalue(), png_chunks.insert_text(original, "parameters", "new"))
+        self.assertEqual(out.getvalue().count(b"tEXtparameters"), 1)
+
+    def test_invalid_png_is_rejected_without_leaving_a_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "out.png")
+            with self.assertRaises(ValueError):
+                png_chunks.write_png(path, b"GIF89a not a png", "parameters", "{}")
+            with self.assertRaises(ValueError):
+                png_chunks.write_png(path, png_bytes()[:100], "parameters", "{}")
+            self.assertEqual(os.listdir(tmpdir), [])
+
+if __name__ == '__main__':
+    unittest.main()
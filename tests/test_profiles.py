@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import profiles
+import ollama
+import settings
+import model_residency
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_file = profiles.PROFILES_FILE
+        profiles.PROFILES_FILE = os.path.join(self.tmpdir.name, "profiles.json")
+        with open(self.original_file, "r", encoding="utf-8") as f:
+            self.shipped = json.load(f)
+        self.write(self.shipped)
+
+    def tearDown(self):
+        profiles.PROFILES_FILE = self.original_file
+        profiles._loaded.update(mtime=None, profiles={})
+        profiles._warned.clear()
+        self.tmpdir.cleanup()
+
+    def write(self, data):
+        with open(profiles.PROFILES_FILE, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        # Make sure every write is seen as a change
+        stat = os.stat(profiles.PROFILES_FILE)
+        os.utime(profiles.PROFILES_FILE, ns=(stat.st_atime_ns, stat.st_mtime_ns + len(json.dumps(data))))
+
+    def test_shipped_profiles(self):
+        self.assertEqual(profiles.profile_names(), ["Slow", "Average", "Fast"])
+        self.assertEqual(profiles.chat_options("Average"), {})
+        # Profiles only change per-request settings, never how the chat model is loaded
+        for profile in self.shipped.values():
+            self.assertNotIn("model", profile["chat"])
+            self.assertFalse(set(profile["chat"]["options"]) & set(profiles.LOAD_OPTIONS))
+
+    def test_load_options_are_ignored(self):
+        self.shipped["Slow"]["chat"]["options"].update(num_ctx=16384, num_thread=4, num_gpu=None)
+        self.write(self.shipped)
+        with self.assertLogs(level="WARNING"):
+            options = profiles.chat_options("Slow")
+        self.assertEqual(options["num_predict"], -1)
+        self.assertFalse(set(options) & set(profiles.LOAD_OPTIONS))
+        payload = ollama.build_chat_payload("You are Bob.", [{"role": "user", "content": "Hi"}], profile="Slow")
+        self.assertEqual(payload["options"]["num_ctx"], model_residency.CHAT_NUM_CTX)
+
+    def test_chat_payload_follows_profile(self):
+        history = [{"role": "user", "content": "word " * 1000}, {"role": "assistant", "content": "ok"}, {"role": "user", "content": "Hi"}]
+        fast = ollama.build_chat_payload("You are Bob.", history, profile="Fast")
+        self.assertEqual(fast["options"]["num_predict"], 192)
+        self.assertEqual(len(fast["messages"]), 3)  # the long message does not fit Fast's budget
+        average = ollama.build_chat_payload("You are Bob.", history, profile="Average")
+        self.assertEqual(average["options"], model_residency.load_options(ollama.CHAT_MODEL))
+        self.assertEqual(len(average["messages"]), 4)
+
+    def test_image_profile(self):
+        payload = {"steps": 20, "width": 512, "height": 512, "alwayson_scripts": {"Adetailer": {"args": []}}}
+        profiles.apply_image_profile(payload, "Fast")
+        self.assertEqual((payload["steps"], payload["width"], payload["height"]), (12, 448, 448))
+        self.assertNotIn("alwayson_scripts", payload)
+
+        payload = {"steps": 20, "alwayson_scripts": {"Adetailer": {"args": []}}}
+        profiles.apply_image_profile(payload, "Average")
+        self.assertEqual(payload, {"steps": 20, "alwayson_scripts": {"Adetailer": {"args": []}}})
+
+    def test_file_changes_apply_without_restart(self):
+        self.assertEqual(profiles.chat_options("Fast")["num_predict"], 192)
+        self.shipped["Fast"]["chat"]["options"]["num_predict"] = 64
+        self.write(self.shipped)
+        self.assertEqual(profiles.chat_options("Fast")["num_predict"], 64)
+
+        # A broken file keeps the last good profiles
+        with open(profiles.PROFILES_FILE, "w", encoding="utf-8") as f:
+            f.write("{not json")
+        os.utime(profiles.PROFILES_FILE, ns=(1, 1))
+        self.assertEqual(profiles.chat_options("Fast")["num_predict"], 64)
+
+    def test_apply_settings_returns_session_profile(self):
+        self.assertEqual(settings.apply_settings("Realistic", "Fast"), "Fast")
+        self.assertEqual(settings.apply_settings("Realistic", "Turbo"), profiles.DEFAULT_PROFILE)
+        self.assertEqual(profiles.get_profile("Turbo"), profiles.get_profile(profiles.DEFAULT_PROFILE))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import prompt_cache
+import ollama_pool
+import ollama
+import fake_ollama
+
+def payload(text, **extra):
+    return dict({"model": "prompter", "messages": [{"role": "user", "content": text}], "stream": False}, **extra)
+
+class TestPromptCache(unittest.TestCase):
+    def setUp(self):
+        self.original = (prompt_cache.TTL, prompt_cache.MAX_ENTRIES)
+        prompt_cache.reset()
+
+    def tearDown(self):
+        prompt_cache.TTL, prompt_cache.MAX_ENTRIES = self.original
+        prompt_cache.reset()
+
+    def test_key_ignores_keep_alive_and_stream(self):
+        self.assertEqual(prompt_cache.key_for(payload("a", keep_alive="1m")), prompt_cache.key_for(payload("a", stream=True)))
+        self.assertNotEqual(prompt_cache.key_for(payload("a")), prompt_cache.key_for(payload("a", options={"temperature": 0.2})))
+        self.assertNotEqual(prompt_cache.key_for(payload("a")), prompt_cache.key_for(payload("b")))
+
+    def test_concurrent_identical_requests_share_one_call(self):
+        calls = []
+        release = threading.Event()
+
+        def slow_call():
+            calls.append(1)
+            release.wait(5)
+            return "portrait"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(prompt_cache.get_or_call(payload("a"), slow_call)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, ["portrait"] * 4)
+        self.assertEqual(len(calls), 1)
+        stats = prompt_cache.stats()
+        self.assertEqual((stats["misses"], stats["coalesced"], stats["in_flight"]), (1, 3, 0))
+
+        # Later identical requests are served from the cache
+        self.assertEqual(prompt_cache.get_or_call(payload("a"), slow_call), "portrait")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(prompt_cache.stats()["hit_rate"], 0.8)
+
+    def test_errors_are_shared_but_not_cached(self):
+        def failing():
+            raise RuntimeError("Ollama down")
+
+        with self.assertRaises(RuntimeError):
+            prompt_cache.get_or_call(payload("a"), failing)
+        self.assertEqual(prompt_cache.get_or_call(payload("a"), lambda: "ok"), "ok")
+
+    def test_ttl_and_lru(self):
+        prompt_cache.MAX_ENTRIES = 2
+        for text in ("a", "b"):
+            prompt_cache.get_or_call(payload(text), lambda: text)
+        prompt_cache.get_or_call(payload("a"), lambda: "fresh")  # a is now the most recent
+        prompt_cache.get_or_call(payload("c"), lambda: "c")
+        self.assertEqual(prompt_cache.get_or_call(payload("b"), lambda: "b again"), "b again")
+        self.assertEqual(prompt_cache.stats()["evictions"], 2)
+
+        prompt_cache.reset()
+        prompt_cache.TTL = 0.05
+        prompt_cache.get_or_call(payload("a"), lambda: "old")
+        time.sleep(0.1)
+        self.assertEqual(prompt_cache.get_or_call(payload("a"), lambda: "new"), "new")
+
+class TestPrompterDeduplication(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, cls.base_url = fake_ollama.start("portrait of Bob")
+        cls.original_endpoints = ollama_pool.endpoints()
+        ollama_pool.configure([cls.base_url])
+
+    @classmethod
+    def tearDownClass(cls):
+        ollama_pool.configure(cls.original_endpoints)
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        prompt_cache.reset()
+
+    def test_double_click_runs_one_generation(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ollama.generate_image_prompt("A tall pirate")))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        results.append(ollama.generate_image_prompt("A tall pirate"))
+
+        self.assertEqual(len(set(results)), 1)
+        self.assertTrue(results[0].startswith("portrait of Bob"))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(ollama.generate_image_request_prompt("on a ship", "A tall pirate").split(",")[0], "portrait of Bob")
+        self.assertEqual(len(self.server.requests), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from render_scheduler import FrameScheduler
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestFrameScheduler(unittest.TestCase):
+    def test_first_frame_is_immediate(self):
+        scheduler = FrameScheduler(max_fps=10, clock=FakeClock())
+        scheduler.mark_dirty()
+        self.assertTrue(scheduler.ready())
+
+    def test_tokens_are_coalesced(self):
+        clock = FakeClock()
+        scheduler = FrameScheduler(max_fps=10, clock=clock)
+        frames = 0
+        # 300 tokens arriving over one second
+        for _ in range(300):
+            scheduler.mark_dirty()
+            if scheduler.ready():
+                frames += 1
+            clock.now += 1 / 300
+        self.assertLessEqual(frames, 11)
+        self.assertTrue(scheduler.dirty)
+        self.assertGreaterEqual(scheduler.time_until_ready(), 0)
+        self.assertLessEqual(scheduler.time_until_ready(), 1 / 10)
+
+        # The last tokens are not dropped: once the interval has passed they go out in a final frame
+        self.assertFalse(scheduler.ready())
+        clock.now += scheduler.time_until_ready()
+        self.assertEqual(scheduler.time_until_ready(), 0)
+        self.assertTrue(scheduler.ready())
+        self.assertFalse(scheduler.dirty)
+        self.assertEqual(scheduler.frames, frames + 1)
+
+    def test_clean_scheduler_never_renders(self):
+        scheduler = FrameScheduler(max_fps=10, clock=FakeClock())
+        self.assertFalse(scheduler.ready())
+
+if __name__ == '__main__':
+    unittest.main()
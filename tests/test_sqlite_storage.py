@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import chat_journal
+from sqlite_storage import SqliteStorage
+
+class TestSqliteStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.chat_folder = os.path.join(self.tmpdir.name, "chat_data")
+        self.storage = SqliteStorage(
+            os.path.join(self.tmpdir.name, "chats.db"),
+            chat_folder=self.chat_folder,
+            backup_folder=os.path.join(self.tmpdir.name, "backup"),
+        )
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmpdir.cleanup()
+
+    def test_save_and_load_chat(self):
+        self.storage.save_metadata({"name": "Bob", "system_prompt": "You are Bob."})
+        history = [{"role": "user", "content": "Hi"}]
+        self.storage.save_chat("Bob", {"history": list(history)})
+
+        history.append({"role": "assistant", "content": "Hello"})
+        self.storage.save_chat("Bob", {"history": list(history)})
+
+        chat_data, metadata = self.storage.load_chat("Bob")
+        self.assertEqual(chat_data["history"], history)
+        self.assertEqual(metadata["system_prompt"], "You are Bob.")
+        self.assertEqual(self.storage.list_characters(), ["Bob"])
+
+    def test_truncated_history_replaces_messages(self):
+        history = [{"role": "user", "content": str(i)} for i in range(4)]
+        self.storage.save_chat("Bob", {"history": history})
+        self.storage.save_chat("Bob", {"history": history[:1]})
+
+        chat_data, _ = self.storage.load_chat("Bob")
+        self.assertEqual(chat_data["history"], history[:1])
+
+    def test_import_chat_data(self):
+        character_folder = os.path.join(self.chat_folder, "Alice")
+        os.makedirs(character_folder)
+        with open(os.path.join(character_folder, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump({"name": "Alice", "system_prompt": "You are Alice."}, f)
+        with open(os.path.join(character_folder, "chat.json"), "w", encoding="utf-8") as f:
+            json.dump({"history": [{"role": "user", "content": "Hey"}]}, f)
+        last_chat_file = os.path.join(self.tmpdir.name, "last_chat.json")
+        with open(last_chat_file, "w", encoding="utf-8") as f:
+            json.dump({"last_chat": "Alice"}, f)
+
+        self.assertEqual(self.storage.import_chat_data(self.chat_folder, last_chat_file), ["Alice"])
+        chat_data, metadata = self.storage.load_chat("Alice")
+        self.assertEqual(chat_data["history"], [{"role": "user", "content": "Hey"}])
+        self.assertEqual(metadata["system_prompt"], "You are Alice.")
+        self.assertEqual(self.storage.load_last_chat_name(), "Alice")
+
+    def test_remove_chat_archives_character(self):
+        self.storage.save_metadata({"name": "Bob", "system_prompt": ""})
+        self.storage.save_chat("Bob", {"history": [{"role": "user", "content": "Bye"}]})
+        self.storage.remove_chat("Bob")
+
+        self.assertEqual(self.storage.list_characters(), [])
+        archived = os.listdir(os.path.join(self.tmpdir.name, "backup"))
+        self.assertEqual(len(archived), 1)
+
+    def test_history_window(self):
+        history = [{"role": "user", "content": str(i)} for i in range(12)]
+        self.storage.save_chat("Bob", {"history": history})
+        self.assertEqual(self.storage.load_history_window("Bob", 5), (history[7:], 7))
+        self.assertEqual(self.storage.load_history_window("Bob", 5, before=7), (history[2:7], 2))
+        self.assertEqual(self.storage.load_history_window("Bob", 5, before=2), (history[:2], 0))
+        self.assertEqual(self.storage.load_history_window("Nobody", 5), ([], 0))
+
+    def test_append_and_version_check(self):
+        self.storage.save_chat("Bob", {"history": [{"role": "user", "content": "Hi"}]})
+        chat_data, _ = self.storage.load_chat("Bob")
+        version = self.storage.append_messages("Bob", [{"role": "assistant", "content": "Hello"}])
+
+        history = self.storage.load_chat("Bob")[0]["history"]
+        self.assertEqual(len(history), 2)
+        self.assertEqual(version, chat_journal.version_of(history))
+        # The version loaded before the append is stale now
+        chat_data["history"].append({"role": "assistant", "content": "Other reply"})
+        with self.assertRaises(chat_journal.VersionConflict):
+            self.storage.save_chat("Bob", chat_data, expected_version=chat_data[chat_journal.VERSION_KEY])
+        self.assertEqual(self.storage.load_chat("Bob")[0]["history"], history)
+
+if __name__ == '__main__':
+    unittest.main()
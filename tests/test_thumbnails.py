@@ -0,0 +1,76 @@
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import thumbnails
+from PIL import Image
+
+class TestThumbnails(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = thumbnails.THUMB_DIR
+        thumbnails.THUMB_DIR = os.path.join(self.tmpdir.name, "thumbs")
+        thumbnails._known.clear()
+        self.avatar = os.path.join(self.tmpdir.name, "Avatar.png")
+        Image.new("RGB", (512, 512), (10, 20, 30)).save(self.avatar)
+
+    def tearDown(self):
+        thumbnails.THUMB_DIR = self.original_dir
+        thumbnails._known.clear()
+        self.tmpdir.cleanup()
+
+    def test_thumbnails_are_webp_at_display_size(self):
+        paths = thumbnails.make_thumbnails(self.avatar)
+        self.assertEqual(set(paths), set(thumbnails.SIZES))
+        for kind, path in paths.items():
+            with Image.open(path) as img:
+                self.assertEqual(img.format, "WEBP")
+                self.assertEqual(img.size, (thumbnails.SIZES[kind] * thumbnails.PIXEL_RATIO,) * 2)
+            self.assertLess(os.path.getsize(path), os.path.getsize(self.avatar))
+
+    def test_names_follow_content_and_existing_thumbnails_are_reused(self):
+        first = thumbnails.make_thumbnails(self.avatar)
+        thumbnails._known.clear()
+        with mock.patch.object(thumbnails, "_render") as render:
+            self.assertEqual(thumbnails.make_thumbnails(self.avatar), first)
+            render.assert_not_called()
+
+        Image.new("RGB", (512, 512), (200, 0, 0)).save(self.avatar)
+        os.utime(self.avatar, ns=(1, 1))
+        self.assertNotEqual(thumbnails.make_thumbnails(self.avatar)["bot"], first["bot"])
+
+    def test_thumbnail_for_falls_back_to_source(self):
+        self.assertEqual(thumbnails.thumbnail_for("missing/avatar.png", "bot"), "missing/avatar.png")
+        broken = os.path.join(self.tmpdir.name, "broken.png")
+        with open(broken, "wb") as f:
+            f.write(b"not an image")
+        self.assertEqual(thumbnails.thumbnail_for(broken, "bot"), broken)
+        self.assertTrue(thumbnails.thumbnail_for(self.avatar, "bot").endswith("-140.webp"))
+
+    def test_middleware_adds_cache_headers_to_thumbnails_only(self):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"cache-control", b"no-cache")]})
+            await send({"type": "http.response.body", "body": b""})
+
+        def headers_for(path):
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            middleware = thumbnails.CacheHeadersMiddleware(app)
+            asyncio.run(middleware({"type": "http", "path": path}, None, send))
+            return dict(sent[0]["headers"])
+
+        thumb = "/gradio_api/file=/srv/app/cache/thumbs/0123456789abcdef-140.webp"
+        self.assertEqual(headers_for(thumb)[b"cache-control"], thumbnails.CACHE_CONTROL.encode())
+        self.assertEqual(headers_for("/gradio_api/file=/srv/app/chat_data/x/assets/Avatar.png")[b"cache-control"], b"no-cache")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from starlette.testclient import TestClient
+
+import workers
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/stream"):
+            # Chunked like the queue's event stream
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(3):
+                data = f"data: {i}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        data = json.dumps({"worker": self.server.index, "path": self.path, "host": self.headers["Host"]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestStickyProxy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = []
+        for index in range(2):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), WorkerHandler)
+            server.index = index
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            cls.servers.append(server)
+        cls.ports = [server.server_address[1] for server in cls.servers]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_sessions_stick_to_their_worker_and_spread(self):
+        proxy = workers.build_proxy(self.ports)
+        with TestClient(proxy) as session_a, TestClient(proxy) as session_b:
+            a = session_a.get("/config?x=1")
+            self.assertEqual(a.json()["path"], "/config?x=1")
+            self.assertEqual(a.json()["host"], "testserver")
+            b = session_b.get("/config")
+            self.assertNotEqual(a.cookies[workers.COOKIE], b.cookies[workers.COOKIE])
+
+            for _ in range(3):
+                self.assertEqual(session_a.get("/").json()["worker"], a.json()["worker"])
+                self.assertEqual(session_b.get("/").json()["worker"], b.json()["worker"])
+            self.assertEqual(session_a.post("/queue/join", content=b'{"session_hash": "a"}').content, b'{"session_hash": "a"}')
+
+    def test_stream_is_passed_through(self):
+        with TestClient(workers.build_proxy(self.ports)) as client:
+            response = client.get("/stream")
+            self.assertEqual(response.headers["content-type"], "text/event-stream")
+            self.assertEqual(response.text, "data: 0\n\ndata: 1\n\ndata: 2\n\n")
+
+    def test_unknown_cookie_is_a_new_session_and_dead_worker_is_502(self):
+        self.assertIsNone(workers.sticky_worker("7", 2))
+        self.assertIsNone(workers.sticky_worker("x", 2))
+        self.assertEqual(workers.sticky_worker("1", 2), 1)
+
+        with TestClient(workers.build_proxy([self.ports[0], 1])) as client:
+            client.cookies.set(workers.COOKIE, "1")
+            self.assertEqual(client.get("/").status_code, 502)
+
+if __name__ == '__main__':
+    unittest.main()
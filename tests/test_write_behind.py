@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+import unittest
+
+# Ensure the repository root is on sys.path when tests are run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import write_behind
+import chat_backend
+
+class TestWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (write_behind.ENABLED, write_behind.FSYNC)
+        write_behind.ENABLED = True
+
+    def tearDown(self):
+        write_behind.flush(5)
+        write_behind.ENABLED, write_behind.FSYNC = self.original
+        self.tmpdir.cleanup()
+
+    def test_pending_writes_for_a_key_are_coalesced_in_order(self):
+        started, release = threading.Event(), threading.Event()
+        written = []
+
+        def blocking():
+            started.set()
+            release.wait(5)
+            written.append(("a", 0))
+
+        write_behind.submit("a", blocking)
+        self.assertTrue(started.wait(5))
+        # While the first write runs, later ones queue up and only the newest per key survives
+        before = write_behind.stats()["coalesced"]
+        for i in range(1, 4):
+            write_behind.submit("a", lambda i=i: written.append(("a", i)))
+        write_behind.submit("b", lambda: written.append(("b", 1)))
+        self.assertEqual(write_behind.stats()["coalesced"] - before, 2)
+        self.assertFalse(write_behind.wait("a", timeout=0.05))
+
+        release.set()
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(written, [("a", 0), ("a", 3), ("b", 1)])
+        self.assertTrue(write_behind.wait("a", timeout=0))
+
+    def test_errors_do_not_stop_the_writer(self):
+        def failing():
+            raise OSError("disk full")
+
+        errors = write_behind.stats()["errors"]
+        written = []
+        write_behind.submit("a", failing)
+        write_behind.submit("b", lambda: written.append(1))
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(written, [1])
+        self.assertEqual(write_behind.stats()["errors"], errors + 1)
+
+    def test_atomic_json_and_fsync(self):
+        write_behind.FSYNC = "always"
+        path = os.path.join(self.tmpdir.name, "last_chat.json")
+        fsyncs = write_behind.stats()["fsyncs"]
+        write_behind.submit("file", lambda: write_behind.write_json_atomic(path, {"last_chat": "Bob"}))
+        self.assertTrue(write_behind.flush(5))
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"last_chat": "Bob"})
+        self.assertEqual(os.listdir(self.tmpdir.name), ["last_chat.json"])
+        self.assertGreater(write_behind.stats()["fsyncs"], fsyncs)
+        self.assertEqual(write_behind.stats()["dirty"], 0)
+
+    def test_atomic_json_from_concurrent_threads(self):
+        path = os.path.join(self.tmpdir.name, "metadata.json")
+        payloads = [{"writer": i, "text": str(i) * 100000} for i in range(8)]
+        errors = []
+
+        def write(data):
+            try:
+                for _ in range(5):
+                    write_behind.write_json_atomic(path, data)
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=write, args=(data,)) for data in payloads]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with open(path, encoding="utf-8") as f:
+            self.assertIn(json.load(f), payloads)
+        self.assertEqual(os.listdir(self.tmpdir.name), ["metadata.json"])
+
+    def test_disabled_writes_inline(self):
+        write_behind.ENABLED = False
+        written = []
+        write_behind.submit("a", lambda: written.append(1))
+        self.assertEqual(written, [1])
+
+class TestChatAppendLater(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (chat_backend.CHAT_FOLDER, chat_backend.STORAGE_BACKEND, chat_backend.LAST_CHAT_FILE)
+        chat_backend.CHAT_FOLDER = os.path.join(self.tmpdir.name, "chat_data")
+        chat_backend.STORAGE_BACKEND = "file"
+        chat_backend.LAST_CHAT_FILE = os.path.join(self.tmpdir.name, "last_chat.json")
+        chat_backend.clear_cache()
+
+    def tearDown(self):
+        write_behind.flush(5)
+        chat_backend.CHAT_FOLDER, chat_backend.STORAGE_BACKEND, chat_backend.LAST_CHAT_FILE = self.original
+        chat_backend.clear_cache()
+        self.tmpdir.cleanup()
+
+    def test_load_sees_saves_still_in_the_queue(self):
+        for i in range(5):
+            message = {"role": "user", "content": str(i)}
+            chat_backend.append_messages_later("Bob", [message], {"system_prompt": "You are Bob."})
+        # The caller may keep changing its messages; the queued append has its own copy
+        message["content"] = "changed"
+
+        chat_data, _ = chat_backend.load_chat("Bob")
+        self.assertEqual([m["content"] for m in chat_data["history"]], ["0", "1", "2", "3", "4"])
+
+        chat_backend.save_last_chat_name("Eve")
+        chat_backend.save_last_chat_name("Bob")
+        self.assertEqual(chat_backend.load_last_chat_name(), "Bob")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+WebP avatar thumbnails at the sizes the UI shows them.
+
+The Chatbot draws avatars at 40 px (user) and 70 px (bot) and the sidebar
+image is about 200 px wide (see main.py), so sending the full 512x512 PNG
+for each of them wastes bandwidth on every chat switch. Thumbnails are made
+when an avatar is saved, or lazily the first time an older avatar is shown.
+
+File names contain a hash of the source image, so a thumbnail never changes
+under its name: it is served as a static file with a long-lived, immutable
+Cache-Control header (CacheHeadersMiddleware) and a new avatar simply gets
+new names.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+
+THUMB_DIR = os.environ.get("THUMBNAIL_DIR", os.path.join("cache", "thumbs"))
+# CSS pixel size per UI slot; rendered at PIXEL_RATIO so they stay sharp on HiDPI screens
+SIZES = {"user": 40, "bot": 70, "sidebar": 200}
+PIXEL_RATIO = int(os.environ.get("THUMBNAIL_PIXEL_RATIO", "2"))
+WEBP_QUALITY = 85
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_THUMB_NAME = re.compile(r"[0-9a-f]{16}-\d+\.webp")
+_lock = threading.Lock()
+# source path -> ((mtime_ns, size), {kind: thumbnail path}), so unchanged avatars are not re-hashed
+_known = {}
+
+
+def _content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _render(src_path, targets):
+    # PIL is only needed when a thumbnail actually has to be drawn
+    from PIL import Image
+
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    with Image.open(src_path) as img:
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        for path, pixels in targets:
+            thumb = img.copy()
+            thumb.thumbnail((pixels, pixels), Image.LANCZOS)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            thumb.save(tmp_path, "WEBP", quality=WEBP_QUALITY, method=6)
+            os.replace(tmp_path, path)
+
+
+def make_thumbnails(src_path):
+    """Create any missing thumbnails of src_path; returns {kind: thumbnail path}."""
+    stat = os.stat(src_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        known = _known.get(src_path)
+    if known is not None and known[0] == signature:
+        return known[1]
+
+    digest = _content_hash(src_path)
+    paths = {}
+    missing = []
+    for kind, size in SIZES.items():
+        pixels = size * PIXEL_RATIO
+        paths[kind] = os.path.join(THUMB_DIR, f"{digest}-{pixels}.webp")
+        if not os.path.exists(paths[kind]):
+            missing.append((paths[kind], pixels))
+    if missing:
+        logging.debug("Rendering %d thumbnails for %s", len(missing), src_path)
+        _render(src_path, missing)
+
+    with _lock:
+        _known[src_path] = (signature, paths)
+    return paths
+
+
+def thumbnail_for(src_path, kind):
+    """Thumbnail to show in a UI slot ("user", "bot" or "sidebar"); src_path itself if none can be made."""
+    if not src_path or not os.path.isfile(src_path):
+        return src_path
+    try:
+        return make_thumbnails(src_path)[kind]
+    except Exception as ex:
+        logging.warning("Could not create thumbnail for %s: %s", src_path, ex)
+        return src_path
+
+
+def is_thumbnail_url(path):
+    return "/file=" in path and _THUMB_NAME.fullmatch(re.split(r"[/\\]", path)[-1]) is not None
+
+
+class CacheHeadersMiddleware:
+    """ASGI middleware that marks thumbnail responses as cacheable forever."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_thumbnail_url(scope.get("path", "")):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_headers(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = [(k, v) for k, v in message.get("headers", []) if k.lower() != b"cache-control"]
+                headers.append((b"cache-control", CACHE_CONTROL.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_headers)
@@ -1,53 +1,68 @@
 import gradio as gr
 import chat_backend
 import stable_diffusion
-import re
 import os
 import time
-import threading
-from queue import Queue, Empty
+import asyncio
 import ollama
+import render_scheduler
+import chat_render
+from markup_formatter import StreamingFormatter
 import logging
 import settings
+import profiles
+import image_jobs
+import thumbnails
 from ollama import generate_image_prompt
 from datetime import datetime
 
 logging.basicConfig(level=logging.DEBUG) # DEBUG, INFO, WARNING, ERROR, CRITICAL
 
+DEFAULT_AVATAR = "assets/default.png"
+USER_AVATAR = "assets/user.png"
 
-def italics_to_bold(text):
-    """
-    Converts action-style markup to bold-italic text.
 
-    Supported action formatting:
-    - *text* or _text_
-    - (text)
-    - [text]
-    """
-    if not isinstance(text, str):
-        return text
+def avatar_or_default(name):
+    """The character's avatar, or DEFAULT_AVATAR while it has none (e.g. still rendering)."""
+    character_avatar = chat_backend.get_avatar_file_path(name)
+    return character_avatar if os.path.isfile(character_avatar) else DEFAULT_AVATAR
 
-    text = re.sub(r'(?<!\*)\*(?!\*)(.*?)\*(?!\*)', r'***\1***', text)
-    text = re.sub(r'_(.*?)_', r'***\1***', text)
-    text = re.sub(r'\(([^)]+)\)', r'***\1***', text)
-    text = re.sub(r'\[([^\]]+)\]', r'***\1***', text)
-    return text
 
-def build_chat_ui(demo=None):
+def format_stages(stages):
+    """"prompt 2.1s · render 14.3s" from a {stage: seconds} dict."""
+    return " · ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stages.items())
+
+
+def chatbot_avatars(character_avatar):
+    """(user, bot) avatar_images for the Chatbot, as thumbnails at their display size."""
+    return (thumbnails.thumbnail_for(USER_AVATAR, "user"), thumbnails.thumbnail_for(character_avatar, "bot"))
+
+
+def load_session():
+    """
+    Chat a new session starts on: (name, history, history_start, system_prompt,
+    avatar, character list). Only the last page of the history is loaded.
+    """
     last_chat_name = chat_backend.load_last_chat_name()
     characters_list = chat_backend.get_character_list()
 
     if last_chat_name and (last_chat_name in characters_list):
-        chat_data, metadata = chat_backend.load_chat(last_chat_name)
+        history, history_start = chat_backend.load_history_window(last_chat_name)
+        metadata = chat_backend.get_metadata(last_chat_name) or {}
 
-        character_avatar = chat_backend.get_avatar_file_path(last_chat_name)
-        system_prompt = metadata["system_prompt"]
+        character_avatar = avatar_or_default(last_chat_name)
+        system_prompt = metadata.get("system_prompt", "")
     else:
         logging.warning("No last chat available... Setting default one...")
-        chat_data = {"system_prompt": "", "history": []}
+        history, history_start = [], 0
         system_prompt = "You are a helpful assistant."
         last_chat_name = "Default Chat"
-        character_avatar = "assets/default.png"
+        character_avatar = DEFAULT_AVATAR
+    return last_chat_name, history, history_start, system_prompt, character_avatar, characters_list
+
+
+def build_chat_ui(demo=None):
+    last_chat_name, history, start, system_prompt, character_avatar, characters_list = load_session()
 
     # --- Helpers for Gradio 3.x Chatbot format ---
     def format_chat_message(content):
@@ -60,50 +75,29 @@ def build_chat_ui(demo=None):
         return content
 
     def history_dicts_to_chatbot(history):
-        if history is None:
-            return []
-
-        chatbot_value = []
-
-        for msg in history:
-            if isinstance(msg, (list, tuple)):
-                # Support legacy Gradio 3.x pair format
-                user_text = msg[0] if len(msg) > 0 else ""
-                assistant_text = msg[1] if len(msg) > 1 else ""
-                if user_text:
-                    chatbot_value.append({"role": "user", "content": user_text})
-                if assistant_text:
-                    chatbot_value.append({"role": "assistant", "content": assistant_text})
-                continue
-
-            if not isinstance(msg, dict):
-                continue
-
-            role = msg.get("role")
-            content = msg.get("content", "")
-            if isinstance(content, tuple) and len(content) == 1 and isinstance(content[0], str):
-                content = content[0]
-            if isinstance(content, dict) and content.get("type") == "image":
-                content = content.get("path", "")
-
-            if role in ("user", "assistant"):
-                if isinstance(content, str):
-                    content = italics_to_bold(content)
-                chatbot_value.append({"role": role, "content": content})
-
-        return chatbot_value
+        # Memoized per message, see chat_render
+        return chat_render.render_history(history)
 
     # --- Saving current chat ---
     current_chat = gr.State(last_chat_name)
+    # Index in the whole chat of the first message on screen; older ones are loaded on request
+    history_start = gr.State(start)
+    # Performance profile of this session ("Response Type"), see profiles.py
+    response_profile = gr.State(profiles.DEFAULT_PROFILE)
     logging.debug("Setting current chat as: "+ last_chat_name)
 
     with gr.Row():
         with gr.Column(scale=1, min_width=200) as Sidebar:
             # Image of Character (Always visible)
             character_image = gr.Image(
-                value=character_avatar,
+                value=thumbnails.thumbnail_for(character_avatar, "sidebar"),
                 show_label=False
                 )
+            # Background avatar render status
+            image_job = gr.State(None)
+            image_status = gr.Markdown("")
+            cancel_image_btn = gr.Button("Cancel image", size="sm")
+            image_timer = gr.Timer(1.0, active=False)
             
             # Accordion for settings
             # Dropdown to select chat
@@ -136,17 +130,18 @@ def build_chat_ui(demo=None):
             # Accordion for settings
             with gr.Accordion("Settings", open=False):
                 image_style = gr.Dropdown(choices=["Realistic", "Anime"], label="Image Style", value="Realistic")
-                response_type = gr.Dropdown(choices=["Slow", "Average", "Fast"], label="Response Type", value="Average")
+                response_type = gr.Dropdown(choices=profiles.profile_names() or ["Slow", "Average", "Fast"], label="Response Type", value=profiles.DEFAULT_PROFILE)
                 apply_button = gr.Button("Apply")
     
         with gr.Column(scale=5) as Textbox:
+            load_earlier_btn = gr.Button("Load earlier messages", size="sm", visible=start > 0)
             # Textbox of chatbot
             chatbot = gr.Chatbot(
                 show_label=False,
                 height=700,
                 elem_id="chatbot",
-                value=history_dicts_to_chatbot(chat_data.get("history", [])),
-                avatar_images=("assets/user.png", character_avatar),  # (user, bot)
+                value=history_dicts_to_chatbot(history),
+                avatar_images=chatbot_avatars(character_avatar),  # (user, bot)
                 buttons=[]
             )
             msg_box = gr.Textbox(label="Message")
@@ -155,7 +150,7 @@ def build_chat_ui(demo=None):
     #        Callback
     # ------------------------
 
-    def create_character(name, system_prompt):
+    def create_character(name, system_prompt, profile):
         if not name:
             logging.warning("No name was added!")
             gr.Warning("No name was added!")
@@ -165,9 +160,8 @@ def build_chat_ui(demo=None):
             gr.Warning("No personality was added!")
             return
         
-        prompt = ollama.generate_image_prompt(system_prompt)
-        path = stable_diffusion.generate_avatar_a1111(name, prompt)
-
+        # Stage 1: the character can be chatted with as soon as it is saved
+        start = time.perf_counter()
         metadata = chat_backend.new_metadata(name, system_prompt)
         chat_backend.save_metadata(metadata)
 
@@ -175,10 +169,66 @@ def build_chat_ui(demo=None):
         chat_backend.save_chat(name, new_character_chat)
 
         chat_backend.save_last_chat_name(name)
+        saved_in = time.perf_counter() - start
+
+        # Stage 2: avatar prompt and render run in the background; the UI polls the job with image_timer
+        def render_avatar():
+            with image_jobs.stage("prompt"):
+                prompt = ollama.generate_image_prompt(system_prompt, profile)
+            # Cancelled while the prompt was written: stop before the render takes the image slot
+            image_jobs.check_cancelled()
+            # Same character and prompt -> same seed, so a retry is served from the image cache
+            seed = stable_diffusion.seed_for(name, prompt)
+            return stable_diffusion.generate_avatar_a1111(name, prompt, seed=seed, profile=profile)
+
+        job_id = stable_diffusion.submit_image_job(render_avatar, label=name)
+
         gr.Info(message=f"ℹ️ Character {name} was created!")
         character_list = chat_backend.load_characters_list()
 
-        return gr.update(choices=list(character_list), value=name), gr.update(value=path)
+        return (
+            gr.update(choices=list(character_list), value=name),
+            gr.update(value=DEFAULT_AVATAR),
+            job_id,
+            gr.Timer(active=True),
+            f"🎨 Generating avatar... (saved in {saved_in * 1000:.0f} ms)",
+        )
+
+    def poll_image_job(job_id, current_chat_name):
+        job = image_jobs.get_job(job_id) if job_id else None
+        if job is None:
+            return gr.update(), gr.update(), gr.Timer(active=False), ""
+
+        is_current = job["label"] == current_chat_name
+        timings = f" ({format_stages(job['stages'])})" if job["stages"] else ""
+        if job["status"] in ("queued", "running"):
+            eta = f" (ETA {int(job['eta'])}s)" if job.get("eta") else ""
+            if job["status"] == "queued":
+                status = "🎨 Waiting for a free slot..."
+            elif job["stage"] == "prompt":
+                status = "🎨 Writing the avatar prompt..."
+            else:
+                status = f"🎨 {int(job['progress'] * 100)}%{eta}"
+            image = gr.update(value=job["preview"]) if is_current and job.get("preview") else gr.update()
+            return image, gr.update(), gr.Timer(active=True), status
+
+        if job["status"] == "done":
+            if not is_current:
+                return gr.update(), gr.update(), gr.Timer(active=False), f"✅ Avatar for {job['label']} is ready{timings}"
+            return (
+                gr.update(value=thumbnails.thumbnail_for(job["result"], "sidebar")),
+                gr.update(avatar_images=chatbot_avatars(job["result"])),
+                gr.Timer(active=False),
+                f"✅ Avatar ready{timings}",
+            )
+
+        message = "⚠️ Avatar cancelled" if job["status"] == "cancelled" else f"⚠️ Avatar failed: {job['error']}"
+        return gr.update(), gr.update(), gr.Timer(active=False), message
+
+    def cancel_image_job(job_id):
+        if job_id and image_jobs.cancel(job_id):
+            return "⏹️ Cancelling..."
+        return gr.update()
     
     def remove_character(name):
         logging.info("Deleting character: ", name)
@@ -200,26 +250,42 @@ def build_chat_ui(demo=None):
         return gr.update(choices=list(chat_backend.load_characters_list()))
 
     # When using the Dropdown
-    def switch_chat(name):
+    def switch_chat(name, profile):
         if not name:
             logging.critical("No name found when switching characters!")
-            return gr.update(value=[]), "", gr.update(value="")
+            return gr.update(value=[]), "", gr.update(value=""), gr.update(), 0, gr.update(visible=False)
         logging.debug("Switch character to:", name)
 
         chat_backend.save_last_chat_name(name)
-        chat_data, metadata = chat_backend.load_chat(name)
+        # Only the last page: switching costs the same however long the chat is
+        history, start = chat_backend.load_history_window(name)
+        metadata = chat_backend.get_metadata(name) or {}
         logging.debug("Chat data loaded for: "+name)
-        history = chat_data["history"]
-        system_prompt = metadata["system_prompt"]
-        character_avatar = chat_backend.get_avatar_file_path(name)
+        system_prompt = metadata.get("system_prompt", "")
+        character_avatar = avatar_or_default(name)
+        # Let Ollama evaluate this chat's prompt while the user reads and types
+        chat_backend.schedule_prefix_warmup(name, system_prompt, history, profile, start)
         return (
             gr.update(
                 value=history_dicts_to_chatbot(history),
-                avatar_images=("assets/user.png", character_avatar)
+                avatar_images=chatbot_avatars(character_avatar)
             ),
             name,
             gr.update(value=system_prompt),
-            gr.update(value=character_avatar),
+            gr.update(value=thumbnails.thumbnail_for(character_avatar, "sidebar")),
+            start,
+            gr.update(visible=start > 0),
+        )
+
+    def load_earlier(chatbot_history, name, start):
+        """Put the page of messages before the first one on screen in front of it."""
+        if not name or not start:
+            return gr.update(), start, gr.update(visible=False)
+        earlier, start = chat_backend.load_history_window(name, before=start)
+        return (
+            history_dicts_to_chatbot(earlier) + (chatbot_history or []),
+            start,
+            gr.update(visible=start > 0),
         )
 
     def update_system_prompt(new_prompt, name):
@@ -261,7 +327,7 @@ def build_chat_ui(demo=None):
             elif isinstance(content, str) and os.path.splitext(content)[1].lower() in (".png", ".jpg", ".jpeg"):
                 content = {"type": "image", "path": content}
             elif isinstance(content, str):
-                content = italics_to_bold(content)
+                content = chat_render.format_text(content)
             elif isinstance(content, dict) and content.get("type") == "image":
                 pass
 
@@ -269,7 +335,7 @@ def build_chat_ui(demo=None):
 
         return cleaned
 
-    def send_message(message, chatbot_history, current_chat_name):
+    async def send_message(message, chatbot_history, current_chat_name, profile=None):
         logging.debug("SENDING MESSAGE")
         chatbot_history = clean_chat_history(chatbot_history)
 
@@ -287,119 +353,166 @@ def build_chat_ui(demo=None):
 
         chatbot_history.append({"role": "user", "content": message})
 
-        metadata = chat_backend.get_metadata(current_chat_name)
+        metadata = await asyncio.to_thread(chat_backend.get_metadata, current_chat_name)
         system_prompt = metadata.get("system_prompt", "")
 
-        chat_data = {
-            "history": chatbot_history,
-            "system_prompt": system_prompt
-        }
+        # Only this turn is saved, appended to whatever the chat holds by then: another tab or
+        # server process may have added turns since this one loaded its history
+        chat_header = {"system_prompt": system_prompt}
+
+        display_history = chatbot_history + [{"role": "assistant", "content": "Writing..."}]
+        # The history before the reply does not change while streaming: render it once
+        rendered_prefix = history_dicts_to_chatbot(chatbot_history)
 
-        display_history = chatbot_history + [{"role": "assistant", "content": "Writing."}]
-        yield history_dicts_to_chatbot(display_history), ""
+        def render_frame():
+            return chat_render.render_with_tail(rendered_prefix, "assistant", display_history[-1]["content"], formatted=True)
 
-        if message:
-            for placeholder in ["Writing", "Writing.", "Writing..", "Writing..."]:
-                display_history[-1]["content"] = placeholder
-                yield history_dicts_to_chatbot(display_history), ""
-                time.sleep(0.12)
+        yield render_frame(), ""
 
         if "show me" in str(message).lower():
             img_path = "assets\\Paty_20250916_010533.png"
             final_history = chatbot_history + [{"role": "assistant", "content": {"type": "image", "path": img_path}}]
-            chat_data["history"] = final_history
-            chat_backend.save_chat(current_chat_name, chat_data)
+            chat_backend.append_messages_later(current_chat_name, final_history[-2:], chat_header)
             yield history_dicts_to_chatbot(final_history), ""
             return
 
-        backend_gen_fn = chat_backend.make_chat_fn(
+        # The prompt is built from the chat as stored, not from the rendered messages on screen,
+        # so it is byte for byte the prefix warmed when the chat was opened or the last reply came in
+        stored_history, stored_start = await asyncio.to_thread(chat_backend.load_history_window, current_chat_name)
+        prompt_history = stored_history + [{"role": "user", "content": message}]
+
+        backend_gen_fn = chat_backend.make_async_stream_fn(
             system_prompt,
-            chatbot_history
+            current_chat_name,
+            profile
         )
-
-        output_queue = Queue()
-        stop_token = object()
-
-        def backend_worker():
-            try:
-                gen = backend_gen_fn(chatbot_history)
-                for partial_history in gen:
-                    output_queue.put(partial_history)
-            except Exception as ex:
-                output_queue.put(("error", ex))
-            finally:
-                output_queue.put(stop_token)
-
-        threading.Thread(target=backend_worker, daemon=True).start()
+        stream = backend_gen_fn(prompt_history, stored_start)
 
         placeholders = ["Writing", "Writing.", "Writing..", "Writing..."]
         placeholder_index = 0
-        final_history = chatbot_history
-        last_word_count = 0
-        running = True
-
-        while running:
-            try:
-                item = output_queue.get(timeout=0.2)
-            except Empty:
-                display_history[-1]["content"] = placeholders[placeholder_index]
-                placeholder_index = (placeholder_index + 1) % len(placeholders)
-                yield history_dicts_to_chatbot(display_history), ""
-                continue
+        reply_parts = []
+        # Markup is formatted as the reply arrives; only the undecided tail is re-rendered per frame
+        formatter = StreamingFormatter()
+        formatted_parts = []
+        scheduler = render_scheduler.FrameScheduler()
+        got_text = False
+        error = None
+        next_item = asyncio.ensure_future(stream.__anext__())
+
+        try:
+            while True:
+                # Wake up for the next chunk, a pending coalesced frame, or the placeholder animation
+                timeout = scheduler.time_until_ready() if scheduler.dirty else 0.2
+                done, _ = await asyncio.wait({next_item}, timeout=timeout)
+                if not done:
+                    if scheduler.ready():
+                        display_history[-1]["content"] = "".join(formatted_parts) + formatter.preview()
+                        yield render_frame(), ""
+                    elif not got_text:
+                        display_history[-1]["content"] = placeholders[placeholder_index]
+                        placeholder_index = (placeholder_index + 1) % len(placeholders)
+                        yield render_frame(), ""
+                    continue
 
-            if item is stop_token:
-                running = False
-                continue
+                try:
+                    delta = next_item.result()
+                except StopAsyncIteration:
+                    break
+                next_item = asyncio.ensure_future(stream.__anext__())
 
-            if isinstance(item, tuple) and item[0] == "error":
-                raise item[1]
-
-            final_history = item
-            assistant_text = ""
-            if final_history and final_history[-1].get("role") == "assistant":
-                assistant_text = final_history[-1].get("content", "")
-
-            words = assistant_text.split()
-            if words:
-                for next_word_count in range(last_word_count + 1, len(words) + 1):
-                    typing_text = " ".join(words[:next_word_count])
-                    display_history[-1]["content"] = typing_text
-                    yield history_dicts_to_chatbot(display_history), ""
-                    time.sleep(0.03)
-                last_word_count = len(words)
-            else:
-                display_history[-1]["content"] = assistant_text
-                yield history_dicts_to_chatbot(display_history), ""
+                if delta.done:
+                    logging.debug(f"Reply stats: {delta.stats}")
+                    error = (delta.stats or {}).get("error")
+                if not delta.text:
+                    continue
+
+                # Only the new text is kept; the full reply is joined when a frame goes out
+                got_text = True
+                reply_parts.append(delta.text)
+                formatted_parts.append(formatter.feed(delta.text))
+                scheduler.mark_dirty()
+                if scheduler.ready():
+                    display_history[-1]["content"] = "".join(formatted_parts) + formatter.preview()
+                    yield render_frame(), ""
+        finally:
+            if not next_item.done():
+                next_item.cancel()
+
+        if not reply_parts and error:
+            # Nothing is saved: the message goes back into the box so it can be sent again
+            gr.Warning(f"⚠️ No reply from Ollama: {error}")
+            yield history_dicts_to_chatbot(chatbot_history[:-1]), message
+            return
+
+        final_history = prompt_history + [{"role": "assistant", "content": "".join(reply_parts)}]
+        # Saved in the background, so the final frame does not wait for the disk
+        chat_backend.append_messages_later(current_chat_name, final_history[-2:], chat_header)
+        yield rendered_prefix + [chat_render.render_message("assistant", final_history[-1]["content"])], ""
 
-        chat_data["history"] = final_history
-        chat_backend.save_chat(current_chat_name, chat_data)
-        yield history_dicts_to_chatbot(final_history), ""
+        # The reply is on screen, now fold old turns into the summary and warm the prompt for the next one
+        chat_backend.schedule_summary_refresh(current_chat_name, system_prompt, final_history, profile, stored_start)
 
     # --- Wiring ---
-    create_char_btn.click(create_character, [char_name_input, system_prompt_input], [chat_list, character_image])
+    create_char_btn.click(
+        create_character,
+        [char_name_input, system_prompt_input, response_profile],
+        [chat_list, character_image, image_job, image_timer, image_status]
+    )
+    image_timer.tick(
+        poll_image_job,
+        [image_job, current_chat],
+        [character_image, chatbot, image_timer, image_status],
+        show_progress="hidden"
+    )
+    cancel_image_btn.click(cancel_image_job, [image_job], [image_status])
     chat_list.change(
         switch_chat,
-        [chat_list],
-        [chatbot, current_chat, system_prompt_display, character_image],
+        [chat_list, response_profile],
+        [chatbot, current_chat, system_prompt_display, character_image, history_start, load_earlier_btn],
         scroll_to_output=True,
         show_progress="hidden"
     )
+    load_earlier_btn.click(
+        load_earlier,
+        [chatbot, current_chat, history_start],
+        [chatbot, history_start, load_earlier_btn],
+        show_progress="hidden"
+    )
     update_prompt_btn.click(update_system_prompt, [system_prompt_display, current_chat], [system_prompt_display])
     msg_box.submit(
         send_message,
-        inputs=[msg_box, chatbot, current_chat],
+        inputs=[msg_box, chatbot, current_chat, response_profile],
         outputs=[chatbot, msg_box],
         scroll_to_output=True,
         show_progress="hidden"
     )
     remove_button.click(remove_character, inputs=[chat_list], outputs=[chat_list])
 
-    apply_button.click(settings.apply_settings, inputs=[image_style, response_type])
+    apply_button.click(settings.apply_settings, inputs=[image_style, response_type], outputs=[response_profile])
 
     if demo is not None:
         def initial_load():
-            return history_dicts_to_chatbot(chat_data.get("history", []))
-        demo.load(initial_load, outputs=[chatbot], scroll_to_output=True, show_progress="hidden")
+            # The UI is built once per process, so every page load reads the last chat again:
+            # it may have changed since, also in another server worker (see workers.py)
+            name, session_history, session_start, session_prompt, session_avatar, names = load_session()
+            return (
+                gr.update(
+                    value=history_dicts_to_chatbot(session_history),
+                    avatar_images=chatbot_avatars(session_avatar)
+                ),
+                gr.update(choices=names, value=name),
+                name,
+                gr.update(value=session_prompt),
+                gr.update(value=thumbnails.thumbnail_for(session_avatar, "sidebar")),
+                session_start,
+                gr.update(visible=session_start > 0),
+            )
+        demo.load(
+            initial_load,
+            outputs=[chatbot, chat_list, current_chat, system_prompt_display, character_image, history_start, load_earlier_btn],
+            scroll_to_output=True,
+            show_progress="hidden"
+        )
 
     return (
         chat_list, chatbot, msg_box, current_chat,
@@ -0,0 +1,180 @@
+"""
+Multi-worker serving mode.
+
+A single Gradio process runs every chat stream, JSON save and markup render
+on one interpreter, and demo.queue() runs each event one call at a time.
+With WEB_WORKERS=N (N > 1) main.py starts N worker processes instead, each
+serving the same app on 127.0.0.1 at WEB_WORKER_BASE_PORT + i, with a small
+reverse proxy in front on the public address:
+
+- sessions are sticky: the first response sets a chat_worker cookie and
+  every later request with it goes to the same worker, because a session's
+  gr.State (current chat, image job, response profile) lives in that
+  worker's memory. New sessions go to the worker with the fewest open
+  requests;
+- responses are streamed through as they arrive, so the queue's
+  server-sent events are not buffered;
+- what sessions share lives on disk and is process-safe: chat files and
+  the index are written under file_lock, last_chat.json is replaced
+  atomically and read again on every page load, and cached metadata is
+  re-checked every CHAT_CACHE_CHECK_INTERVAL seconds;
+- a worker that exits is started again.
+
+SO_REUSEPORT was not used: the kernel spreads connections by address, not
+by session, so a session's requests could land on a worker without its state.
+"""
+import itertools
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+
+WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+SERVER_NAME = os.environ.get("WEB_SERVER_NAME", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("WEB_SERVER_PORT", "7860"))
+WORKER_BASE_PORT = int(os.environ.get("WEB_WORKER_BASE_PORT", str(SERVER_PORT + 1)))
+# Set by serve() in each worker; 0 in single-process mode
+WORKER_INDEX = int(os.environ.get("WEB_WORKER_INDEX", "0"))
+STARTUP_TIMEOUT = float(os.environ.get("WEB_WORKER_STARTUP_TIMEOUT", "120"))
+
+COOKIE = "chat_worker"
+# Headers that belong to one connection and are not forwarded
+HOP_HEADERS = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"transfer-encoding", b"upgrade",
+}
+
+
+def sticky_worker(cookie, count):
+    """Worker index from the session cookie, or None for a new (or unknown) session."""
+    if cookie is None or not cookie.isdigit():
+        return None
+    index = int(cookie)
+    return index if index < count else None
+
+
+def build_proxy(ports):
+    """Starlette app forwarding every request to the worker of its session."""
+    import httpx
+    from starlette.applications import Starlette
+    from starlette.responses import Response, StreamingResponse
+    from starlette.routing import Route
+
+    open_requests = [0] * len(ports)
+    new_sessions = itertools.count()
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(None, connect=5.0),
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=64),
+    )
+
+    async def forward(request):
+        worker = sticky_worker(request.cookies.get(COOKIE), len(ports))
+        new_session = worker is None
+        if new_session:
+            # Fewest open requests; ties go round-robin so sessions opened one by one still spread
+            start = next(new_sessions)
+            worker = min(range(len(ports)), key=lambda i: (open_requests[i], (i - start) % len(ports)))
+
+        headers = [(k, v) for k, v in request.headers.raw if k not in HOP_HEADERS and k != b"content-length"]
+        headers.append((b"x-forwarded-for", (request.client.host if request.client else "").encode("latin-1")))
+        upstream_request = client.build_request(
+            request.method,
+            httpx.URL(f"http://127.0.0.1:{ports[worker]}{request.url.path}", query=request.url.query.encode("latin-1")),
+            headers=headers,
+            content=await request.body(),
+        )
+        open_requests[worker] += 1
+        try:
+            upstream = await client.send(upstream_request, stream=True)
+        except httpx.HTTPError as ex:
+            open_requests[worker] -= 1
+            logging.warning("Worker %d (port %d) unavailable: %s", worker, ports[worker], ex)
+            return Response("Worker unavailable", status_code=502)
+
+        async def body():
+            try:
+                async for chunk in upstream.aiter_raw():
+                    yield chunk
+            finally:
+                open_requests[worker] -= 1
+                await upstream.aclose()
+
+        response = StreamingResponse(body(), status_code=upstream.status_code)
+        response.raw_headers = [(k, v) for k, v in upstream.headers.raw if k.lower() not in HOP_HEADERS]
+        if new_session:
+            response.raw_headers.append((b"set-cookie", f"{COOKIE}={worker}; Path=/; SameSite=Lax; HttpOnly".encode("latin-1")))
+        return response
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await client.aclose()
+
+    methods = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+    return Starlette(
+        routes=[Route("/{path:path}", forward, methods=methods)],
+        lifespan=lifespan,
+    )
+
+
+def _start_worker(script, index, port):
+    env = dict(
+        os.environ,
+        WEB_WORKERS="1",
+        WEB_WORKER_INDEX=str(index),
+        WEB_SERVER_NAME="127.0.0.1",
+        WEB_SERVER_PORT=str(port),
+    )
+    return subprocess.Popen([sys.executable, script], env=env)
+
+
+def _wait_until_listening(port, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Worker on port {port} exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Worker on port {port} did not start within {timeout:.0f}s")
+
+
+def _supervise(script, ports, processes, stopping):
+    while not stopping.wait(1.0):
+        for index, process in enumerate(processes):
+            if process.poll() is not None:
+                logging.critical("Worker %d exited with code %s, starting it again", index, process.returncode)
+                processes[index] = _start_worker(script, index, ports[index])
+
+
+def serve(script, workers=None, server_name=None, server_port=None):
+    """Run script (main.py) as N workers behind the sticky proxy until interrupted."""
+    import uvicorn
+
+    workers = workers or WORKERS
+    server_name = server_name or SERVER_NAME
+    server_port = server_port or SERVER_PORT
+    ports = [WORKER_BASE_PORT + i for i in range(workers)]
+    processes = [_start_worker(script, i, port) for i, port in enumerate(ports)]
+    stopping = threading.Event()
+    try:
+        for port, process in zip(ports, processes):
+            _wait_until_listening(port, process, STARTUP_TIMEOUT)
+        threading.Thread(target=_supervise, args=(script, ports, processes, stopping), daemon=True).start()
+        logging.warning("Serving %d workers (ports %d-%d) on http://%s:%d", workers, ports[0], ports[-1], server_name, server_port)
+        uvicorn.run(build_proxy(ports), host=server_name, port=server_port, log_level="warning")
+    finally:
+        stopping.set()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
@@ -0,0 +1,177 @@
+"""
+Write-behind queue for chat persistence.
+
+Saving a reply used to happen before the reply's last frame was sent, so
+every turn waited for the disk. Writes are now handed to one background
+writer instead:
+
+- writes are keyed (e.g. per character); a write submitted while an older
+  one for the same key is still waiting replaces it, so a burst of saves
+  becomes one write of the latest state;
+- one writer runs them in submission order, so writes for a key never
+  overlap or overtake each other;
+- readers call wait(key) first, which returns at once unless a write for
+  that key is pending, so they never see older data than they saved;
+- CHAT_FSYNC picks durability: "off" leaves flushing to the OS, "batch"
+  (default) fsyncs the written files at most every CHAT_FSYNC_INTERVAL
+  seconds, "always" after every write;
+- flush() drains the queue and is registered with atexit.
+
+CHAT_WRITE_BEHIND=0 runs every write inline, as before.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ENABLED = os.environ.get("CHAT_WRITE_BEHIND", "1") == "1"
+FSYNC = os.environ.get("CHAT_FSYNC", "batch")
+FSYNC_INTERVAL = float(os.environ.get("CHAT_FSYNC_INTERVAL", "1"))
+
+_cond = threading.Condition()
+# key -> write function, oldest first; only the latest function per key is kept
+_pending = OrderedDict()
+_active = set()
+# Files written since the last fsync
+_dirty = set()
+_last_sync = 0.0
+_sync_lock = threading.Lock()
+_thread = None
+_stats = {"submitted": 0, "coalesced": 0, "writes": 0, "errors": 0, "fsyncs": 0}
+
+
+def submit(key, write):
+    """Run write() in the background, replacing a write for key that has not started yet."""
+    if not ENABLED:
+        write()
+        return
+    global _thread
+    with _cond:
+        _stats["submitted"] += 1
+        if key in _pending:
+            _stats["coalesced"] += 1
+        _pending[key] = write
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="write-behind", daemon=True)
+            _thread.start()
+        _cond.notify_all()
+
+
+def wait(key, timeout=None):
+    """Block until no write for key is pending or running. Returns False on timeout."""
+    if threading.current_thread() is _thread:
+        return True
+    with _cond:
+        return _cond.wait_for(lambda: key not in _pending and key not in _active, timeout)
+
+
+def flush(timeout=None):
+    """Wait for every queued write, then fsync what was written (unless CHAT_FSYNC=off)."""
+    with _cond:
+        drained = _cond.wait_for(lambda: not _pending and not _active, timeout)
+    _sync()
+    return drained
+
+
+def mark_dirty(path):
+    """Record a file a write touched, for the next fsync."""
+    if FSYNC == "off":
+        return
+    with _cond:
+        _dirty.add(path)
+        _cond.notify_all()
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """Write data as JSON to a temp file and rename it over path."""
+    # Per process and thread, so concurrent writers of the same file never share a temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **dump_kwargs)
+    os.replace(tmp_path, path)
+    mark_dirty(path)
+
+
+def _fsync(path, directory=False):
+    if directory and os.name == "nt":
+        # Windows cannot open a directory to fsync it
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY if directory else os.O_RDWR)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sync():
+    global _last_sync
+    # Held for the whole batch, so flush() returns only after an fsync the writer started is done
+    with _sync_lock:
+        with _cond:
+            paths = list(_dirty)
+            _dirty.clear()
+            _last_sync = time.monotonic()
+        if not paths:
+            return
+        # Directories too, so renames are durable
+        directories = {os.path.dirname(path) or "." for path in paths}
+        for path, directory in [(path, False) for path in paths] + [(path, True) for path in directories]:
+            try:
+                _fsync(path, directory)
+            except OSError as ex:
+                logging.debug("fsync failed for %s: %s", path, ex)
+        with _cond:
+            _stats["fsyncs"] += 1
+
+
+def _sync_due_in():
+    if FSYNC != "batch" or not _dirty:
+        return None
+    return _last_sync + FSYNC_INTERVAL - time.monotonic()
+
+
+def _run():
+    while True:
+        with _cond:
+            while not _pending:
+                due_in = _sync_due_in()
+                if due_in is not None and due_in <= 0:
+                    break
+                _cond.wait(due_in)
+            key = write = None
+            if _pending:
+                key, write = _pending.popitem(last=False)
+                _active.add(key)
+
+        if write is None:
+            _sync()
+            continue
+        try:
+            write()
+        except Exception as ex:
+            logging.critical("Background write for %s failed", key, exc_info=ex)
+            with _cond:
+                _stats["errors"] += 1
+        finally:
+            with _cond:
+                _active.discard(key)
+                _stats["writes"] += 1
+                _cond.notify_all()
+        # Under steady load the queue never drains, so batches are also synced between writes
+        due_in = _sync_due_in()
+        if FSYNC == "always" or (due_in is not None and due_in <= 0):
+            _sync()
+
+
+def stats():
+    with _cond:
+        return dict(_stats, pending=len(_pending) + len(_active), dirty=len(_dirty))
+
+
+atexit.register(flush)